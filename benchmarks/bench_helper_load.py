@@ -0,0 +1,236 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Load test of the helper RPC
+
+Many concurrent clients send a mix of pings, fire and forget runs
+and runs waiting for the output. Latency percentiles of each kind
+of request and overall throughput are reported.
+
+Helper runs in this process so its resources can be inspected:
+resident memory is sampled after every round and the growth after
+the first (warm-up) round is reported, running tasks and open file
+descriptors are compared before the load and after the clients
+disconnect. The run fails if any tasks or descriptors were leaked.
+
+Run with: python -O -m benchmarks.bench_helper_load
+"""
+
+from argparse import ArgumentParser
+from array import array
+from asyncio import all_tasks, current_task, gather
+from asyncio import run as async_run
+from asyncio import sleep
+from os import listdir
+from pathlib import Path
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Tuple
+
+from bubblejail.bubblejail_helper import BubblejailHelper, RpcFraming
+from bubblejail.bubblejail_helper_client import HelperClient
+
+REQUEST_KINDS = ('ping', 'run', 'run wait')
+
+PERCENTILES = (50, 90, 99)
+
+
+class LoadResult(NamedTuple):
+    latencies: Dict[str, List[float]]
+    requests_total: int
+    seconds: float
+    rss_kib: List[int]
+    leaked_tasks: int
+    leaked_fds: int
+
+
+def count_open_fds() -> int:
+    return len(listdir('/proc/self/fd'))
+
+
+def count_tasks() -> int:
+    return len(all_tasks() - {current_task()})
+
+
+def read_rss_kib() -> int:
+    with open('/proc/self/status') as status_file:
+        for line in status_file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+    raise RuntimeError('No VmRSS in /proc/self/status')
+
+
+def percentile(sorted_values: List[float], percent: int) -> float:
+    index = round(percent / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def request_kind(request_number: int) -> str:
+    return REQUEST_KINDS[request_number % len(REQUEST_KINDS)]
+
+
+async def client_load(
+        client: HelperClient,
+        requests_number: int,
+        latencies: 'array[float]',
+        offset: int) -> None:
+    for request_number in range(requests_number):
+        start_time = perf_counter()
+        if request_kind(request_number) == 'ping':
+            await client.ping(timeout=None)
+        elif request_kind(request_number) == 'run':
+            # Only the time to send is measured as there is no response
+            await client.run(['/bin/true'])
+        else:
+            output = await client.run(
+                ['/bin/echo', str(request_number)], wait_response=True)
+            if output != f"{request_number}\n":
+                raise RuntimeError('Wrong output', output)
+
+        latencies[offset + request_number] = perf_counter() - start_time
+
+
+async def wait_settled(helper: BubblejailHelper, tasks_number: int) -> None:
+    # Fire and forget commands can outlive their requests
+    # and handlers of closed connections finish on their own
+    for _ in range(500):
+        if not helper.reaper.commands and count_tasks() <= tasks_number:
+            return
+
+        await sleep(0.01)
+
+
+async def run_load(
+        helper: BubblejailHelper,
+        helper_socket_path: Path,
+        clients_number: int,
+        requests_number: int,
+        rounds: int,
+        framing: RpcFraming) -> LoadResult:
+    # Preallocated so that the load itself does not grow RSS
+    latencies = array('d', bytes(
+        8 * clients_number * requests_number * rounds))
+    rss_kib: List[int] = []
+
+    tasks_before = count_tasks()
+    fds_before = count_open_fds()
+
+    clients = [HelperClient(helper_socket_path, framing=framing)
+               for _ in range(clients_number)]
+    await gather(*(x.connect() for x in clients))
+    # Reader tasks of clients are expected to be running
+    clients_tasks = count_tasks()
+
+    start_time = perf_counter()
+    for round_number in range(rounds):
+        await gather(*(
+            client_load(
+                client, requests_number, latencies,
+                (round_number * clients_number + client_number)
+                * requests_number,
+            )
+            for client_number, client in enumerate(clients)))
+        await wait_settled(helper, clients_tasks)
+        rss_kib.append(read_rss_kib())
+
+    seconds = perf_counter() - start_time
+
+    await gather(*(x.close() for x in clients))
+    await wait_settled(helper, tasks_before)
+
+    kind_latencies: Dict[str, List[float]] = {x: [] for x in REQUEST_KINDS}
+    for index, latency in enumerate(latencies):
+        kind_latencies[request_kind(index % requests_number)].append(latency)
+
+    return LoadResult(
+        latencies=kind_latencies,
+        requests_total=len(latencies),
+        seconds=seconds,
+        rss_kib=rss_kib,
+        leaked_tasks=count_tasks() - tasks_before,
+        leaked_fds=count_open_fds() - fds_before,
+    )
+
+
+def print_result(framing: str, result: LoadResult) -> None:
+    print(f"{framing} framing: {result.requests_total} requests "
+          f"{result.requests_total / result.seconds:.1f} requests/s")
+
+    for kind_name, kind_latencies in result.latencies.items():
+        sorted_latencies = sorted(kind_latencies)
+        percentiles = '   '.join(
+            f"p{x} {percentile(sorted_latencies, x) * 1000:>7.2f}"
+            for x in PERCENTILES)
+        print(f"  {kind_name:<9} {percentiles}   "
+              f"max {sorted_latencies[-1] * 1000:>7.2f} ms")
+
+    print(f"  RSS after rounds (KiB): {result.rss_kib}   "
+          f"growth after warm-up {result.rss_kib[-1] - result.rss_kib[0]} KiB")
+    print(f"  leaked tasks {result.leaked_tasks}   "
+          f"leaked fds {result.leaked_fds}")
+
+
+def bench_helper_load_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=300,
+                        help='Requests sent by each client in a round')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='First round is a warm-up for RSS growth')
+    parser.add_argument('--framing', choices=('line', 'binary', 'both'),
+                        default='both')
+    args = parser.parse_args()
+
+    framings: Tuple[RpcFraming, ...] = (
+        ('line', 'binary') if args.framing == 'both' else (args.framing, ))
+
+    async def run_benchmarks() -> List[Tuple[str, LoadResult]]:
+        results: List[Tuple[str, LoadResult]] = []
+        with TemporaryDirectory() as tempdir:
+            helper_socket_path = Path(tempdir) / 'helper.socket'
+            helper = BubblejailHelper(
+                startup_args=[],
+                helper_socket_path=helper_socket_path,
+                no_child_timeout=None,
+                use_fixups=False,
+                linger_timeout=3600,
+            )
+            await helper.start_async()
+
+            try:
+                for framing in framings:
+                    results.append((framing, await run_load(
+                        helper, helper_socket_path,
+                        args.clients, args.requests,
+                        args.rounds, framing)))
+            finally:
+                await helper.stop_async()
+
+        return results
+
+    results = async_run(run_benchmarks())
+
+    for framing, result in results:
+        print_result(framing, result)
+
+    if any(x.leaked_tasks or x.leaked_fds for _, x in results):
+        print('Helper leaked tasks or file descriptors')
+        sys_exit(1)
+
+
+if __name__ == '__main__':
+    bench_helper_load_main()
@@ -0,0 +1,149 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Import time and memory of entry points
+
+Every entry point is imported in a fresh interpreter and the best
+cumulative import time reported by 'python -X importtime' is compared
+to its budget. Modules imported before the entry point, such as
+asyncio for the helper, are not counted. Modules are byte compiled
+first as installed ones are.
+
+Exits with non-zero status if a budget is exceeded.
+
+Run with: python -m benchmarks.bench_imports
+"""
+
+from argparse import ArgumentParser
+from importlib.util import find_spec
+from os import environ
+from pathlib import Path
+from subprocess import run
+from sys import executable
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class EntryPoint(NamedTuple):
+    name: str
+    module: str
+    # Imported beforehand and not counted
+    preload: Tuple[str, ...]
+    # Microseconds
+    time_budget: int
+
+
+ENTRY_POINTS = (
+    # Helper is started in every sandbox before it can bind socket.
+    # About 8 ms on development machine.
+    EntryPoint('helper', 'bubblejail.bubblejail_helper', ('asyncio', ),
+               20_000),
+    # Every bubblejail command and shell completion imports the CLI.
+    # About 22 ms on development machine, was 86 ms.
+    EntryPoint('cli', 'bubblejail.bubblejail_cli', (), 45_000),
+    # Window should show up before instance is selected
+    EntryPoint('gui', 'bubblejail.bubblejail_gui_qt', ('PyQt5.QtWidgets', ),
+               45_000),
+)
+
+# KiB of resident memory added by helper import after asyncio
+# was imported. About 1 MiB on development machine.
+HELPER_RSS_BUDGET = 1280
+
+
+def run_python(code: str, env: Dict[str, str], *python_args: str) -> str:
+    """Returns standard error"""
+    return run(
+        (executable, *python_args, '-c', code),
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+
+
+def measure_import_time(entry_point: EntryPoint, env: Dict[str, str],
+                        repeat: int) -> int:
+    """Returns best cumulative import time in microseconds"""
+    code = ''.join(f"import {x}\n"
+                   for x in (*entry_point.preload, entry_point.module))
+    run_python(code, env)
+
+    import_times: List[int] = []
+    for _ in range(repeat):
+        for import_line in run_python(
+                code, env, '-X', 'importtime').splitlines()[1:]:
+            _, cumulative_time, imported_name = import_line.split('|')
+            if imported_name.strip() == entry_point.module:
+                import_times.append(int(cumulative_time))
+
+    return min(import_times)
+
+
+def measure_helper_rss(env: Dict[str, str]) -> int:
+    """Returns KiB of resident memory added by helper import"""
+    return int(run_python(
+        'from resource import getrusage, RUSAGE_SELF\n'
+        'import asyncio\n'
+        'before = getrusage(RUSAGE_SELF).ru_maxrss\n'
+        'import bubblejail.bubblejail_helper\n'
+        'after = getrusage(RUSAGE_SELF).ru_maxrss\n'
+        'from sys import stderr\n'
+        'print(after - before, file=stderr)\n',
+        env,
+    ))
+
+
+def bench_imports_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Best of the runs is reported')
+    args = parser.parse_args()
+
+    is_over_budget = False
+    with TemporaryDirectory() as tempdir:
+        env = environ.copy()
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        env['PYTHONPYCACHEPREFIX'] = str(Path(tempdir) / 'pycache')
+        env['PYTHONPATH'] = str(Path(__file__).parent.parent)
+
+        for entry_point in ENTRY_POINTS:
+            if any(find_spec(x.split('.')[0]) is None
+                   for x in entry_point.preload):
+                print(f"{entry_point.name:<8} skipped, "
+                      f"{', '.join(entry_point.preload)} is not installed")
+                continue
+
+            import_time = measure_import_time(entry_point, env, args.repeat)
+            is_over = import_time > entry_point.time_budget
+            is_over_budget |= is_over
+            print(f"{entry_point.name:<8} import {import_time / 1000:>8.1f} ms"
+                  f" (budget {entry_point.time_budget / 1000:.0f} ms)"
+                  f"{' OVER BUDGET' if is_over else ''}")
+
+        helper_rss = measure_helper_rss(env)
+        is_over = helper_rss > HELPER_RSS_BUDGET
+        is_over_budget |= is_over
+        print(f"{'helper':<8} rss    {helper_rss:>8} KiB"
+              f" (budget {HELPER_RSS_BUDGET} KiB)"
+              f"{' OVER BUDGET' if is_over else ''}")
+
+    if is_over_budget:
+        sys_exit(1)
+
+
+if __name__ == '__main__':
+    bench_imports_main()
@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""End-to-end launch latency with stand-in bwrap and xdg-dbus-proxy
+
+Drives BubblejailInstance.async_run_init against the stub bwrap
+(benchmarks/stub_bwrap.py) which runs the real helper without
+namespaces, so it works on machines without user namespaces.
+Timestamps are taken from the --trace of every launch.
+
+Run with: python -O -m benchmarks.bench_launch
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from asyncio import create_task
+from asyncio import run as async_run
+from asyncio import sleep
+from json import loads as json_loads
+from os import environ, getpid, kill, pathsep
+from pathlib import Path
+from signal import SIGTERM
+from statistics import quantiles
+from sys import executable, modules
+from tempfile import TemporaryDirectory
+from time import monotonic_ns
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple
+
+from toml import dumps as toml_dumps
+from toml import loads as toml_loads
+
+if TYPE_CHECKING:
+    # Imported after cache directory is redirected
+    from bubblejail.bubblejail_instance import BubblejailInstance
+
+SOURCE_ROOT = Path(__file__).parent.parent
+
+STUB_BWRAP = '''#!/bin/sh
+exec {python} {optimize} -m benchmarks.stub_bwrap "$@"
+'''
+
+STUB_DBUS_PROXY = '''#!/bin/sh
+exec sleep infinity
+'''
+
+
+class LaunchTimes(NamedTuple):
+    # Nanoseconds since async_run_init was called
+    helper_ready: int
+    app_exec: int
+
+
+def write_executable(path: Path, text: str) -> None:
+    path.write_text(text)
+    path.chmod(0o755)
+
+
+def find_event_end(trace_events: List[Dict[str, Any]], name: str) -> int:
+    """Returns end of the first span with name in nanoseconds"""
+    for event in trace_events:
+        if event['name'] == name and event['ph'] == 'X':
+            return int((event['ts'] + event['dur']) * 1000)
+
+    raise ValueError('Span not found in trace', name)
+
+
+async def measure_launch(
+    instance: BubblejailInstance,
+    temp_path: Path,
+    use_launch_plan_cache: bool,
+) -> LaunchTimes:
+    app_started_path = temp_path / 'app_started'
+    trace_path = temp_path / 'trace.json'
+
+    start_time = monotonic_ns()
+    run_task = create_task(instance.async_run_init(
+        args_to_run=[
+            '/bin/sh', '-c', f": > {app_started_path}; exec sleep infinity"],
+        use_launch_plan_cache=use_launch_plan_cache,
+        trace_path=trace_path,
+    ))
+
+    while not app_started_path.exists():
+        if run_task.done():
+            # Raise exception from the launch
+            run_task.result()
+            raise RuntimeError('Instance exited before starting app')
+
+        await sleep(0.001)
+
+    # Handled by bubblejail the same way as on user logout
+    kill(getpid(), SIGTERM)
+    await run_task
+    app_started_path.unlink()
+
+    trace_events = json_loads(trace_path.read_text())['traceEvents']
+    return LaunchTimes(
+        helper_ready=find_event_end(trace_events, 'bind socket') - start_time,
+        app_exec=find_event_end(trace_events, 'spawn') - start_time,
+    )
+
+
+def print_percentiles(name: str, nanoseconds: List[int]) -> None:
+    milliseconds = [x / 1e6 for x in nanoseconds]
+    if len(milliseconds) > 1:
+        percentiles = quantiles(milliseconds, n=100, method='inclusive')
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = milliseconds[0]
+
+    print(f"{name:<20} p50 {p50:>8.2f} ms   "
+          f"p95 {p95:>8.2f} ms   p99 {p99:>8.2f} ms")
+
+
+def bench_launch_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--profile', default='generic',
+                        help='Shipped profile used as instance config')
+    parser.add_argument('--no-launch-plan-cache', action='store_true')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tempdir:
+        temp_path = Path(tempdir)
+
+        # Launch plans, parsed configs and seccomp filters are cached.
+        # xdg reads the environment when imported.
+        if 'xdg.BaseDirectory' in modules:
+            raise RuntimeError('Cache directory can not be redirected')
+        environ['XDG_CACHE_HOME'] = str(temp_path / 'cache')
+
+        from bubblejail.bubblejail_instance import BubblejailInstance
+        from bubblejail.bubblejail_utils import BubblejailSettings
+
+        from .bench_plan import (FAKE_HOST_ENVIRON, HOST_DEVICE_SERVICES,
+                                 PROFILES_DIR)
+
+        stubs_dir = temp_path / 'bin'
+        stubs_dir.mkdir()
+        write_executable(
+            stubs_dir / 'bwrap',
+            STUB_BWRAP.format(
+                python=executable,
+                optimize='-O' if not __debug__ else '',
+            ),
+        )
+        write_executable(stubs_dir / 'xdg-dbus-proxy', STUB_DBUS_PROXY)
+        BubblejailSettings.BWRAP_PATH_STR = str(stubs_dir / 'bwrap')
+
+        runtime_dir = temp_path / 'runtime'
+        runtime_dir.mkdir(mode=0o700)
+
+        environ.update(FAKE_HOST_ENVIRON)
+        environ['XDG_RUNTIME_DIR'] = str(runtime_dir)
+        environ['XAUTHORITY'] = str(temp_path / 'Xauthority')
+        environ['PATH'] = str(stubs_dir) + pathsep + environ['PATH']
+        environ['PYTHONPATH'] = str(SOURCE_ROOT)
+
+        instance_dir = temp_path / 'bench_launch'
+        instance_dir.mkdir()
+        services_dict = toml_loads(
+            (PROFILES_DIR / f"{args.profile}.toml").read_text())['services']
+        for service_name in HOST_DEVICE_SERVICES:
+            services_dict.pop(service_name, None)
+
+        instance = BubblejailInstance(instance_dir)
+        instance.path_home_directory.mkdir()
+        instance.path_config_file.write_text(toml_dumps(services_dict))
+
+        async def run_launches() -> List[LaunchTimes]:
+            launch_times = []
+            for run_number in range(args.warmup + args.runs):
+                times = await measure_launch(
+                    instance=instance,
+                    temp_path=temp_path,
+                    use_launch_plan_cache=not args.no_launch_plan_cache,
+                )
+                if run_number >= args.warmup:
+                    launch_times.append(times)
+
+            return launch_times
+
+        launch_times = async_run(run_launches())
+
+    print(f"{args.runs} launches of profile {args.profile}")
+    print_percentiles('helper ready', [x.helper_ready for x in launch_times])
+    print_percentiles('first app exec', [x.app_exec for x in launch_times])
+
+
+if __name__ == '__main__':
+    bench_launch_main()
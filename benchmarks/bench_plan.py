@@ -0,0 +1,359 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Micro-benchmarks of config parsing, service iteration and args generation
+
+Configs are the shipped profiles and synthetic configs with
+thousands of shared paths and hundreds of D-Bus names.
+Host environment (display, D-Bus, runtime directory) is faked
+so the suite runs on a plain Linux box.
+
+Launch plan cache load is measured next to the recompute it replaces.
+Results are compared against the baseline saved with --save-baseline.
+
+Run with: python -m benchmarks.bench_plan
+"""
+
+from argparse import ArgumentParser
+from copy import deepcopy
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import environ
+from pathlib import Path
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+from time import perf_counter_ns
+from tracemalloc import clear_traces, get_traced_memory
+from tracemalloc import start as tracemalloc_start
+from tracemalloc import stop as tracemalloc_stop
+from typing import (Any, Callable, Dict, Iterator, List, NamedTuple, Optional,
+                    Tuple, cast)
+
+from toml import dumps as toml_dumps
+from toml import loads as toml_loads
+from xdg.BaseDirectory import xdg_cache_home
+
+from bubblejail.bubblejail_instance import BubblejailInit, BubblejailInstance
+from bubblejail.bwrap_config import DbusSessionTalkTo
+from bubblejail.launch_plan import LaunchPlan, LaunchPlanCache
+from bubblejail.services import (EMPTY_LIST, BubblejailDefaults,
+                                 BubblejailService, OptionStrList,
+                                 ServiceContainer, ServiceGeneratorType,
+                                 ServicesConfDictType, ServiceWantsHomeBind)
+
+PROFILES_DIR = Path(__file__).parent.parent / 'data/bubblejail/profiles'
+
+# Services that walk host devices which might not exist
+HOST_DEVICE_SERVICES = ('direct_rendering', 'joystick')
+
+SYNTHETIC_SIZES = (
+    # (shared paths, D-Bus names)
+    (100, 10),
+    (1000, 100),
+    (5000, 500),
+)
+
+FAKE_HOST_ENVIRON = {
+    'DISPLAY': ':99',
+    'WAYLAND_DISPLAY': 'wayland-99',
+    'DBUS_SESSION_BUS_ADDRESS': 'unix:path=/nonexistent/bus',
+    'LANG': 'C.UTF-8',
+}
+
+
+class BenchDbusNames(BubblejailService):
+    """Yields arbitrary number of D-Bus names
+
+    None of the real services has a list of names.
+    """
+
+    def __init__(self, names: List[str] = EMPTY_LIST):
+        super().__init__()
+        self.names = OptionStrList(
+            str_list=names,
+            name='names',
+            pretty_name='D-Bus names',
+            description='Names to talk to',
+        )
+        self.add_option(self.names)
+
+    def __iter__(self) -> ServiceGeneratorType:
+        if not self.enabled:
+            return
+
+        for x in self.names.get_value():
+            yield DbusSessionTalkTo(x)
+
+    name = 'bench_dbus'
+    pretty_name = 'Benchmark D-Bus names'
+    description = 'Only used by benchmarks'
+
+
+def create_container(conf_dict: ServicesConfDictType) -> ServiceContainer:
+    container = ServiceContainer()
+    container.services.append(BenchDbusNames())
+    container.set_services(conf_dict)
+    return container
+
+
+class Scenario(NamedTuple):
+    name: str
+    config_contents: str
+
+
+def iter_profile_scenarios() -> Iterator[Scenario]:
+    for profile_path in sorted(PROFILES_DIR.glob('*.toml')):
+        services_dict = toml_loads(profile_path.read_text())['services']
+        for service_name in HOST_DEVICE_SERVICES:
+            services_dict.pop(service_name, None)
+
+        yield Scenario(
+            name=f"profile {profile_path.stem}",
+            config_contents=toml_dumps(services_dict),
+        )
+
+
+def iter_synthetic_scenarios() -> Iterator[Scenario]:
+    for paths_number, names_number in SYNTHETIC_SIZES:
+        services_dict = {
+            'common': {
+                'executable_name': ['/usr/bin/true'],
+                'dbus_name': 'org.example.Bench',
+            },
+            'root_share': {
+                'paths': [f"/srv/rw/{x}" for x in range(paths_number)],
+                'read_only_paths': [
+                    f"/srv/ro/{x}" for x in range(paths_number)],
+            },
+            'home_share': {
+                'home_paths': [f"share/{x}" for x in range(paths_number)],
+            },
+            'bench_dbus': {
+                'names': [f"org.example.Name{x}"
+                          for x in range(names_number)],
+            },
+            'network': {},
+            'notify': {},
+            'gnome_toolkit': {
+                'dconf_dbus': True,
+                'gnome_vfs_dbus': True,
+            },
+        }
+        yield Scenario(
+            name=f"synthetic {paths_number} paths {names_number} names",
+            config_contents=toml_dumps(services_dict),
+        )
+
+
+class BenchInit(BubblejailInit):
+    """Init that does not read services from the instance config file"""
+
+    def __init__(self, parent: BubblejailInstance,
+                 container: ServiceContainer) -> None:
+        super().__init__(parent=parent, config_contents='',
+                         use_launch_plan_cache=False)
+        self.container = container
+
+    def get_launch_plan(self) -> LaunchPlan:
+        return LaunchPlan.from_services(
+            instance_config=self.container,
+            home_bind_path=self.home_bind_path,
+        )
+
+
+class BenchResult(NamedTuple):
+    ops_per_sec: float
+    peak_bytes: int
+
+
+def measure(
+        func: Callable[[Any], object],
+        make_input: Callable[[], Any],
+        min_time_ns: int) -> BenchResult:
+    """Runs function until min_time_ns has been spent in it
+
+    Input is prepared outside of the timed section as some of the
+    functions consume it.
+    """
+    # Warm up and measure peak of allocated memory
+    tracemalloc_start()
+    try:
+        func_input = make_input()
+        clear_traces()
+        func(func_input)
+        _, peak_bytes = get_traced_memory()
+    finally:
+        tracemalloc_stop()
+
+    total_time_ns = 0
+    ops = 0
+    while total_time_ns < min_time_ns:
+        func_input = make_input()
+        start_time = perf_counter_ns()
+        func(func_input)
+        total_time_ns += perf_counter_ns() - start_time
+        ops += 1
+
+    return BenchResult(
+        ops_per_sec=ops / total_time_ns * 1e9,
+        peak_bytes=peak_bytes,
+    )
+
+
+def iter_benchmarks(
+    scenario: Scenario,
+    instance: BubblejailInstance,
+    cache_dir: Path,
+) -> Iterator[Tuple[str, Callable[[Any], object], Callable[[], Any]]]:
+    conf_dict = cast(ServicesConfDictType,
+                     toml_loads(scenario.config_contents))
+    container = create_container(deepcopy(conf_dict))
+
+    yield ('toml_loads', toml_loads,
+           lambda: scenario.config_contents)
+    yield ('set_services', create_container,
+           lambda: deepcopy(conf_dict))
+    yield ('from_services', lambda x: LaunchPlan.from_services(
+        instance_config=x,
+        home_bind_path=instance.path_home_directory,
+    ), lambda: container)
+
+    def genetate_args(bubblejail_init: BubblejailInit) -> None:
+        bubblejail_init.genetate_args()
+        for temp_file in bubblejail_init.temp_files:
+            temp_file.close()
+
+    yield ('genetate_args', genetate_args,
+           lambda: BenchInit(instance, container))
+
+    # What the cache hit replaces
+    def recompute_plan(config_contents: str) -> LaunchPlan:
+        return LaunchPlan.from_services(
+            instance_config=create_container(cast(
+                ServicesConfDictType, toml_loads(config_contents))),
+            home_bind_path=instance.path_home_directory,
+        )
+
+    yield ('launch plan recompute', recompute_plan,
+           lambda: scenario.config_contents)
+
+    plan_cache = LaunchPlanCache(
+        instance_name=instance.name,
+        home_bind_path=instance.path_home_directory,
+        config_contents=scenario.config_contents,
+        cache_dir=cache_dir,
+    )
+    plan_cache.store(LaunchPlan.from_services(
+        instance_config=container,
+        home_bind_path=instance.path_home_directory,
+    ))
+    yield ('launch plan cache load', lambda x: x.load(),
+           lambda: plan_cache)
+
+
+def iter_defaults(home_bind_path: Path) -> None:
+    config_iterator = BubblejailDefaults().__iter__()
+    for config in config_iterator:
+        if isinstance(config, ServiceWantsHomeBind):
+            config_iterator.send(home_bind_path)
+
+
+def get_default_baseline_path() -> Path:
+    return Path(xdg_cache_home) / 'bubblejail/benchmarks/bench_plan.json'
+
+
+def bench_plan_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Seconds spent in each benchmark')
+    parser.add_argument('--baseline', type=Path,
+                        default=get_default_baseline_path())
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help='Allowed slowdown relative to baseline')
+    parser.add_argument('--filter', default='',
+                        help='Only run benchmarks containing the string')
+    args = parser.parse_args()
+
+    min_time_ns = int(args.min_time * 1e9)
+
+    baseline: Optional[Dict[str, Dict[str, float]]] = None
+    if not args.save_baseline:
+        try:
+            baseline = json_loads(args.baseline.read_text())
+        except FileNotFoundError:
+            print(f"No baseline at {args.baseline}")
+
+    results: Dict[str, Dict[str, float]] = {}
+    regressions: List[str] = []
+
+    def report(bench_name: str, result: BenchResult) -> None:
+        results[bench_name] = result._asdict()
+        line = (f"{bench_name:<60} {result.ops_per_sec:>12.1f} ops/s "
+                f"{result.peak_bytes / 1024:>10.1f} KiB peak")
+
+        if baseline is not None and bench_name in baseline:
+            baseline_ops = baseline[bench_name]['ops_per_sec']
+            change = result.ops_per_sec / baseline_ops - 1
+            line += f" {change:>+8.1%}"
+            if change < -args.max_regression:
+                regressions.append(bench_name)
+                line += ' REGRESSION'
+
+        print(line)
+
+    with TemporaryDirectory() as tempdir:
+        temp_path = Path(tempdir)
+        runtime_dir = temp_path / 'runtime'
+        runtime_dir.mkdir(mode=0o700)
+        instance_dir = temp_path / 'instance'
+        instance_dir.mkdir()
+
+        environ.update(FAKE_HOST_ENVIRON)
+        environ['XDG_RUNTIME_DIR'] = str(runtime_dir)
+        environ['XAUTHORITY'] = str(temp_path / 'Xauthority')
+
+        instance = BubblejailInstance(instance_dir)
+
+        if args.filter in 'BubblejailDefaults.__iter__':
+            report('BubblejailDefaults.__iter__', measure(
+                iter_defaults,
+                lambda: instance.path_home_directory,
+                min_time_ns,
+            ))
+
+        for scenario in (*iter_profile_scenarios(),
+                         *iter_synthetic_scenarios()):
+            for bench_name, func, make_input in iter_benchmarks(
+                    scenario, instance, temp_path / 'cache'):
+
+                full_name = f"{scenario.name}: {bench_name}"
+                if args.filter not in full_name:
+                    continue
+
+                report(full_name, measure(func, make_input, min_time_ns))
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json_dumps(results, indent=2))
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed")
+        sys_exit(1)
+
+
+if __name__ == '__main__':
+    bench_plan_main()
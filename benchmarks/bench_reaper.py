@@ -0,0 +1,188 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Fork storm against the helper reaper
+
+Helper runs in this process which is made a child subreaper,
+so orphaned processes are reparented to it the same way they are
+reparented to the helper running as PID 1 of the sandbox.
+
+Two storms are run: many short commands requested over the helper
+socket by concurrent clients, and a shell double forking processes
+that become orphans. Zombies are sampled while the storm runs and
+the run fails if any are left once it settles.
+
+Run with: python -O -m benchmarks.bench_reaper
+"""
+
+from argparse import ArgumentParser
+from asyncio import create_task, gather, open_unix_connection
+from asyncio import run as async_run
+from asyncio import sleep
+from ctypes import CDLL, get_errno
+from os import strerror
+from pathlib import Path
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Awaitable, Callable, NamedTuple
+
+from bubblejail.bubblejail_helper import (BubblejailHelper, RequestRun,
+                                          get_children_pids, is_zombie)
+
+PR_SET_CHILD_SUBREAPER = 36
+
+ORPHANS_SCRIPT = '''i=0
+while [ $i -lt {number} ]; do
+    ( /bin/true & )
+    i=$((i+1))
+done
+'''
+
+
+class StormResult(NamedTuple):
+    reaped: int
+    seconds: float
+    peak_zombies: int
+    left_zombies: int
+    history_length: int
+
+
+def set_child_subreaper() -> None:
+    libc = CDLL(None, use_errno=True)
+    if libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) != 0:
+        raise OSError(get_errno(), strerror(get_errno()))
+
+
+def count_zombies() -> int:
+    return sum(1 for pid in get_children_pids() if is_zombie(pid))
+
+
+async def run_storm(
+    helper: BubblejailHelper,
+    storm: Callable[[], Awaitable[None]],
+    expected_reaps: int,
+) -> StormResult:
+    reaped_before = helper.reaper.reaped_total
+    peak_zombies = 0
+
+    async def sample_zombies() -> None:
+        nonlocal peak_zombies
+        while True:
+            peak_zombies = max(peak_zombies, count_zombies())
+            await sleep(0.005)
+
+    sampler_task = create_task(sample_zombies())
+    start_time = perf_counter()
+    await storm()
+    while helper.reaper.reaped_total - reaped_before < expected_reaps:
+        await sleep(0.001)
+
+    seconds = perf_counter() - start_time
+    sampler_task.cancel()
+
+    # Let any late SIGCHLD be handled
+    await sleep(0.1)
+
+    return StormResult(
+        reaped=helper.reaper.reaped_total - reaped_before,
+        seconds=seconds,
+        peak_zombies=peak_zombies,
+        left_zombies=count_zombies(),
+        history_length=len(helper.reaper.exit_history),
+    )
+
+
+def print_result(name: str, result: StormResult) -> None:
+    print(f"{name:<10} {result.reaped:>7} reaped "
+          f"{result.reaped / result.seconds:>10.1f} reaps/s   "
+          f"peak zombies {result.peak_zombies:>5}   "
+          f"left zombies {result.left_zombies:>3}   "
+          f"history {result.history_length:>5}")
+
+
+def bench_reaper_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--commands', type=int, default=2000,
+                        help='Commands requested over helper socket')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--orphans', type=int, default=2000,
+                        help='Orphaned processes created by a shell')
+    parser.add_argument('--history-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    set_child_subreaper()
+
+    async def run_storms() -> int:
+        with TemporaryDirectory() as tempdir:
+            helper_socket_path = Path(tempdir) / 'helper.socket'
+            helper = BubblejailHelper(
+                startup_args=[],
+                helper_socket_path=helper_socket_path,
+                no_child_timeout=None,
+                use_fixups=False,
+                # Keep helper running between storms
+                linger_timeout=3600,
+                exit_history_size=args.history_size,
+            )
+            await helper.start_async()
+
+            async def command_client(commands_number: int) -> None:
+                (_, writer) = await open_unix_connection(
+                    path=helper_socket_path,
+                )
+                for _ in range(commands_number):
+                    writer.write(
+                        RequestRun(['/bin/true']).to_json_byte_line())
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+
+            async def commands_storm() -> None:
+                per_client, remainder = divmod(args.commands, args.clients)
+                await gather(*(
+                    command_client(per_client + (x < remainder))
+                    for x in range(args.clients)))
+
+            async def orphans_storm() -> None:
+                await helper.run_command([
+                    '/bin/sh', '-c',
+                    ORPHANS_SCRIPT.format(number=args.orphans),
+                ])
+
+            try:
+                results = {
+                    'commands': await run_storm(
+                        helper, commands_storm, args.commands),
+                    # Shell itself is reaped too
+                    'orphans': await run_storm(
+                        helper, orphans_storm, args.orphans + 1),
+                }
+            finally:
+                await helper.stop_async()
+
+        for name, result in results.items():
+            print_result(name, result)
+
+        return sum(x.left_zombies for x in results.values())
+
+    left_zombies = async_run(run_storms())
+    if left_zombies:
+        print(f"{left_zombies} zombies were not reaped")
+        sys_exit(1)
+
+
+if __name__ == '__main__':
+    bench_reaper_main()
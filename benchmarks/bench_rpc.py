@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Throughput of the helper RPC with line and binary framing
+
+Measures ping requests per second sent concurrently over a single
+connection and megabytes per second of streamed command output.
+Helper runs in this process.
+
+Run with: python -O -m benchmarks.bench_rpc
+"""
+
+from argparse import ArgumentParser
+from asyncio import gather
+from asyncio import run as async_run
+from asyncio import sleep
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List, Tuple
+
+from bubblejail.bubblejail_helper import BubblejailHelper, RpcFraming
+from bubblejail.bubblejail_helper_client import HelperClient
+
+FRAMINGS: Tuple[RpcFraming, ...] = ('line', 'binary')
+
+# Zeros are the worst case for JSON escaping
+OUTPUT_SOURCES = ('/dev/zero', '/dev/urandom')
+
+
+async def bench_pings(client: HelperClient, requests_number: int,
+                      concurrency: int) -> float:
+    """Returns requests per second"""
+    async def ping_worker(pings_number: int) -> None:
+        for _ in range(pings_number):
+            await client.ping(timeout=None)
+
+    per_worker = requests_number // concurrency
+    start_time = perf_counter()
+    await gather(*(ping_worker(per_worker) for _ in range(concurrency)))
+    return per_worker * concurrency / (perf_counter() - start_time)
+
+
+async def bench_output(client: HelperClient, source: str,
+                       output_size: int) -> float:
+    """Returns megabytes of output per second"""
+    received_size = 0
+
+    def count_output(stream_name: str, data: bytes) -> None:
+        nonlocal received_size
+        received_size += len(data)
+
+    start_time = perf_counter()
+    await client.run_streaming(
+        ['/bin/head', '-c', str(output_size), source],
+        count_output,
+    )
+    seconds = perf_counter() - start_time
+
+    if received_size != output_size:
+        raise RuntimeError('Output was lost', received_size)
+
+    return output_size / 1e6 / seconds
+
+
+def bench_rpc_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='Requests in flight at the same time')
+    parser.add_argument('--output-mb', type=int, default=64,
+                        help='Megabytes of output of streamed command')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Best of the runs is reported')
+    args = parser.parse_args()
+
+    async def run_benchmarks() -> List[Tuple[str, str, float]]:
+        results: List[Tuple[str, str, float]] = []
+        with TemporaryDirectory() as tempdir:
+            helper_socket_path = Path(tempdir) / 'helper.socket'
+            helper = BubblejailHelper(
+                startup_args=[],
+                helper_socket_path=helper_socket_path,
+                no_child_timeout=None,
+                use_fixups=False,
+                linger_timeout=3600,
+                max_concurrent_requests=args.concurrency,
+            )
+            await helper.start_async()
+
+            try:
+                for framing in FRAMINGS:
+                    async with HelperClient(
+                            helper_socket_path, framing=framing) as client:
+
+                        requests_per_sec = max([
+                            await bench_pings(
+                                client, args.requests, args.concurrency)
+                            for _ in range(args.repeat)
+                        ])
+                        results.append(
+                            (framing, 'ping', requests_per_sec))
+
+                        for source in OUTPUT_SOURCES:
+                            megabytes_per_sec = max([
+                                await bench_output(
+                                    client, source, args.output_mb * 10**6)
+                                for _ in range(args.repeat)
+                            ])
+                            results.append(
+                                (framing, f"output {source}",
+                                 megabytes_per_sec))
+
+                # Let helper handle the closed connections
+                await sleep(0.1)
+            finally:
+                await helper.stop_async()
+
+        return results
+
+    results = async_run(run_benchmarks())
+
+    for framing, bench_name, value in results:
+        unit = 'requests/s' if bench_name == 'ping' else 'MB/s'
+        print(f"{framing:<8} {bench_name:<22} {value:>12.1f} {unit}")
+
+
+if __name__ == '__main__':
+    bench_rpc_main()
@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Measures per syscall overhead of seccomp filter layouts
+
+Every measurement runs in a forked child with the filter loaded,
+the same way bwrap loads it in to the sandbox.
+
+Run with: python -m benchmarks.bench_seccomp
+"""
+
+from argparse import ArgumentParser
+from errno import EPERM
+from os import _exit, fork, getppid, pipe, read, waitpid, write
+from struct import pack, unpack
+from time import perf_counter
+from typing import List, Optional, cast
+
+from bubblejail.bubblejail_seccomp import (SCMP_ARCH_NATIVE,
+                                           SECCOMP_OPTIMIZE_BINARY_TREE,
+                                           SECCOMP_OPTIMIZE_PRIORITY,
+                                           SeccompState, get_libseccomp)
+
+# Syscalls that the measuring child needs to function
+ESSENTIAL_SYSCALLS = frozenset((
+    'getppid', 'read', 'write', 'exit', 'exit_group', 'brk', 'mmap',
+    'munmap', 'mremap', 'mprotect', 'madvise', 'futex', 'rt_sigaction',
+    'rt_sigprocmask', 'rt_sigreturn', 'sigaltstack', 'close', 'fstat',
+    'newfstatat', 'lseek', 'ioctl', 'getpid', 'gettid', 'clock_gettime',
+    'gettimeofday', 'getrandom', 'openat', 'prctl', 'seccomp',
+))
+
+RULE_COUNTS = (2, 50, 300)
+
+OPTIMIZE_LEVELS = {
+    'priority': SECCOMP_OPTIMIZE_PRIORITY,
+    'binary_tree': SECCOMP_OPTIMIZE_BINARY_TREE,
+}
+
+
+def get_filterable_syscalls() -> List[str]:
+    libseccomp = get_libseccomp()
+    syscall_names = []
+    for syscall_number in range(512):
+        # ctypes converts char pointer return to bytes
+        syscall_name = cast(
+            Optional[bytes],
+            libseccomp.seccomp_syscall_resolve_num_arch(
+                SCMP_ARCH_NATIVE, syscall_number),
+        )
+        if syscall_name is None:
+            continue
+
+        decoded_name = syscall_name.decode()
+        if decoded_name not in ESSENTIAL_SYSCALLS:
+            syscall_names.append(decoded_name)
+
+    return syscall_names
+
+
+def measure_syscall_time(
+        seccomp_state: Optional[SeccompState],
+        iterations: int) -> float:
+    """Returns average time of getppid syscall in nanoseconds"""
+    read_end, write_end = pipe()
+    child_pid = fork()
+    if child_pid == 0:
+        if seccomp_state is not None:
+            try:
+                seccomp_state.load()
+            except OSError:
+                _exit(1)
+
+        start_time = perf_counter()
+        for _ in range(iterations):
+            getppid()
+        child_elapsed = perf_counter() - start_time
+
+        write(write_end, pack('d', child_elapsed))
+        _exit(0)
+
+    elapsed_data = read(read_end, 8)
+    _, exit_status = waitpid(child_pid, 0)
+    if exit_status != 0:
+        raise RuntimeError('Failed to load seccomp filter')
+
+    elapsed: float = unpack('d', elapsed_data)[0]
+    return elapsed / iterations * 1e9
+
+
+def bench_seccomp_main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    filterable_syscalls = get_filterable_syscalls()
+
+    def best_of(seccomp_state: Optional[SeccompState]) -> float:
+        return min(measure_syscall_time(seccomp_state, args.iterations)
+                   for _ in range(args.repeat))
+
+    no_filter_time = best_of(None)
+    print(f"No filter: {no_filter_time:.1f} ns per syscall")
+
+    for rule_count in RULE_COUNTS:
+        for level_name, optimize_level in OPTIMIZE_LEVELS.items():
+            seccomp_state = SeccompState(optimize_level=optimize_level)
+            for syscall_name in filterable_syscalls[:rule_count]:
+                seccomp_state.filter_syscall(syscall_name, EPERM)
+
+            applied_level = seccomp_state.get_applied_optimize_level()
+            if applied_level != optimize_level:
+                level_name = f"{level_name} (rejected)"
+
+            filter_time = best_of(seccomp_state)
+            print(
+                f"{rule_count:>4} rules {level_name:>23}: "
+                f"{filter_time:.1f} ns per syscall, "
+                f"overhead {filter_time - no_filter_time:.1f} ns"
+            )
+
+
+if __name__ == '__main__':
+    bench_seccomp_main()
@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Stand-in for bwrap used by the launch latency harness
+
+Reads the options passed through --args file descriptor the same
+way bwrap does, including the files passed by descriptors, then runs
+the helper from this source tree without creating any namespaces.
+Helper socket is placed in the host directory that would have been
+bound to /run/bubblehelp.
+"""
+
+from os import kill
+from pathlib import Path
+from signal import SIGTERM, signal
+from subprocess import Popen
+from sys import argv, executable
+from sys import exit as sys_exit
+from sys import flags
+from time import monotonic_ns
+from types import FrameType
+from typing import List, Optional, Tuple
+
+from bubblejail.bubblejail_trace import TraceRecorder
+
+HELPER_SANDBOX_DIR = '/run/bubblehelp'
+
+# Options that take file descriptor as the first argument
+FD_OPTIONS = frozenset((
+    '--file', '--seccomp', '--bind-data', '--ro-bind-data',
+))
+
+
+def parse_bwrap_options(args_fd: int) -> Tuple[Path, int]:
+    """Returns host helper directory and number of bytes read from fds"""
+    with open(args_fd, mode='rb') as args_file:
+        options = args_file.read().decode().split('\0')
+
+    helper_dir: Optional[Path] = None
+    bytes_read = 0
+    for index, option in enumerate(options):
+        if option == '--bind' and options[index + 2] == HELPER_SANDBOX_DIR:
+            helper_dir = Path(options[index + 1])
+        elif option in FD_OPTIONS:
+            with open(int(options[index + 1]), mode='rb') as fd_file:
+                bytes_read += len(fd_file.read())
+
+    if helper_dir is None:
+        raise ValueError('Helper directory is not bound')
+
+    return helper_dir, bytes_read
+
+
+def stub_bwrap_main() -> None:
+    start_time = monotonic_ns()
+    tracer = TraceRecorder('bwrap-stub', enabled=True)
+
+    bwrap_args = argv[1:]
+    if bwrap_args[:1] != ['--args']:
+        raise ValueError('Expected --args as the first option')
+
+    helper_dir, bytes_read = parse_bwrap_options(int(bwrap_args[1]))
+    tracer.add_span('parse args', start_time, monotonic_ns(),
+                    bytes_read=bytes_read)
+
+    # First argument after options is the helper path
+    helper_args: List[str] = [executable]
+    if flags.optimize:
+        helper_args.append('-O')
+
+    helper_args.extend((
+        '-m', 'bubblejail.bubblejail_helper',
+        '--helper-socket', str(helper_dir / 'helper.socket'),
+    ))
+    helper_args.extend(bwrap_args[3:])
+
+    spawn_start_time = monotonic_ns()
+    helper_process = Popen(helper_args)
+    tracer.add_span('spawn helper', spawn_start_time, monotonic_ns())
+    tracer.save_json_lines(helper_dir / 'trace.jsonl')
+
+    def forward_sigterm(signal_number: int,
+                        frame: Optional[FrameType]) -> None:
+        kill(helper_process.pid, SIGTERM)
+
+    signal(SIGTERM, forward_sigterm)
+
+    sys_exit(helper_process.wait())
+
+
+if __name__ == '__main__':
+    stub_bwrap_main()
@@ -17,13 +17,22 @@
 
 from argparse import REMAINDER as ARG_REMAINDER
 from argparse import ArgumentParser, Namespace
-from asyncio import run as async_run
+from contextlib import ExitStack
+from os import environ, getpid, replace, stat, utime
 from pathlib import Path
 from shlex import split as shlex_split
+from sys import exit as sys_exit
+from sys import stderr, stdout
+from time import time
 from typing import Dict, Generator, Iterable, Iterator, List, Optional, Set
 
+from xdg.BaseDirectory import xdg_cache_home
+
 from .bubblejail_directories import BubblejailDirectories
-from .services import SERVICES_CLASSES
+from .bubblejail_utils import REFILL_STRATEGIES
+
+# Bump together with the completion scripts in data/
+COMPLETION_CACHE_VERSION = 2
 
 
 class CommandMetadata:
@@ -72,26 +81,84 @@ def _extra_args_converter(command_sequence: List[str]
 
 
 def run_bjail(args: Namespace) -> None:
+    from asyncio import run as async_run
+
+    from .bubblejail_pool import claim_pooled_sandbox
+
     instance_name = args.instance_name
 
     instance = BubblejailDirectories.instance_get(instance_name)
+    args_to_instance: List[str] = args.args_to_instance
+
+    is_debug_run = (args.dry_run or args.debug_shell or args.trace
+                    or args.debug_helper_script is not None
+                    or args.debug_bwrap_args is not None)
 
-    if instance.is_running():
-        args_to_run = list(instance.rewrite_arguments(args.args_to_instance))
+    pass_files: List[Path] = args.pass_file or []
+    # Launch reports are only shown when debugging
+    is_launch_reported = args.debug or args.trace is not None
+
+    is_running = instance.is_running()
+    launch_report = 'Warm launch: sandbox is already running'
+
+    if not is_running and not is_debug_run:
+        executable_args = async_run(claim_pooled_sandbox(instance))
+        if executable_args is not None:
+            is_running = True
+            launch_report = 'Warm launch: claimed pre-warmed sandbox'
+            if not args_to_instance:
+                args_to_instance = executable_args
+
+    if is_running:
+        args_to_run = list(instance.rewrite_arguments(args_to_instance))
 
         if args.dry_run:
             print('Found helper socket.')
             print('Args to be sent: ', args_to_run)
             return
 
-        command_return_text = async_run(
-            instance.send_run_rpc(
-                args_to_run=args_to_run,
-                wait_for_response=args.wait,
+        if is_launch_reported:
+            print(launch_report, file=stderr)
+
+        if args.stdio or pass_files:
+            with ExitStack() as exit_stack:
+                file_fds = [
+                    exit_stack.enter_context(open(x, mode='rb')).fileno()
+                    for x in pass_files
+                ]
+                exit_code = async_run(
+                    instance.send_run_rpc_with_fds(
+                        args_to_run=args_to_run,
+                        pass_stdio=args.stdio,
+                        file_fds=file_fds,
+                    )
+                )
+        elif args.wait:
+            def write_output(stream_name: str, data: bytes) -> None:
+                output_file = stdout if stream_name == 'stdout' else stderr
+                output_file.buffer.write(data)
+                output_file.buffer.flush()
+
+            exit_code = async_run(
+                instance.stream_run_rpc(
+                    args_to_run=args_to_run,
+                    output_handler=write_output,
+                )
             )
-        )
-        if args.wait:
-            print(command_return_text)
+        else:
+            async_run(
+                instance.send_run_rpc(
+                    args_to_run=args_to_run,
+                )
+            )
+            return
+
+        if exit_code != 0:
+            # Killed by signal is negative same as shell would report
+            sys_exit(exit_code if exit_code > 0 else 128 - exit_code)
+    elif args.stdio or pass_files:
+        print('Passing descriptors requires running instance', file=stderr)
+        sys_exit(1)
     else:
         extra_args: Optional[List[str]]
         if args.debug_bwrap_args is not None:
@@ -102,24 +169,39 @@ def run_bjail(args: Namespace) -> None:
         else:
             extra_args = None
 
+        if is_launch_reported and not args.dry_run:
+            print('Cold launch: starting new sandbox', file=stderr)
+
         async_run(
             instance.async_run_init(
-                args_to_run=args.args_to_instance,
+                args_to_run=args_to_instance,
                 debug_shell=args.debug_shell,
                 debug_helper_script=args.debug_helper_script,
                 debug_log_dbus=args.debug_log_dbus,
                 dry_run=args.dry_run,
                 extra_bwrap_args=extra_args,
+                trace_path=args.trace,
             )
         )
 
 
-def iter_profile_names() -> Generator[str, None, None]:
-    for profiles_directory in BubblejailDirectories.\
-            iter_profile_directories():
+def bjail_pool(args: Namespace) -> None:
+    from asyncio import run as async_run
+
+    from .bubblejail_pool import SandboxPool
+
+    instance = BubblejailDirectories.instance_get(args.instance_name)
+    pool = SandboxPool(
+        instance=instance,
+        size=args.size,
+        idle_timeout=args.idle_timeout,
+        refill_strategy=args.refill,
+    )
+    async_run(pool.run())
 
-        for profile_file in profiles_directory.iterdir():
-            yield profile_file.stem
+
+def iter_profile_names() -> Generator[str, None, None]:
+    yield from BubblejailDirectories.profile_catalog().names()
 
 
 def iter_instance_names() -> Generator[str, None, None]:
@@ -150,7 +232,7 @@ class AutoCompleteParser:
             self,
     ) -> None:
 
-        want_instance_set = {'edit', 'run', 'generate-desktop-entry'}
+        want_instance_set = {'edit', 'run', 'generate-desktop-entry', 'pool'}
         base_options = {'--help'}
 
         # enumerate words to allow LL parser lookahead
@@ -226,6 +308,73 @@ class AutoCompleteParser:
         yield from self.auto_complete_iterable
 
 
+def get_completion_cache_path() -> Path:
+    return Path(xdg_cache_home) / 'bubblejail' / 'completion'
+
+
+def write_completion_cache() -> None:
+    """Cache read by shell completion scripts without running Python
+
+    Every line is a key followed by tab separated values. Scripts
+    fall back to 'list _auto_complete' if any of the watched paths
+    is newer than the cache file or if the installed module differs.
+    Cache modification time is set a second before directories were
+    listed so that changes within the same second of coarse time
+    stamps are not missed.
+    """
+    list_time = time() - 1
+
+    watch_paths = [
+        *(str(x) for x in BubblejailDirectories.iter_instances_directories()),
+        *(str(x) for x in BubblejailDirectories.iter_profile_directories()),
+    ]
+
+    # Subcommands and options change on upgrade. Package managers
+    # keep modification time of the package so it is not enough
+    # that module is older than the cache, stamp has to be equal.
+    module_stat = stat(__file__)
+    module_stamp = (f"{module_stat.st_size}:{int(module_stat.st_mtime)}:"
+                    f"{module_stat.st_ino}")
+
+    def cache_line(key: str, values: Iterable[str]) -> str:
+        return '\t'.join((
+            key,
+            *(x for x in values if '\t' not in x and '\n' not in x),
+        )) + '\n'
+
+    cache_lines = [
+        cache_line('version', (str(COMPLETION_CACHE_VERSION), )),
+        # Scripts compare these to their environment
+        cache_line('environ', ('|'.join(
+            environ.get(x, '') for x in (
+                'BUBBLEJAIL_DATADIRS', 'BUBBLEJAIL_CONFDIRS',
+                'XDG_DATA_HOME', 'XDG_CONFIG_HOME',
+            )), )),
+        cache_line('watch', watch_paths),
+        # Same format as 'stat -c %s:%Y:%i'
+        cache_line('install', (__file__, module_stamp)),
+        cache_line('subcommands', iter_subcommands()),
+        cache_line('want_instance', sorted(CommandMetadata.cmd_want_instance)),
+        cache_line('list_options', sorted(CommandMetadata.cmd_list_options)),
+        cache_line('instances', iter_instance_names()),
+        cache_line('profiles', iter_profile_names()),
+        *(cache_line(f"options:{x}", sorted(CommandMetadata.cmd_map[x]))
+          for x in iter_subcommands()),
+    ]
+
+    cache_path = get_completion_cache_path()
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f"{cache_path.name}.{getpid()}")
+        with open(temp_path, mode='w') as temp_file:
+            temp_file.writelines(cache_lines)
+        utime(temp_path, (list_time, list_time))
+        replace(temp_path, cache_path)
+    except OSError:
+        # Cache is only an optimization
+        ...
+
+
 def bjail_list(args: Namespace) -> None:
     str_iterator: Iterator[str]
 
@@ -234,6 +383,7 @@ def bjail_list(args: Namespace) -> None:
     elif args.list_what == 'profiles':
         str_iterator = iter_profile_names()
     elif args.list_what == 'services':
+        from .services import SERVICES_CLASSES
         str_iterator = (x.name for x in SERVICES_CLASSES)
     elif args.list_what == 'subcommands':
         str_iterator = iter_subcommands()
@@ -247,6 +397,8 @@ def bjail_list(args: Namespace) -> None:
 
         a = AutoCompleteParser(args, words)
         str_iterator = a.auto_complete()
+        # Completion scripts only get here if cache is stale
+        write_completion_cache()
 
     for string in str_iterator:
         print(string)
@@ -262,6 +414,8 @@ def bjail_create(args: Namespace) -> None:
 
 
 def bjail_edit(args: Namespace) -> None:
+    from asyncio import run as async_run
+
     instance = BubblejailDirectories.instance_get(args.instance_name)
     async_run(instance.edit_config_in_editor())
 
@@ -284,6 +438,8 @@ def bubblejail_main() -> None:
         CommandMetadata.add_subcommand('run')
     )
 
+    parser_run.add_argument(
+        CommandMetadata.add_option('--debug'), action='store_true')
     parser_run.add_argument(
         CommandMetadata.add_option('--debug-shell'), action='store_true')
     parser_run.add_argument(
@@ -294,6 +450,15 @@ def bubblejail_main() -> None:
         CommandMetadata.add_option('--debug-log-dbus'), action='store_true')
     parser_run.add_argument(
         CommandMetadata.add_option('--wait'), action='store_true')
+    parser_run.add_argument(
+        CommandMetadata.add_option('--trace'), type=Path)
+    parser_run.add_argument(
+        CommandMetadata.add_option('--stdio'), action='store_true')
+    parser_run.add_argument(
+        CommandMetadata.add_option('--pass-file'),
+        action='append',
+        type=Path,
+    )
 
     parser_run.add_argument(
         CommandMetadata.add_option('--debug-bwrap-args'),
@@ -306,6 +471,24 @@ def bubblejail_main() -> None:
         nargs=ARG_REMAINDER,
     )
     parser_run.set_defaults(func=run_bjail)
+    # pool subcommand
+    parser_pool = subparsers.add_parser(
+        CommandMetadata.add_subcommand('pool'),
+    )
+    parser_pool.add_argument(
+        CommandMetadata.add_option('--size'), type=int, default=1)
+    parser_pool.add_argument(
+        CommandMetadata.add_option('--idle-timeout'),
+        type=float,
+        default=600,
+    )
+    parser_pool.add_argument(
+        CommandMetadata.add_option('--refill'),
+        choices=REFILL_STRATEGIES,
+        default='eager',
+    )
+    parser_pool.add_argument(CommandMetadata.instance_arg())
+    parser_pool.set_defaults(func=bjail_pool)
     # create subcommand
     parser_create = subparsers.add_parser(
         CommandMetadata.add_subcommand('create')
@@ -14,105 +14,89 @@
 # You should have received a copy of the GNU General Public License
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
 from os import environ
 from pathlib import Path
-from subprocess import run as subprocess_run
-from typing import Any, Dict, Generator, Optional
+from typing import TYPE_CHECKING, Generator, Optional
 
 from toml import dump as toml_dump
-from toml import load as toml_load
-from xdg import IniFile
 from xdg.BaseDirectory import xdg_config_home, xdg_data_home
 
-from .bubblejail_instance import BubblejailInstance, BubblejailProfile
 from .bubblejail_utils import FILE_NAME_SERVICES, BubblejailSettings
-from .exceptions import BubblejailException, BubblejailInstanceNotFoundError
-
-PathGeneratorType = Generator[Path, None, None]
-
-UsrSharePath = Path(BubblejailSettings.SHARE_PATH_STR)
-UsrShareApplicationsPath = UsrSharePath / 'applications'
-SystemConfigsPath = UsrSharePath / 'bubblejail'
-
-UserConfigDir = Path(xdg_config_home) / 'bubblejail'
-UserConfigDir.mkdir(exist_ok=True)
-
-
-def convert_old_conf_to_new() -> None:
-    for instance_directory in BubblejailDirectories.\
-            iter_instances_path():
-        if (instance_directory / FILE_NAME_SERVICES).is_file():
-            continue
-
-        print(f"Converting {instance_directory.stem}")
-
-        old_conf_path = instance_directory / 'config.toml'
-        with open(old_conf_path) as old_conf_file:
-            old_conf_dict = toml_load(old_conf_file)
+from .exceptions import BubblejailInstanceNotFoundError
+from .instances_index import InstancesIndex
+from .profile_catalog import ProfileCatalog
 
-        new_conf: Dict[str, Any] = {}
+if TYPE_CHECKING:
+    # Instance module pulls in asyncio, helper client and seccomp.
+    # Commands that only list directories should not pay for it.
+    from .bubblejail_instance import BubblejailInstance, BubblejailProfile
 
-        try:
-            services_list = old_conf_dict.pop('services')
-        except KeyError:
-            services_list = []
+PathGeneratorType = Generator[Path, None, None]
 
-        for service_name in services_list:
-            new_conf[service_name] = {}
 
-        try:
-            old_service_dict = old_conf_dict.pop('service')
-        except KeyError:
-            old_service_dict = {}
+class BubblejailDirectories:
+    _profile_catalog: Optional[ProfileCatalog] = None
 
-        for service_name, service_dict in old_service_dict.items():
-            new_conf[service_name] = service_dict
+    @classmethod
+    def instance_get(cls, instance_name: str) -> BubblejailInstance:
+        from .bubblejail_instance import BubblejailInstance
 
-        new_conf['common'] = old_conf_dict
+        for data_dir in cls.iter_bubblejail_data_directories():
+            try:
+                instance_record = InstancesIndex(
+                    data_dir).records()[instance_name]
+            except KeyError:
+                continue
 
-        with open(instance_directory / FILE_NAME_SERVICES, mode='x') as f:
-            toml_dump(new_conf, f)
+            return BubblejailInstance(Path(instance_record.path))
 
+        raise BubblejailInstanceNotFoundError(instance_name)
 
-class BubblejailDirectories:
+    @classmethod
+    def instance_exists(cls, instance_name: str) -> bool:
+        return any(
+            instance_name in InstancesIndex(x).records()
+            for x in cls.iter_bubblejail_data_directories())
 
     @classmethod
-    def instance_get(cls, instance_name: str) -> BubblejailInstance:
-        convert_old_conf_to_new()
-        for instances_dir in cls.iter_instances_directories():
-            possible_instance_path = instances_dir / instance_name
+    def profile_catalog(cls) -> ProfileCatalog:
+        profile_directories = tuple(
+            x / 'profiles' for x in cls.iterm_config_dirs())
 
-            if possible_instance_path.is_dir():
-                return BubblejailInstance(possible_instance_path)
+        # Catalog checks itself if profiles changed
+        if (cls._profile_catalog is None
+                or cls._profile_catalog.profile_directories
+                != profile_directories):
+            cls._profile_catalog = ProfileCatalog(profile_directories)
 
-        raise BubblejailInstanceNotFoundError(instance_name)
+        return cls._profile_catalog
 
     @classmethod
     def profile_get(cls, profile_name: str) -> BubblejailProfile:
-        profile_file_name = profile_name + '.toml'
-        for profiles_directory in cls.iter_profile_directories():
-            possible_profile_path = profiles_directory / profile_file_name
-
-            if possible_profile_path.is_file():
-                with open(possible_profile_path) as profile_file:
-                    return BubblejailProfile(**toml_load(profile_file))
-
-        raise BubblejailException(f"Profile {profile_name} not found")
+        return cls.profile_catalog().profile_get(profile_name)
 
     @classmethod
     def iter_profile_directories(cls) -> PathGeneratorType:
+        user_config_dir = cls.user_config_dir_get()
         for conf_dir in cls.iterm_config_dirs():
             profiles_dir = conf_dir / 'profiles'
-            profiles_dir.mkdir(exist_ok=True)
+            profiles_dir.mkdir(exist_ok=True,
+                               parents=conf_dir == user_config_dir)
             yield profiles_dir
 
+    @classmethod
+    def user_config_dir_get(cls) -> Path:
+        return Path(xdg_config_home) / 'bubblejail'
+
     @classmethod
     def iterm_config_dirs(cls) -> PathGeneratorType:
         try:
             conf_directories = environ['BUBBLEJAIL_CONFDIRS']
         except KeyError:
-            yield UserConfigDir
-            yield SystemConfigsPath
+            yield cls.user_config_dir_get()
+            yield cls.share_path_get() / 'bubblejail'
             return
 
         yield from (Path(x) for x in conf_directories.split(':'))
@@ -125,8 +109,10 @@ class BubblejailDirectories:
             create_dot_desktop: bool = False,
             print_import_tips: bool = False,
     ) -> BubblejailInstance:
+        from .bubblejail_instance import BubblejailInstance, BubblejailProfile
 
-        instance_directory = next(cls.iter_instances_directories()) / new_name
+        data_directory = next(cls.iter_bubblejail_data_directories())
+        instance_directory = data_directory / 'instances' / new_name
 
         # Exception will be raised if directory already exists
         instance_directory.mkdir(mode=0o700, parents=True)
@@ -145,18 +131,25 @@ class BubblejailDirectories:
                       instance_conf_file)
 
         instance = BubblejailInstance(instance_directory)
+        InstancesIndex(data_directory).add(
+            instance_directory=instance_directory,
+            creation_profile_name=profile_name,
+        )
 
-        if create_dot_desktop:
-            if profile.dot_desktop_path is not None:
-                cls.overwrite_desktop_entry_for_profile(
-                    instance_name=new_name,
-                    profile_object=profile,
-                )
-            else:
-                cls.generate_empty_desktop_entry(new_name)
-
-        if profile_name is not None:
-            instance.metadata_creation_profile_name = profile_name
+        # Metadata is written once
+        with instance.metadata as metadata:
+            if profile_name is not None:
+                metadata.creation_profile_name = profile_name
+
+            if create_dot_desktop:
+                if profile.dot_desktop_path is not None:
+                    cls.overwrite_desktop_entry_for_profile(
+                        instance_name=new_name,
+                        profile_object=profile,
+                        instance=instance,
+                    )
+                else:
+                    cls.generate_empty_desktop_entry(new_name)
 
         if profile_name is not None and print_import_tips:
             print('Import tips: ', profile.import_tips)
@@ -169,9 +162,7 @@ class BubblejailDirectories:
         try:
             data_directories = environ['BUBBLEJAIL_DATADIRS']
         except KeyError:
-            home_path = Path(xdg_data_home + '/bubblejail')
-            home_path.mkdir(exist_ok=True, parents=True)
-            yield home_path
+            yield Path(xdg_data_home + '/bubblejail')
             return
 
         yield from (Path(x) for x in data_directories.split(':'))
@@ -180,13 +171,19 @@ class BubblejailDirectories:
     def iter_instances_directories(cls) -> PathGeneratorType:
         for data_dir in cls.iter_bubblejail_data_directories():
             instances_dir_path = (data_dir / 'instances')
-            instances_dir_path.mkdir(exist_ok=True)
+            instances_dir_path.mkdir(exist_ok=True, parents=True)
             yield instances_dir_path
 
     @classmethod
     def iter_instances_path(cls) -> PathGeneratorType:
-        for instances_dir in cls.iter_instances_directories():
-            yield from instances_dir.iterdir()
+        for data_dir in cls.iter_bubblejail_data_directories():
+            yield from (Path(x.path) for x in
+                        InstancesIndex(data_dir).records().values())
+
+    @classmethod
+    def share_path_get(cls) -> Path:
+        # Launchers set the share path after importing bubblejail_utils
+        return Path(BubblejailSettings.SHARE_PATH_STR)
 
     @classmethod
     def desktop_entries_dir_get(cls) -> Path:
@@ -201,7 +198,8 @@ class BubblejailDirectories:
                 possible_name = desktop_entry_name + '.desktop'
             else:
                 possible_name = desktop_entry_name
-            possible_path = UsrShareApplicationsPath / possible_name
+            possible_path = (cls.share_path_get() / 'applications'
+                             / possible_name)
         else:
             possible_path = Path(desktop_entry_name)
 
@@ -217,9 +215,11 @@ class BubblejailDirectories:
         profile_name: Optional[str] = None,
         desktop_entry_name: Optional[str] = None,
         new_name: Optional[str] = None,
+        instance: Optional[BubblejailInstance] = None,
     ) -> None:
 
-        instance = cls.instance_get(instance_name)
+        if instance is None:
+            instance = cls.instance_get(instance_name)
 
         # Five ways to figure out desktop entry path
         if desktop_entry_name is not None:
@@ -246,6 +246,8 @@ class BubblejailDirectories:
             raise TypeError('Desktop entry path can\'t be None.',
                             dot_desktop_path)
 
+        from xdg import IniFile
+
         new_dot_desktop = IniFile.IniFile(
             filename=str(dot_desktop_path))
 
@@ -295,6 +297,7 @@ class BubblejailDirectories:
         # Requires `update-desktop-database` binary
         # Arch package desktop-file-utils
         print('Updating desktop MIME database')
+        from subprocess import run as subprocess_run
         try:
             subprocess_run(
                 args=(
@@ -314,6 +317,7 @@ class BubblejailDirectories:
             cls,
             instance_name: str,
     ) -> None:
+        from xdg import IniFile
 
         new_dot_desktop = IniFile.IniFile()
         new_dot_desktop.addGroup('Desktop Entry')
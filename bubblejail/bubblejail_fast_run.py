@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Runs command in already running instance
+
+Launcher tries this before the command line interface is imported.
+Only plain 'bubblejail run INSTANCE ARGS...' is handled, which is
+what desktop entries use. Anything else, or instance that is not
+running, falls back to the command line interface.
+
+Helper does not respond to the commands that are not waited for
+so the request is sent over blocking socket without asyncio.
+Annotations are not evaluated so that typing is not imported.
+"""
+from __future__ import annotations
+
+from json import dumps as json_dumps
+from os import environ, stat
+from os.path import expanduser
+from socket import AF_UNIX, SOCK_STREAM, socket
+from stat import S_ISSOCK
+
+
+def rewrite_home_arguments(arguments: list[str]) -> list[str]:
+    """Rewrites real user home with sandboxed one."""
+    user_real_home_str = expanduser('~')
+    sandbox_home = '/home/user'
+
+    return [
+        arg.replace(user_real_home_str, sandbox_home, 1)
+        if arg.startswith(user_real_home_str) else arg
+        for arg in arguments
+    ]
+
+
+def running_helper_socket(instance_name: str) -> str | None:
+    """Returns helper socket path if instance is running"""
+    runtime_dir = environ.get('XDG_RUNTIME_DIR')
+    if (runtime_dir is None
+            or '/' in instance_name
+            or instance_name.startswith('.')):
+        return None
+
+    helper_socket_path = (
+        f"{runtime_dir}/bubblejail/{instance_name}/helper/helper.socket")
+    try:
+        if S_ISSOCK(stat(helper_socket_path).st_mode):
+            return helper_socket_path
+    except OSError:
+        ...
+
+    return None
+
+
+def run_request_line(args_to_run: list[str]) -> bytes:
+    """Same line as RequestRun(args_to_run).to_json_byte_line()"""
+    return (json_dumps({
+        'id': None,
+        'method': 'run',
+        'params': {
+            'args_to_run': args_to_run,
+            'wait_response': False,
+            'stream_output': False,
+            'pass_stdio': False,
+            'files_count': 0,
+        },
+    }) + '\n').encode()
+
+
+def try_fast_run(argv: list[str]) -> bool:
+    """Returns False if command line interface has to handle arguments"""
+    if len(argv) < 2 or argv[0] != 'run' or argv[1].startswith('-'):
+        return False
+
+    instance_name, *args_to_instance = argv[1:]
+
+    helper_socket_path = running_helper_socket(instance_name)
+    if helper_socket_path is None:
+        return False
+
+    try:
+        with socket(AF_UNIX, SOCK_STREAM) as connection:
+            connection.connect(helper_socket_path)
+            connection.sendall(run_request_line(
+                rewrite_home_arguments(args_to_instance)))
+    except OSError:
+        # Socket left over from the sandbox that was killed
+        return False
+
+    return True
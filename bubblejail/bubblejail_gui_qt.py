@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
 from functools import partial
 from sys import argv
 from typing import Any, Iterator, List, Optional, Tuple, Type
@@ -22,14 +24,13 @@ from PyQt5.QtCore import QModelIndex
 from PyQt5.QtWidgets import (QApplication, QCheckBox, QComboBox, QFormLayout,
                              QGroupBox, QHBoxLayout, QLabel, QLineEdit,
                              QListWidget, QListWidgetItem, QMainWindow,
-                             QPushButton, QScrollArea, QVBoxLayout, QWidget)
+                             QPushButton, QScrollArea, QSpinBox, QVBoxLayout,
+                             QWidget)
 
 from .bubblejail_directories import BubblejailDirectories
-from .bubblejail_instance import BubblejailProfile
-from .exceptions import BubblejailInstanceNotFoundError
-from .services import (BubblejailService, OptionBool, OptionSpaceSeparatedStr,
-                       OptionStr, OptionStrList, ServiceOption,
-                       ServiceOptionTypes)
+from .services import (BubblejailService, OptionBool, OptionInt,
+                       OptionSpaceSeparatedStr, OptionStr, OptionStrList,
+                       ServiceOption, ServiceOptionTypes)
 
 
 class BubblejailGuiWidget:
@@ -187,6 +188,36 @@ class OptionWidgetStr(OptionWidgetBase):
         return str(self.line_edit.text())
 
 
+class OptionWidgetInt(OptionWidgetBase):
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        data: int,
+    ):
+        super().__init__(
+            name=name,
+            description=description,
+            data=data,
+        )
+
+        self.horizontal_layout = QHBoxLayout()
+        self.widget.setLayout(self.horizontal_layout)
+
+        self.label = QLabel(name)
+        self.label.setToolTip(description)
+        self.horizontal_layout.addWidget(self.label)
+
+        self.spin_box = QSpinBox()
+        self.spin_box.setMaximum(2**31 - 1)
+        self.spin_box.setValue(data)
+        self.spin_box.setToolTip(description)
+        self.horizontal_layout.addWidget(self.spin_box)
+
+    def get_data(self) -> int:
+        return int(self.spin_box.value())
+
+
 class OptionWidgetCombobox(OptionWidgetBase):
     def __init__(
         self,
@@ -246,6 +277,8 @@ class ServiceWidget:
                     widget_class = OptionWidgetStr
                 elif isinstance(option, OptionStrList):
                     widget_class = OptionWidgetStrList
+                elif isinstance(option, OptionInt):
+                    widget_class = OptionWidgetInt
                 else:
                     raise TypeError()
 
@@ -379,15 +412,9 @@ class CreateInstanceWidget(CentralWidgets):
         self.profile_text = QLabel('No profile selected')
         self.main_layout.addWidget(self.profile_text)
 
-        self.current_profile: Optional[BubblejailProfile] = None
-
-        profiles_names = set()
-        for profiles_directory in \
-                BubblejailDirectories.iter_profile_directories():
-            for profile_file in profiles_directory.iterdir():
-                profiles_names.add(profile_file.stem)
+        self.current_profile_name: Optional[str] = None
 
-        for profile_name in profiles_names:
+        for profile_name in BubblejailDirectories.profile_catalog().names():
             self.profile_select_widget.add_item(profile_name)
 
         self.refresh_create_button()
@@ -396,16 +423,15 @@ class CreateInstanceWidget(CentralWidgets):
         current_name = self.name_widget.get_data()
         if not current_name:
             return False, '⚠ Name is empty'
-        else:
-            try:
-                BubblejailDirectories.instance_get(current_name)
-                return False, '⚠ Name is already used'
-            except BubblejailInstanceNotFoundError:
-                ...
-
-        if self.current_profile is not None:
-            if self.current_profile.dot_desktop_path is not None and \
-                    not self.current_profile.dot_desktop_path.is_file():
+        elif BubblejailDirectories.instance_exists(current_name):
+            return False, '⚠ Name is already used'
+
+        if self.current_profile_name is not None:
+            # Catalog notices if profile or application was installed
+            current_profile = BubblejailDirectories.profile_catalog().record(
+                self.current_profile_name)
+            if current_profile.dot_desktop_path is not None and \
+                    not current_profile.dot_desktop_exists:
                 warn_text = (
                     '⚠ WARNING \n'
                     'Desktop entry does not exist\n'
@@ -414,8 +440,8 @@ class CreateInstanceWidget(CentralWidgets):
                 return False, warn_text
             else:
                 return True, (
-                    f"{self.current_profile.description}\n"
-                    f"Import tips:  {self.current_profile.import_tips}"
+                    f"{current_profile.description}\n"
+                    f"Import tips:  {current_profile.import_tips}"
                 )
 
         return True, 'Create empty profile'
@@ -428,13 +454,14 @@ class CreateInstanceWidget(CentralWidgets):
 
     def selection_changed(self, new_text: str) -> None:
         if new_text == 'None':
-            self.current_profile = None
+            self.current_profile_name = None
         else:
-            self.current_profile = BubblejailDirectories.profile_get(new_text)
-            if self.current_profile is not None and \
-                    self.current_profile.dot_desktop_path is not None:
+            self.current_profile_name = new_text
+            current_profile = BubblejailDirectories.profile_catalog().record(
+                new_text)
+            if current_profile.dot_desktop_path is not None:
                 self.name_widget.line_edit.setText(
-                    self.current_profile.dot_desktop_path.stem
+                    current_profile.dot_desktop_path.stem
                 )
 
         self.refresh_create_button()
@@ -17,24 +17,58 @@ from __future__ import annotations
 
 from argparse import REMAINDER as ARG_REMAINDER
 from argparse import ArgumentParser
-from asyncio import (AbstractServer, CancelledError, Event, StreamReader,
-                     StreamWriter, Task, create_subprocess_exec, create_task,
-                     get_event_loop, sleep, start_unix_server)
-from asyncio.subprocess import DEVNULL, PIPE, STDOUT
+from array import array
+from asyncio import (AbstractServer, CancelledError, Event, Future,
+                     IncompleteReadError, Lock, Semaphore, StreamReader,
+                     StreamReaderProtocol, StreamWriter, Task)
+from asyncio import TimeoutError as AsyncioTimeoutError
+from asyncio import (TimerHandle, create_task, gather, get_event_loop,
+                     start_unix_server, wait, wait_for)
+from asyncio.events import Handle
+from collections import deque
+from contextlib import nullcontext
+from fcntl import F_DUPFD_CLOEXEC, fcntl
 from json import dumps as json_dumps
 from json import loads as json_loads
-from os import WNOHANG, kill, wait3, waitpid
-from pathlib import Path
+from os import (POSIX_SPAWN_DUP2, WEXITSTATUS, WIFSIGNALED, WNOHANG, WTERMSIG,
+                chmod, close, environ, fspath, kill, posix_spawnp, scandir,
+                wait4)
+from os.path import dirname
+from os.path import join as path_join
 from signal import SIGCHLD, SIGKILL, SIGTERM
-from time import sleep as sync_sleep
-from typing import (Any, Awaitable, Dict, Generator, List, Literal, Optional,
-                    Tuple, Union)
+from socket import (AF_UNIX, CMSG_LEN, MSG_CMSG_CLOEXEC, SCM_RIGHTS,
+                    SOCK_STREAM, SOL_SOCKET, socket)
+from struct import Struct
+from subprocess import DEVNULL, PIPE, STDOUT, Popen
+from typing import (IO, TYPE_CHECKING, Any, AsyncGenerator, Awaitable,
+                    ContextManager, Deque, Dict, Generator, List, Literal,
+                    NamedTuple, Optional, Set, Tuple, Union)
+
+if TYPE_CHECKING:
+    # Only imported if launch is traced
+    from .bubblejail_trace import StrPath, TraceRecorder
+
+try:
+    from os import pidfd_open
+    from signal import pidfd_send_signal
+    HAS_PIDFD = True
+except ImportError:  # Python 3.8
+    HAS_PIDFD = False
+
+# Bytes read from output of streamed commands at once
+STREAM_CHUNK_SIZE = 64 * 1024
+# JSON escapes can make output notification six times longer
+RPC_LINE_LIMIT = 8 * STREAM_CHUNK_SIZE
+# Files passed to a command in addition to standard input and output
+MAX_PASSED_FILES = 64
 
-from xdg.BaseDirectory import get_runtime_dir
 
 # region Rpc
-RpcMethods = Literal['ping', 'run']
-RpcData = Union[Dict[str, Union[bool, str, List[str]]], List[str]]
+RpcMethods = Literal['ping', 'run', 'exit_history', 'set_framing']
+# line: JSON messages separated by newlines
+# binary: length prefixed frames with several messages in each
+RpcFraming = Literal['line', 'binary']
+RpcData = Union[Dict[str, Any], List[str]]
 RpcType = Dict[str, Optional[Union[str, RpcData, RpcMethods]]]
 
 
@@ -44,15 +78,6 @@ class JsonRpcRequest:
         string_form = json_dumps(rpc_dict) + '\n'
         return string_form.encode()
 
-    @staticmethod
-    def _json_byte_line_to_dict(data: bytes) -> Dict[Any, Any]:
-        decoded_dict: Dict[Any, Any] = json_loads(data)
-        # Replace 'id' with 'request_id'
-        decoded_dict['request_id'] = decoded_dict['id']
-        decoded_dict.pop('id')
-
-        return decoded_dict
-
     def __init__(self,
                  method: RpcMethods,
                  request_id: Optional[str] = None,
@@ -94,7 +119,10 @@ class RequestRun(JsonRpcRequest):
         self,
         args_to_run: List[str],
         wait_response: bool = False,
-        request_id: Optional[str] = None
+        request_id: Optional[str] = None,
+        stream_output: bool = False,
+        pass_stdio: bool = False,
+        files_count: int = 0,
     ) -> None:
         super().__init__(
             method='run',
@@ -102,14 +130,58 @@ class RequestRun(JsonRpcRequest):
             params={
                 'args_to_run': args_to_run,
                 'wait_response': wait_response,
+                'stream_output': stream_output,
+                'pass_stdio': pass_stdio,
+                'files_count': files_count,
             },
         )
         self.args_to_run = args_to_run
         self.wait_response = wait_response
+        # Output is sent in notifications as it is read
+        # and response only contains exit code
+        self.stream_output = stream_output
+        # Only used over the file descriptors socket.
+        # Descriptors of standard input, output and error followed
+        # by files are sent with request.
+        self.pass_stdio = pass_stdio
+        self.files_count = files_count
+
+    def resolve_args(self, startup_args: List[str]) -> None:
+        """Lingering sandbox runs the startup command again"""
+        if not self.args_to_run:
+            self.args_to_run = startup_args
 
     def response_run(self, text: str) -> bytes:
         return self._get_reponse_bytes({'return': text})
 
+    def response_exit_code(self, exit_code: int) -> bytes:
+        return self._get_reponse_bytes({'exit_code': exit_code})
+
+    def notification_output(self, stream_name: str,
+                            data: Optional[bytes]) -> bytes:
+        """Data is None if it is sent as body of binary frame message"""
+        params = {
+            'request_id': self.request_id,
+            'stream': stream_name,
+        }
+        if data is not None:
+            # Binary output survives round trip through JSON string
+            params['data'] = data.decode('utf-8', 'surrogateescape')
+
+        return self._dict_to_json_byte_line({
+            'id': None,
+            'method': 'output',
+            'params': params,
+        })
+
+    def decode_exit_code(self, text: bytes) -> int:
+        exit_code = json_loads(text)['result']['exit_code']
+
+        if isinstance(exit_code, int):
+            return exit_code
+        else:
+            raise TypeError('Expected int in response.')
+
     def decode_response(self, text: bytes) -> str:
         possible_str = json_loads(text)['result']['return']
 
@@ -119,105 +191,370 @@ class RequestRun(JsonRpcRequest):
             raise TypeError('Expected str in response.')
 
 
-RpcRequests = Union[RequestPing, RequestRun]
+class RequestExitHistory(JsonRpcRequest):
+    def __init__(self, request_id: Optional[str] = None) -> None:
+        super().__init__(
+            method='exit_history',
+            request_id=request_id,
+        )
+
+    def response_exit_history(self, reaper: ChildReaper) -> bytes:
+        return self._get_reponse_bytes({
+            'reaped_total': reaper.reaped_total,
+            'exits': [x._asdict() for x in reaper.exit_history],
+        })
+
+    def decode_response(self, text: bytes) -> List[ExitRecord]:
+        exits = json_loads(text)['result']['exits']
+        return [ExitRecord(**x) for x in exits]
+
+
+class RequestSetFraming(JsonRpcRequest):
+    """Switches framing of the connection in both directions
+
+    Helper sends response before switching. Connection starts with
+    line framing. Should be sent before other requests as helper
+    waits for them to finish first.
+    """
+
+    def __init__(
+        self,
+        framing: RpcFraming,
+        request_id: Optional[str] = None,
+    ) -> None:
+        super().__init__(
+            method='set_framing',
+            request_id=request_id,
+            params={'framing': framing},
+        )
+        self.framing = framing
+
+    def response_set_framing(self) -> bytes:
+        return self._get_reponse_bytes({'framing': self.framing})
+
+
+RpcRequests = Union[RequestPing, RequestRun, RequestExitHistory,
+                    RequestSetFraming]
 
 
 def request_selector(data: bytes) -> RpcRequests:
-    decoded_dict = JsonRpcRequest._json_byte_line_to_dict(data)
+    decoded_dict: Dict[str, Any] = json_loads(data)
 
     method = decoded_dict['method']
-    request_id = decoded_dict['request_id']
+    request_id = decoded_dict['id']
     params = decoded_dict['params']
 
     if method == 'ping':
         return RequestPing(request_id=request_id)
+    elif method == 'exit_history':
+        return RequestExitHistory(request_id=request_id)
     elif method == 'run':
         return RequestRun(
             request_id=request_id,
             **params
         )
+    elif method == 'set_framing':
+        if params['framing'] not in ('line', 'binary'):
+            raise TypeError('Unknown framing.')
+
+        return RequestSetFraming(
+            request_id=request_id,
+            framing=params['framing'],
+        )
     else:
         raise TypeError('Unknown rpc method.')
+
+
+# Frame is payload size followed by messages.
+# Message is header size, body size, JSON header and raw body.
+FRAME_HEADER = Struct('!I')
+MESSAGE_HEADER = Struct('!II')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# Header and body of frame message
+FrameMessage = Tuple[bytes, bytes]
+
+
+async def read_frame(reader: StreamReader) -> Optional[List[FrameMessage]]:
+    """Returns None once the connection is closed"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+
+    (payload_size, ) = FRAME_HEADER.unpack(header)
+    if payload_size > MAX_FRAME_SIZE:
+        raise ValueError('Frame is too large')
+
+    payload = memoryview(await reader.readexactly(payload_size))
+    messages: List[FrameMessage] = []
+    offset = 0
+    while offset < payload_size:
+        header_size, body_size = MESSAGE_HEADER.unpack_from(payload, offset)
+        offset += MESSAGE_HEADER.size
+        message_header = bytes(payload[offset:offset + header_size])
+        offset += header_size
+        messages.append(
+            (message_header, bytes(payload[offset:offset + body_size])))
+        offset += body_size
+
+    return messages
+
+
+class LineWriter:
+    """Writes every message as a JSON line"""
+
+    def __init__(self, writer: StreamWriter):
+        self.writer = writer
+        self.lock = Lock()
+
+    async def send(self, line: bytes) -> None:
+        async with self.lock:
+            self.writer.write(line)
+            await self.writer.drain()
+
+    async def send_output(self, request: RequestRun,
+                          stream_name: str, data: bytes) -> None:
+        await self.send(request.notification_output(stream_name, data))
+
+
+class FrameWriter:
+    """Batches messages sent during one event loop iteration in a frame"""
+
+    def __init__(self, writer: StreamWriter):
+        self.writer = writer
+        self.batch: List[bytes] = []
+        self.batch_size = 0
+        self.flush_handle: Optional[Handle] = None
+
+    def write(self, header: bytes, body: bytes = b'') -> None:
+        self.batch.append(MESSAGE_HEADER.pack(len(header), len(body)))
+        self.batch.append(header)
+        self.batch.append(body)
+        self.batch_size += MESSAGE_HEADER.size + len(header) + len(body)
+
+        if self.batch_size > MAX_FRAME_SIZE // 2:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = get_event_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if self.batch:
+            self.writer.write(FRAME_HEADER.pack(self.batch_size))
+            self.writer.writelines(self.batch)
+            self.batch.clear()
+            self.batch_size = 0
+
+    async def drain(self) -> None:
+        # Batch is bounded so waiting for the previous
+        # frames is enough to keep memory use constant
+        await self.writer.drain()
+
+    async def send(self, header: bytes, body: bytes = b'') -> None:
+        self.write(header, body)
+        await self.drain()
+
+    async def send_output(self, request: RequestRun,
+                          stream_name: str, data: bytes) -> None:
+        # Output is sent as is instead of escaping it in JSON
+        await self.send(request.notification_output(stream_name, None), data)
+
+
+RpcWriter = Union[LineWriter, FrameWriter]
 # endregion Rpc
 
 
-def handle_children() -> None:
-    """Reaps dead children."""
-    # Needs to be in exception
-    # Seems like the sometimes python raises ChildProcessError
-    # Most often however (0, 0)
-    wait_pid_tuple: Tuple[int, int] = (0, 0)
+# region Fd passing
+
+
+def send_fds(sock: socket, data: bytes, fds: List[int]) -> None:
+    sock.sendmsg(
+        [data],
+        [(SOL_SOCKET, SCM_RIGHTS, array('i', fds))] if fds else [],
+    )
+
+
+def recv_fds(sock: socket, bufsize: int,
+             max_fds: int) -> Tuple[bytes, List[int]]:
+    fds = array('i')
+    data, ancdata, _, _ = sock.recvmsg(
+        bufsize,
+        CMSG_LEN(max_fds * fds.itemsize),
+        # Do not leak received descriptors to other commands
+        MSG_CMSG_CLOEXEC,
+    )
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == SOL_SOCKET and cmsg_type == SCM_RIGHTS:
+            fds.frombytes(
+                cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+
+    return data, list(fds)
+
+
+async def wait_readable(sock: socket) -> None:
+    loop = get_event_loop()
+    readable: Future[None] = loop.create_future()
+
+    def set_readable() -> None:
+        if not readable.done():
+            readable.set_result(None)
+
+    loop.add_reader(sock, set_readable)
     try:
-        # Walrus in action
-        while (wait_pid_tuple := waitpid(-1, WNOHANG)) != (0, 0):
-            exit_pid, exit_code = wait_pid_tuple
-            if exit_pid == 0:
-                return
+        await readable
+    finally:
+        loop.remove_reader(sock)
 
-            if __debug__:
-                print('Reaped: ', exit_pid,
-                      ' Exit code: ', exit_code,
-                      flush=True)
-
-    except ChildProcessError:
-        ...
-
-
-def terminate_children(run_helper_task: Task[None]) -> None:
-    """Send SIGTERM to all children of this process"""
-    signal_counter = 0
-    pids_sigtermed = set()
-
-    def signal_all_children() -> None:
-        nonlocal signal_counter
-        signal_counter += 1
-        # Send SIGTERM to all our children
-        for task_dir in Path('/proc/self/task/').iterdir():
-            # Open task
-            with open(task_dir / 'children') as children_file:
-                children_file_pids = children_file.read().split()
-                for pid in (int(pid_str) for pid_str in children_file_pids):
-                    if signal_counter > 20:
-                        # if we tried to send sigterm 20 times and it still
-                        # did not work use SIGKILL
-                        kill(pid, SIGKILL)
-                        continue
-
-                    if pid not in pids_sigtermed:
-                        kill(pid, SIGTERM)
-                        pids_sigtermed.add(pid)
-
-    signal_all_children()
+
+async def sock_recv_fds(sock: socket, bufsize: int,
+                        max_fds: int) -> Tuple[bytes, List[int]]:
     while True:
-        # Reap the rest of the children
-        # this will block
-        # might cause stalls in shutdown
-        # might also have race conditions with SIGCHLD
         try:
-            pid_reaped, _, _ = wait3(WNOHANG)
-            if pid_reaped == 0:
-                sync_sleep(0.5)
-                signal_all_children()
-        except ChildProcessError:
-            break
+            return recv_fds(sock, bufsize, max_fds)
+        except BlockingIOError:
+            await wait_readable(sock)
 
-    run_helper_task.cancel()
+# endregion Fd passing
+
+
+def get_children_pids() -> List[int]:
+    children_pids: List[int] = []
+    with scandir('/proc/self/task/') as task_dirs:
+        for task_dir in task_dirs:
+            with open(f"{task_dir.path}/children") as children_file:
+                # Children file will be empty if there are not children
+                children_pids.extend(
+                    int(pid_str) for pid_str in children_file.read().split())
+
+    return children_pids
+
+
+def is_zombie(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            # State follows the command enclosed in round parenthesis
+            state = stat_file.read().rsplit(')', maxsplit=1)[1].split()[0]
+    except FileNotFoundError:
+        return True
+
+    return state == 'Z'
+
+
+def wait_status_to_exit_code(wait_status: int) -> int:
+    """Same as returncode of subprocess: negative signal if killed"""
+    if WIFSIGNALED(wait_status):
+        return -WTERMSIG(wait_status)
+    else:
+        return WEXITSTATUS(wait_status)
+
+
+class ExitRecord(NamedTuple):
+    pid: int
+    # Empty for orphaned processes reparented to helper
+    argv: List[str]
+    exit_code: int
+    user_time: float
+    system_time: float
+    # Kilobytes
+    max_rss: int
+
+
+class ChildReaper:
+    """Reaps every child of the helper and records their exits
+
+    Helper is PID 1 of the sandbox so every orphaned process is
+    reparented to it. All children are collected with wait4(-1)
+    until there are none left, as several SIGCHLD are merged in to one.
+    Commands started by helper are registered to get their exit code.
+    """
+
+    def __init__(self, history_size: int = 1024) -> None:
+        self.exit_history: Deque[ExitRecord] = deque(maxlen=history_size)
+        self.commands: Dict[int, Tuple[List[str], Future[int]]] = {}
+        self.reaped_total = 0
+
+    def add_command(self, pid: int, argv: List[str]) -> Future[int]:
+        # Should be called before returning to event loop
+        # otherwise command could be reaped as an orphan
+        exit_future: Future[int] = get_event_loop().create_future()
+        self.commands[pid] = (argv, exit_future)
+        return exit_future
+
+    def reap(self) -> int:
+        """Returns number of reaped processes"""
+        reaped_number = 0
+        while True:
+            try:
+                pid, wait_status, rusage = wait4(-1, WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                break
+
+            reaped_number += 1
+            exit_code = wait_status_to_exit_code(wait_status)
+            argv, exit_future = self.commands.pop(pid, ([], None))
+
+            self.exit_history.append(ExitRecord(
+                pid=pid,
+                argv=argv,
+                exit_code=exit_code,
+                user_time=rusage.ru_utime,
+                system_time=rusage.ru_stime,
+                max_rss=rusage.ru_maxrss,
+            ))
+
+            if exit_future is not None and not exit_future.done():
+                exit_future.set_result(exit_code)
+
+        self.reaped_total += reaped_number
+        return reaped_number
 
 
 class BubblejailHelper(Awaitable[bool]):
     def __init__(
         self,
             startup_args: List[str],
-            helper_socket_path: Path = Path('/run/bubblehelp/helper.socket'),
-            no_child_timeout: Optional[int] = 3,
-            reaper_pool_timer: int = 5,
+            helper_socket_path: StrPath = '/run/bubblehelp/helper.socket',
+            no_child_timeout: Optional[float] = 3,
             use_fixups: bool = True,
+            tracer: Optional[TraceRecorder] = None,
+            wait_for_run: bool = False,
+            linger_timeout: float = 0,
+            termination_deadline: float = 10,
+            exit_history_size: int = 1024,
+            max_concurrent_requests: int = 64,
+            fd_socket_path: Optional[StrPath] = None,
     ):
         self.startup_args = startup_args
+        # Seconds to wait for the first child before terminating.
+        # Pre-warmed helper has no startup command and should not
+        # terminate until first command is run.
+        self.no_child_timeout = no_child_timeout if not wait_for_run else None
+        # Seconds to keep running after last child exited
+        self.linger_timeout = linger_timeout
+        # Seconds between SIGTERM and SIGKILL of children on termination
+        self.termination_deadline = termination_deadline
         self.helper_socket_path = helper_socket_path
+        self.tracer = tracer
+        self.is_first_request = True
 
         # Server
         self.server: Optional[AbstractServer] = None
+        # Requests that pass file descriptors are accepted on
+        # a separate socket as asyncio streams drop ancillary data
+        self.fd_socket_path = fd_socket_path
+        self.fd_server_socket: Optional[socket] = None
+        self.fd_server_task: Optional[Task[None]] = None
+        # Shared by all connections. Run request holds it until
+        # the command exits so burst of requests can't fork bomb.
+        self.request_semaphore = Semaphore(max_concurrent_requests)
 
         # Event terminated
         self.terminated = Event()
@@ -225,8 +562,12 @@ class BubblejailHelper(Awaitable[bool]):
         # Terminator variables
         self.terminator_look_for_command: Optional[str] = None
 
-        self.terminator_pool_timer = reaper_pool_timer
-        self.termninator_watcher_task: Optional[Task[None]] = None
+        self.had_children = False
+        self.reaper = ChildReaper(exit_history_size)
+        self.children_changed = Event()
+        self.stop_timer: Optional[TimerHandle] = None
+        self.stop_task: Optional[Task[None]] = None
+        self.is_terminating = False
 
         # Fix-ups
         if not use_fixups:
@@ -234,24 +575,26 @@ class BubblejailHelper(Awaitable[bool]):
 
         # Make sure that XDG_RUNTIME_DIR is 700
         # otherwise KDE applications do not work
-        Path(get_runtime_dir()).chmod(0o700)
+        # Bubblejail always sets it in the sandbox
+        runtime_dir = environ.get('XDG_RUNTIME_DIR')
+        if runtime_dir is not None:
+            chmod(runtime_dir, 0o700)
 
     @classmethod
-    def iter_proc_process_directories(cls) -> Generator[Path, None, None]:
-        proc_path = Path('/proc')
+    def iter_proc_process_directories(cls) -> Generator[str, None, None]:
         # Iterate over items in /proc
-        for proc_item in proc_path.iterdir():
+        for proc_item in scandir('/proc'):
             # If we found something without number as name
             # skip it as its not a process
             if proc_item.name.isnumeric():
-                yield proc_item
+                yield proc_item.path
 
     @classmethod
     def proc_has_process_command(cls, process_command: str) -> bool:
         for process_dir in cls.iter_proc_process_directories():
             # read cmdline file containing cmd arguments
             try:
-                with open(process_dir / 'stat') as stat_file:
+                with open(f"{process_dir}/stat") as stat_file:
                     # Read file and split by white space
                     # The command argument is a second white space
                     # separated argument so we only need to split 2 times
@@ -268,41 +611,246 @@ class BubblejailHelper(Awaitable[bool]):
 
     @classmethod
     def process_has_child(cls) -> bool:
-        for task_dir in Path('/proc/self/task/').iterdir():
+        return any(not is_zombie(pid) for pid in get_children_pids())
 
-            # Open task
-            with open(task_dir / 'children') as children_file:
-                children_file_contents = children_file.read()
-                if children_file_contents:
-                    # Children file will be empty if there are not children
-                    return True
+    def has_children(self) -> bool:
+        if self.terminator_look_for_command is None:
+            return self.process_has_child()
+        else:
+            return self.proc_has_process_command(
+                self.terminator_look_for_command
+            )
 
-        return False
+    # region Lifecycle
+
+    def handle_sigchld(self) -> None:
+        if self.reaper.reap():
+            self.children_changed.set()
+            self.check_children()
+
+    def cancel_stop_timer(self) -> None:
+        if self.stop_timer is not None:
+            self.stop_timer.cancel()
+            self.stop_timer = None
+
+    def check_children(self) -> None:
+        """Schedules termination if there are no children left"""
+        if self.is_terminating or self.stop_task is not None:
+            return
+
+        # Running commands avoid reading /proc on every exit
+        if ((self.reaper.commands
+                and self.terminator_look_for_command is None)
+                or self.has_children()):
+            self.had_children = True
+            self.cancel_stop_timer()
+            return
+
+        if self.stop_timer is not None:
+            return
+
+        if self.had_children:
+            timeout = self.linger_timeout
+        elif self.no_child_timeout is not None:
+            timeout = self.no_child_timeout
+        else:
+            return
+
+        self.stop_timer = get_event_loop().call_later(
+            timeout, self.stop_no_children)
+
+    def stop_no_children(self) -> None:
+        self.stop_timer = None
+        if self.has_children():
+            return
 
-    async def termninator_watcher(self) -> None:
         if __debug__:
-            print(
-                'self.terminator_look_for_command: ',
-                repr(self.terminator_look_for_command))
+            print('No children found. Terminating.', flush=True)
 
-        while True:
-            try:
-                await sleep(self.terminator_pool_timer)  # wait timer
+        self.request_stop()
+
+    def on_command_exit(self, exit_future: Future[int]) -> None:
+        self.check_children()
+
+    def signal_child(self, pid: int, signal_number: int,
+                     pidfds: Dict[int, int]) -> None:
+        """Signals child through pidfd so that reused PID is never hit"""
+        try:
+            if HAS_PIDFD:
+                if pid not in pidfds:
+                    pidfd = pidfd_open(pid)
+                    pidfds[pid] = pidfd
+
+                    def on_pidfd_readable(pidfd: int = pidfd) -> None:
+                        # Becomes readable once process exits
+                        get_event_loop().remove_reader(pidfd)
+                        self.children_changed.set()
+
+                    get_event_loop().add_reader(pidfd, on_pidfd_readable)
+
+                pidfd_send_signal(pidfds[pid], signal_number)
+            else:
+                kill(pid, signal_number)
+        except ProcessLookupError:
+            ...
+
+    async def terminate_children(self) -> None:
+        """Sends SIGTERM to all children and SIGKILL after deadline"""
+        loop = get_event_loop()
+        kill_time = loop.time() + self.termination_deadline
+        signals_sent: Dict[int, int] = {}
+        pidfds: Dict[int, int] = {}
+
+        try:
+            while True:
+                # Orphans might get reparented to us during termination
+                living_pids = [pid for pid in get_children_pids()
+                               if not is_zombie(pid)]
+                if not living_pids:
+                    return
+
+                time_left = kill_time - loop.time()
+                signal_number = SIGTERM if time_left > 0 else SIGKILL
+
+                for pid in living_pids:
+                    if signals_sent.get(pid) != signal_number:
+                        signals_sent[pid] = signal_number
+                        self.signal_child(pid, signal_number, pidfds)
 
-                if self.terminator_look_for_command is None:
-                    is_time_to_termniate = not self.process_has_child()
-                else:
-                    is_time_to_termniate = not self.proc_has_process_command(
-                        self.terminator_look_for_command
+                self.children_changed.clear()
+                try:
+                    await wait_for(
+                        self.children_changed.wait(),
+                        # Killed processes might take time to exit
+                        timeout=time_left if time_left > 0 else 1,
                     )
+                except AsyncioTimeoutError:
+                    ...
+        finally:
+            for pidfd in pidfds.values():
+                loop.remove_reader(pidfd)
+                close(pidfd)
+
+    async def terminate_async(self) -> None:
+        self.is_terminating = True
+        self.cancel_stop_timer()
+        await self.terminate_children()
+        await self.stop_async()
+
+    def request_terminate(self) -> None:
+        if not self.is_terminating:
+            create_task(self.terminate_async())
+
+    def request_stop(self) -> None:
+        if self.stop_task is None:
+            self.stop_task = create_task(self.stop_async())
+
+    # endregion Lifecycle
+
+    def trace_span(self, name: str, **args: Any) -> ContextManager[None]:
+        if self.tracer is None:
+            return nullcontext()
+
+        return self.tracer.span(name, **args)
+
+    def register_command(
+            self, pid: int, args_to_run: List[str]) -> Future[int]:
+        exit_future = self.reaper.add_command(pid, args_to_run)
+
+        self.had_children = True
+        self.cancel_stop_timer()
+        exit_future.add_done_callback(self.on_command_exit)
+
+        return exit_future
 
-                if is_time_to_termniate:
-                    if __debug__:
-                        print('No children found. Terminating.')
-                    create_task(self.stop_async())
+    def spawn_command(
+        self,
+        args_to_run: List[str],
+        stdin: Optional[int] = None,
+        stdout: Optional[int] = None,
+        stderr: Optional[int] = None,
+    ) -> Tuple[Popen[bytes], Future[int]]:
+        # Span ends once the command has been executed
+        with self.trace_span('spawn', args_to_run=args_to_run):
+            # Subprocesses are not created through asyncio as its
+            # child watcher would race with the reaper
+            p = Popen(
+                args_to_run,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+            )
+            exit_future = self.register_command(p.pid, args_to_run)
+
+        def set_returncode(exit_future: Future[int]) -> None:
+            # Popen would otherwise try to wait for reaped process
+            if not exit_future.cancelled():
+                p.returncode = exit_future.result()
+
+        # Callback also keeps Popen alive until the command exits.
+        # Otherwise its destructor would add it to the subprocess
+        # module list and reap it before the reaper does.
+        exit_future.add_done_callback(set_returncode)
+        return p, exit_future
+
+    def spawn_command_with_fds(
+        self,
+        args_to_run: List[str],
+        stdio_fds: List[int],
+        file_fds: List[int],
+    ) -> Future[int]:
+        """Spawns command with passed descriptors
+
+        Files are available to command starting from descriptor 3.
+        """
+        # Move descriptors above the ones they will be duplicated to
+        high_fds: List[int] = []
+        for fd in (*stdio_fds, *file_fds):
+            try:
+                high_fds.append(fcntl(fd, F_DUPFD_CLOEXEC, 3 + len(file_fds)))
+            except OSError:
+                for x in high_fds:
+                    close(x)
+                raise
+
+        target_fds = (*range(len(stdio_fds)),
+                      *range(3, 3 + len(file_fds)))
+
+        try:
+            with self.trace_span('spawn', args_to_run=args_to_run):
+                pid = posix_spawnp(
+                    args_to_run[0],
+                    args_to_run,
+                    environ,
+                    file_actions=[
+                        (POSIX_SPAWN_DUP2, fd, target_fd)
+                        for fd, target_fd in zip(high_fds, target_fds)
+                    ],
+                )
+                exit_future = self.register_command(pid, args_to_run)
+        finally:
+            for fd in high_fds:
+                close(fd)
+
+        return exit_future
+
+    @staticmethod
+    async def iter_pipe_chunks(
+            pipe: IO[bytes]) -> AsyncGenerator[bytes, None]:
+        stream_reader = StreamReader()
+        transport, _ = await get_event_loop().connect_read_pipe(
+            lambda: StreamReaderProtocol(stream_reader),
+            pipe,
+        )
+        try:
+            while True:
+                chunk = await stream_reader.read(STREAM_CHUNK_SIZE)
+                if not chunk:
                     return
-            except CancelledError:
-                return
+
+                yield chunk
+        finally:
+            transport.close()
 
     async def run_command(
         self,
@@ -311,32 +859,198 @@ class BubblejailHelper(Awaitable[bool]):
     ) -> Optional[str]:
 
         if std_in_out_mode == DEVNULL:
-            p = await create_subprocess_exec(
-                *args_to_run,
+            self.spawn_command(
+                args_to_run,
+                stdin=DEVNULL,
                 stdout=DEVNULL,
                 stderr=DEVNULL,
-                stdin=DEVNULL,
             )
+            return None
         elif std_in_out_mode == PIPE:
-            p = await create_subprocess_exec(
-                *args_to_run,
+            p, exit_future = self.spawn_command(
+                args_to_run,
+                stdin=DEVNULL,
                 stdout=PIPE,
                 stderr=STDOUT,
-                stdin=PIPE,
             )
         else:
-            p = await create_subprocess_exec(
-                *args_to_run,
-            )
+            p, exit_future = self.spawn_command(args_to_run)
 
-        if std_in_out_mode is None:
-            await p.wait()
-        elif std_in_out_mode == PIPE:
-            (stdout_data, _) = await p.communicate()
+        stdout_data: Optional[bytes] = None
+        if p.stdout is not None:
+            stdout_data = b''.join(
+                [x async for x in self.iter_pipe_chunks(p.stdout)])
+
+        await exit_future
+
+        if stdout_data is not None:
             return stdout_data.decode()
 
         return None
 
+    async def stream_command(
+            self,
+            request: RequestRun,
+            rpc_writer: RpcWriter) -> bytes:
+        """Sends output as it is read and returns exit code response"""
+        try:
+            p, exit_future = self.spawn_command(
+                request.args_to_run,
+                stdin=DEVNULL,
+                stdout=PIPE,
+                stderr=PIPE,
+            )
+        except OSError as error:
+            print('Failed to run command:', error, flush=True)
+            await rpc_writer.send_output(
+                request, 'stderr',
+                f"Failed to run command: {error}\n".encode())
+            # Same as shell reports command not found
+            return request.response_exit_code(127)
+
+        async def forward_output(pipe: IO[bytes], stream_name: str) -> None:
+            async for chunk in self.iter_pipe_chunks(pipe):
+                # Waiting for drain keeps memory use constant
+                await rpc_writer.send_output(request, stream_name, chunk)
+
+        if p.stdout is None or p.stderr is None:
+            raise TypeError('Expected pipes of the process')
+
+        await gather(
+            forward_output(p.stdout, 'stdout'),
+            forward_output(p.stderr, 'stderr'),
+        )
+
+        return request.response_exit_code(await exit_future)
+
+    def parse_request(self, data: bytes) -> RpcRequests:
+        request = request_selector(data)
+        if isinstance(request, RequestRun):
+            request.resolve_args(self.startup_args)
+
+        return request
+
+    async def fd_client_handler(self, connection: socket) -> None:
+        fds: List[int] = []
+        try:
+            with connection:
+                request_line = b''
+                while not request_line.endswith(b'\n'):
+                    data, data_fds = await sock_recv_fds(
+                        connection, STREAM_CHUNK_SIZE, 3 + MAX_PASSED_FILES)
+                    fds.extend(data_fds)
+                    if not data:
+                        return
+
+                    request_line += data
+
+                request = self.parse_request(request_line)
+                if not isinstance(request, RequestRun):
+                    raise TypeError('Expected run request')
+
+                stdio_count = 3 if request.pass_stdio else 0
+                if len(fds) != stdio_count + request.files_count:
+                    raise ValueError('Wrong number of passed descriptors')
+
+                async with self.request_semaphore:
+                    try:
+                        exit_future = self.spawn_command_with_fds(
+                            request.args_to_run,
+                            stdio_fds=fds[:stdio_count],
+                            file_fds=fds[stdio_count:],
+                        )
+                    except OSError as error:
+                        print('Failed to run command:', error, flush=True)
+                        # Same as shell reports command not found
+                        exit_future = get_event_loop().create_future()
+                        exit_future.set_result(127)
+                    finally:
+                        # Command has its own copies of descriptors.
+                        # Pipes would not be closed otherwise.
+                        for fd in fds:
+                            close(fd)
+                        fds.clear()
+
+                    if not request.wait_response:
+                        # Only commands being waited on count towards limit
+                        return
+
+                    exit_code = await exit_future
+
+                await get_event_loop().sock_sendall(
+                    connection, request.response_exit_code(exit_code))
+        finally:
+            for fd in fds:
+                close(fd)
+
+    async def run_fd_server(self, server_socket: socket) -> None:
+        loop = get_event_loop()
+        client_tasks: Set[Task[None]] = set()
+        while True:
+            connection, _ = await loop.sock_accept(server_socket)
+            client_task = create_task(self.fd_client_handler(connection))
+            client_tasks.add(client_task)
+            client_task.add_done_callback(client_tasks.discard)
+
+    async def get_response(
+            self,
+            request: RpcRequests,
+            rpc_writer: RpcWriter) -> Optional[bytes]:
+        if isinstance(request, RequestPing):
+            return request.response_ping()
+        elif isinstance(request, RequestExitHistory):
+            return request.response_exit_history(self.reaper)
+        elif isinstance(request, RequestRun) and request.stream_output:
+            return await self.stream_command(request, rpc_writer)
+        elif isinstance(request, RequestRun) and request.wait_response:
+            try:
+                run_stdout = await self.run_command(
+                    args_to_run=request.args_to_run,
+                    std_in_out_mode=PIPE,
+                )
+            except OSError as error:
+                print('Failed to run command:', error, flush=True)
+                # Error is the output as if shell ran the command
+                run_stdout = f"Failed to run command: {error}\n"
+
+            if run_stdout is None:
+                return None
+            else:
+                return request.response_run(
+                    text=run_stdout,
+                )
+        elif isinstance(request, RequestRun):
+            # Command is left to the reaper so that request
+            # stops counting towards limit once it is spawned
+            try:
+                self.spawn_command(request.args_to_run)
+            except OSError as error:
+                # Nobody waits for a response
+                print('Failed to run command:', error, flush=True)
+
+            return None
+        else:
+            raise TypeError('Request can not be run concurrently')
+
+    async def handle_request(
+            self,
+            request: RpcRequests,
+            rpc_writer: RpcWriter) -> None:
+        try:
+            response = await self.get_response(request, rpc_writer)
+            if response is None:
+                return
+
+            # Responses are matched to requests by id
+            # and can be sent in any order
+            await rpc_writer.send(response)
+        except ConnectionError:
+            if __debug__:
+                print('Client disconnected before response', flush=True)
+        finally:
+            if isinstance(request, RequestRun):
+                self.request_semaphore.release()
+
     async def client_handler(
             self,
             reader: StreamReader,
@@ -345,57 +1059,103 @@ class BubblejailHelper(Awaitable[bool]):
         if __debug__:
             print('Client connected', flush=True)
 
+        rpc_writer: RpcWriter = LineWriter(writer)
+        pending_requests: Set[Task[None]] = set()
+
         while True:
-            line = await reader.readline()
-            if not line:
+            if isinstance(rpc_writer, LineWriter):
+                line = await reader.readline()
+                messages = [line] if line else None
+            else:
+                frame_messages = await read_frame(reader)
+                messages = ([header for header, _ in frame_messages]
+                            if frame_messages is not None else None)
+
+            if messages is None:
                 if __debug__:
                     print('Reached end of reader. Returnning', flush=True)
-                writer.close()
-                await writer.wait_closed()
-                return
+                break
 
-            request = request_selector(line)
+            for message in messages:
+                request = self.parse_request(message)
 
-            if isinstance(request, RequestPing):
-                response = request.response_ping()
-            elif isinstance(request, RequestRun):
-                run_stdout = await self.run_command(
-                    args_to_run=request.args_to_run,
-                    std_in_out_mode=PIPE if request.wait_response else None,
-                )
-                if run_stdout is None:
+                if self.is_first_request:
+                    self.is_first_request = False
+                    if self.tracer is not None:
+                        self.tracer.add_instant('first request')
+
+                if isinstance(request, RequestSetFraming):
+                    # Responses in flight use current framing
+                    if pending_requests:
+                        await wait(pending_requests)
+
+                    await rpc_writer.send(request.response_set_framing())
+                    rpc_writer = (FrameWriter(writer)
+                                  if request.framing == 'binary'
+                                  else LineWriter(writer))
                     continue
-                else:
-                    response = request.response_run(
-                        text=run_stdout,
-                    )
 
-            writer.write(response)
-            await writer.drain()
+                # Stop reading requests until one of running finishes.
+                # Ping and exit history are answered right away
+                # and do not count.
+                if isinstance(request, RequestRun):
+                    await self.request_semaphore.acquire()
+
+                request_task = create_task(
+                    self.handle_request(request, rpc_writer))
+                pending_requests.add(request_task)
+                request_task.add_done_callback(pending_requests.discard)
+
+        if pending_requests:
+            await wait(pending_requests)
+
+        writer.close()
+        await writer.wait_closed()
 
     async def start_async(self) -> None:
-        self.server = await start_unix_server(
-            self.client_handler,
-            path=self.helper_socket_path,
-        )
+        get_event_loop().add_signal_handler(SIGCHLD, self.handle_sigchld)
+
+        with self.trace_span('bind socket'):
+            self.server = await start_unix_server(
+                self.client_handler,
+                path=self.helper_socket_path,
+            )
+            if self.fd_socket_path is not None:
+                self.fd_server_socket = socket(AF_UNIX, SOCK_STREAM)
+                self.fd_server_socket.setblocking(False)
+                self.fd_server_socket.bind(fspath(self.fd_socket_path))
+                self.fd_server_socket.listen()
+                self.fd_server_task = create_task(
+                    self.run_fd_server(self.fd_server_socket))
+
         if __debug__:
             print('Started unix server', flush=True)
-        self.termninator_watcher_task = create_task(self.termninator_watcher())
+
         if self.startup_args:
-            await self.run_command(self.startup_args)
+            with self.trace_span('startup command',
+                                 args_to_run=self.startup_args):
+                await self.run_command(self.startup_args)
+        else:
+            self.check_children()
 
     async def stop_async(self) -> None:
-
-        if (self.termninator_watcher_task is not None
-            and
-                not self.termninator_watcher_task.done()):
-            self.termninator_watcher_task.cancel()
-            await self.termninator_watcher_task
+        self.cancel_stop_timer()
+        get_event_loop().remove_signal_handler(SIGCHLD)
 
         if self.server is not None:
             self.server.close()
             await self.server.wait_closed()
 
+        if self.fd_server_task is not None:
+            self.fd_server_task.cancel()
+            try:
+                await self.fd_server_task
+            except CancelledError:
+                ...
+
+        if self.fd_server_socket is not None:
+            self.fd_server_socket.close()
+
         self.terminated.set()
 
         print('Terminated', flush=True)
@@ -416,6 +1176,34 @@ def get_helper_argument_parser() -> ArgumentParser:
         action='store_true',
     )
 
+    parser.add_argument(
+        '--trace',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--wait-for-run',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--linger-timeout',
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        '--termination-deadline',
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        '--max-concurrent-requests',
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        '--helper-socket',
+        default='/run/bubblehelp/helper.socket',
+    )
+
     parser.add_argument(
         'args_to_run',
         nargs=ARG_REMAINDER,
@@ -429,26 +1217,50 @@ def bubblejail_helper_main() -> None:
 
     parsed_args = parser.parse_args()
 
-    async def run_helper() -> None:
-        if not parsed_args.shell:
-            startup_args = parsed_args.args_to_run
+    tracer: Optional[TraceRecorder] = None
+    if parsed_args.trace:
+        try:
+            from .bubblejail_trace import TraceRecorder
+        except ImportError:
+            # Debug helper script is run without the package
+            print('Tracing is not available in helper script', flush=True)
         else:
-            startup_args = ['/bin/sh']
+            tracer = TraceRecorder(
+                process_name='bubblejail-helper',
+                enabled=True,
+            )
 
-        helper = BubblejailHelper(
-            startup_args=startup_args
-        )
+    if not parsed_args.shell:
+        startup_args = parsed_args.args_to_run
+    else:
+        startup_args = ['/bin/sh']
+
+    event_loop = get_event_loop()
+
+    helper = BubblejailHelper(
+        startup_args=startup_args,
+        helper_socket_path=parsed_args.helper_socket,
+        tracer=tracer,
+        wait_for_run=parsed_args.wait_for_run,
+        linger_timeout=parsed_args.linger_timeout,
+        termination_deadline=parsed_args.termination_deadline,
+        max_concurrent_requests=parsed_args.max_concurrent_requests,
+        fd_socket_path=path_join(
+            dirname(parsed_args.helper_socket), 'fds.socket'),
+    )
+
+    async def run_helper() -> None:
         await helper.start_async()
         await helper
 
-    event_loop = get_event_loop()
-    run_helper_task = event_loop.create_task(run_helper(), name='Run helper')
-    event_loop.add_signal_handler(SIGCHLD, handle_children)
-    event_loop.add_signal_handler(SIGTERM, terminate_children, run_helper_task)
+    event_loop.add_signal_handler(SIGTERM, helper.request_terminate)
     try:
-        event_loop.run_until_complete(run_helper_task)
-    except CancelledError:
-        print('Termninated by CancelledError')
+        event_loop.run_until_complete(run_helper())
+    finally:
+        if tracer is not None:
+            # Helper directory is shared with the host
+            tracer.save_json_lines(path_join(
+                dirname(parsed_args.helper_socket), 'trace.jsonl'))
 
 
 if __name__ == '__main__':
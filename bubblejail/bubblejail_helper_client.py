@@ -0,0 +1,294 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from asyncio import (CancelledError, Future, StreamReader, StreamWriter, Task,
+                     create_task, get_event_loop, open_unix_connection,
+                     wait_for)
+from json import loads as json_loads
+from pathlib import Path
+from socket import AF_UNIX, SOCK_STREAM, socket
+from types import TracebackType
+from typing import Callable, Dict, List, Optional, Type
+
+from .bubblejail_helper import (RPC_LINE_LIMIT, ExitRecord, FrameWriter,
+                                JsonRpcRequest, LineWriter, RequestExitHistory,
+                                RequestPing, RequestRun, RequestSetFraming,
+                                RpcFraming, RpcWriter, read_frame, send_fds)
+from .exceptions import HelperConnectionError
+
+# Called with stream name ('stdout' or 'stderr') and output chunk
+OutputHandler = Callable[[str, bytes], None]
+
+
+class HelperClient:
+    """Connection to the helper that can be reused for many requests
+
+    Requests can be sent concurrently. Responses are matched to
+    requests by id as helper sends them once ready.
+    Timeout of None waits for response forever.
+
+    Binary framing batches requests sent at the same time and
+    does not escape the output of streamed commands.
+    """
+
+    def __init__(self, helper_socket_path: Path,
+                 framing: RpcFraming = 'line'):
+        self.helper_socket_path = helper_socket_path
+        self.framing = framing
+
+        self.reader: Optional[StreamReader] = None
+        self.writer: Optional[StreamWriter] = None
+        self.rpc_writer: Optional[RpcWriter] = None
+        self.reader_task: Optional[Task[None]] = None
+
+        self.request_counter = 0
+        self.pending_responses: Dict[str, Future[bytes]] = {}
+        self.output_handlers: Dict[str, OutputHandler] = {}
+
+    async def connect(self) -> None:
+        (self.reader, self.writer) = await open_unix_connection(
+            path=self.helper_socket_path,
+            limit=RPC_LINE_LIMIT,
+        )
+        self.rpc_writer = LineWriter(self.writer)
+
+        if self.framing != 'line':
+            request = RequestSetFraming(
+                framing=self.framing,
+                request_id=self.next_request_id(),
+            )
+            await self.rpc_writer.send(request.to_json_byte_line())
+            # Nothing else is sent until framing is switched
+            if not await self.reader.readline():
+                raise HelperConnectionError(
+                    'Helper closed connection before response')
+
+            self.rpc_writer = FrameWriter(self.writer)
+
+        self.reader_task = create_task(self.read_responses())
+
+    async def close(self) -> None:
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except CancelledError:
+                ...
+
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+    async def __aenter__(self) -> HelperClient:
+        await self.connect()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    async def read_responses(self) -> None:
+        if self.reader is None:
+            raise HelperConnectionError('Client is not connected')
+
+        try:
+            while True:
+                if self.framing == 'line':
+                    line = await self.reader.readline()
+                    frame_messages = [(line, b'')] if line else None
+                else:
+                    frame_messages = await read_frame(self.reader)
+
+                if frame_messages is None:
+                    break
+
+                for header, body in frame_messages:
+                    self.handle_message(header, body)
+        finally:
+            for response_future in self.pending_responses.values():
+                if not response_future.done():
+                    response_future.set_exception(HelperConnectionError(
+                        'Helper closed connection before response'))
+
+            self.pending_responses.clear()
+
+    def handle_message(self, header: bytes, body: bytes) -> None:
+        message = json_loads(header)
+        if message.get('method') == 'output':
+            self.handle_output_notification(message['params'], body)
+            return
+
+        request_id = message['id']
+        response_future = self.pending_responses.pop(request_id, None)
+        # Future is gone if request timed out
+        if (response_future is not None
+                and not response_future.done()):
+            response_future.set_result(header)
+
+    def handle_output_notification(
+            self, params: Dict[str, str], body: bytes) -> None:
+        output_handler = self.output_handlers.get(params['request_id'])
+        if output_handler is None:
+            return
+
+        # Binary framing sends output in the body of message
+        if 'data' in params:
+            data = params['data'].encode('utf-8', 'surrogateescape')
+        else:
+            data = body
+
+        output_handler(params['stream'], data)
+
+    def next_request_id(self) -> str:
+        self.request_counter += 1
+        return str(self.request_counter)
+
+    async def send(self, request: JsonRpcRequest) -> None:
+        if self.rpc_writer is None:
+            raise HelperConnectionError('Client is not connected')
+
+        await self.rpc_writer.send(request.to_json_byte_line())
+
+    async def request(
+            self,
+            request: JsonRpcRequest,
+            timeout: Optional[float] = None) -> bytes:
+        """Sends request and returns response line"""
+        if self.reader_task is None or self.reader_task.done():
+            raise HelperConnectionError('Client is not connected')
+
+        if request.request_id is None:
+            request.request_id = self.next_request_id()
+
+        request_id = request.request_id
+        response_future: Future[bytes] = get_event_loop().create_future()
+        self.pending_responses[request_id] = response_future
+
+        try:
+            await self.send(request)
+            return await wait_for(response_future, timeout=timeout)
+        finally:
+            self.pending_responses.pop(request_id, None)
+
+    async def ping(self, timeout: Optional[float] = 3) -> None:
+        await self.request(RequestPing(), timeout=timeout)
+
+    async def run(
+            self,
+            args_to_run: List[str],
+            wait_response: bool = False,
+            timeout: Optional[float] = None) -> Optional[str]:
+        request = RequestRun(
+            args_to_run=args_to_run,
+            wait_response=wait_response,
+        )
+
+        if not wait_response:
+            # Helper does not respond to the commands
+            # that are not waited for
+            await self.send(request)
+            return None
+
+        return request.decode_response(
+            await self.request(request, timeout=timeout))
+
+    async def run_streaming(
+            self,
+            args_to_run: List[str],
+            output_handler: OutputHandler,
+            timeout: Optional[float] = None) -> int:
+        """Runs command passing its output to handler as it arrives
+
+        Returns exit code of the command.
+        """
+        request_id = self.next_request_id()
+        request = RequestRun(
+            args_to_run=args_to_run,
+            wait_response=True,
+            request_id=request_id,
+            stream_output=True,
+        )
+
+        self.output_handlers[request_id] = output_handler
+        try:
+            return request.decode_exit_code(
+                await self.request(request, timeout=timeout))
+        finally:
+            self.output_handlers.pop(request_id)
+
+    async def exit_history(
+            self, timeout: Optional[float] = 3) -> List[ExitRecord]:
+        request = RequestExitHistory()
+        return request.decode_response(
+            await self.request(request, timeout=timeout))
+
+
+async def run_with_fds(
+        fd_socket_path: Path,
+        args_to_run: List[str],
+        pass_stdio: bool = False,
+        file_fds: Optional[List[int]] = None,
+        wait_response: bool = True,
+        timeout: Optional[float] = None) -> Optional[int]:
+    """Runs command with descriptors of this process
+
+    Standard input, output and error are passed if pass_stdio is set.
+    Files are available to the command starting from descriptor 3.
+    Returns exit code if wait_response is set.
+    """
+    if file_fds is None:
+        file_fds = []
+
+    request = RequestRun(
+        args_to_run=args_to_run,
+        wait_response=wait_response,
+        pass_stdio=pass_stdio,
+        files_count=len(file_fds),
+    )
+
+    loop = get_event_loop()
+    with socket(AF_UNIX, SOCK_STREAM) as connection:
+        connection.setblocking(False)
+        await loop.sock_connect(connection, str(fd_socket_path))
+        # Descriptors are duplicated by kernel on send
+        send_fds(
+            connection,
+            request.to_json_byte_line(),
+            [0, 1, 2, *file_fds] if pass_stdio else file_fds,
+        )
+
+        if not wait_response:
+            return None
+
+        async def read_response() -> bytes:
+            response = b''
+            while not response.endswith(b'\n'):
+                data = await loop.sock_recv(connection, 4096)
+                if not data:
+                    raise HelperConnectionError(
+                        'Helper closed connection before response')
+
+                response += data
+
+            return response
+
+        return request.decode_exit_code(
+            await wait_for(read_response(), timeout=timeout))
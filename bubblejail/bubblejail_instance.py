@@ -15,33 +15,39 @@
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
 from asyncio import (CancelledError, Task, create_subprocess_exec, create_task,
-                     get_event_loop, open_unix_connection, wait_for)
+                     get_event_loop, sleep)
 from asyncio.subprocess import DEVNULL as asyncio_devnull
 from asyncio.subprocess import PIPE as asyncio_pipe
 from asyncio.subprocess import STDOUT as asyncio_stdout
 from asyncio.subprocess import Process
-from os import environ, kill
+from os import O_DIRECTORY, O_RDONLY, close, environ, fsync, getpid, kill
+from os import open as os_open
+from os import replace, unlink
 from pathlib import Path
 from signal import SIGTERM
 from socket import AF_UNIX, SOCK_STREAM, SocketType, socket
-from tempfile import TemporaryDirectory, TemporaryFile
-from typing import (IO, Any, Generator, List, MutableMapping, Optional, Set,
-                    Type, TypedDict, cast)
+from tempfile import TemporaryDirectory
+from typing import (IO, Any, Dict, Generator, List, Optional, Set, Tuple, Type,
+                    TypedDict, TypeVar, cast)
 
 from toml import dump as toml_dump
 from toml import loads as toml_loads
 from xdg.BaseDirectory import get_runtime_dir
 
-from .bubblejail_helper import RequestRun
-from .bubblejail_seccomp import SeccompState
-from .bubblejail_utils import (BubblejailSettings, FILE_NAME_METADATA,
-                               FILE_NAME_SERVICES)
-from .bwrap_config import (Bind, BwrapConfigBase, DbusSessionArgs,
-                           DbusSystemArgs, EnvrimentalVar, FileTransfer,
-                           LaunchArguments, SeccompDirective)
+from .bubblejail_fast_run import rewrite_home_arguments
+from .bubblejail_helper_client import HelperClient, OutputHandler, run_with_fds
+from .bubblejail_trace import TraceRecorder
+from .bubblejail_utils import (FILE_NAME_METADATA, FILE_NAME_SERVICES,
+                               BubblejailSettings, copy_data_to_memfd,
+                               copy_file_to_memfd)
+from .bwrap_config import Bind, EnvrimentalVar, FileTransfer
+from .config_cache import load_toml
 from .exceptions import BubblejailException
+from .launch_plan import LaunchPlan, LaunchPlanCache
 from .services import ServiceContainer as BubblejailInstanceConfig
-from .services import ServicesConfDictType, ServiceWantsHomeBind
+from .services import ServicesConfDictType
+
+T = TypeVar('T')
 
 
 def sigterm_bubblejail_handler(bwrap_pid: int) -> None:
@@ -53,13 +59,6 @@ def sigterm_bubblejail_handler(bwrap_pid: int) -> None:
     # No need to wait as the bwrap should terminate when helper exits
 
 
-def copy_data_to_temp_file(data: bytes) -> IO[bytes]:
-    temp_file = TemporaryFile()
-    temp_file.write(data)
-    temp_file.seek(0)
-    return temp_file
-
-
 async def process_watcher(process: Process) -> None:
     """Reads stdout of process and prints"""
     process_stdout = process.stdout
@@ -89,7 +88,8 @@ class ConfDict(TypedDict, total=False):
 
 class BubblejailInstance:
 
-    def __init__(self, instance_home: Path):
+    def __init__(self, instance_home: Path,
+                 runtime_dir: Optional[Path] = None):
         self.name = instance_home.stem
         # Instance directory located at $XDG_DATA_HOME/bubblejail/
         self.instance_directory = instance_home
@@ -99,8 +99,14 @@ class BubblejailInstance:
             raise BubblejailException("Instance directory does not exist")
 
         # Run-time directory
-        self.runtime_dir: Path = Path(
-            get_runtime_dir() + f'/bubblejail/{self.name}')
+        # Pre-warmed sandboxes of the pool have their own
+        if runtime_dir is None:
+            runtime_dir = Path(
+                get_runtime_dir() + f'/bubblejail/{self.name}')
+
+        self.runtime_dir: Path = runtime_dir
+
+        self._metadata: Optional['BubblejailInstanceMetadata'] = None
 
     # region Paths
 
@@ -125,6 +131,16 @@ class BubblejailInstance:
     def path_runtime_helper_socket(self) -> Path:
         return self.path_runtime_helper_dir / 'helper.socket'
 
+    @property
+    def path_runtime_helper_fd_socket(self) -> Path:
+        """Socket for requests that pass file descriptors"""
+        return self.path_runtime_helper_dir / 'fds.socket'
+
+    @property
+    def path_runtime_helper_trace(self) -> Path:
+        """Trace events written by helper"""
+        return self.path_runtime_helper_dir / 'trace.jsonl'
+
     @property
     def path_runtime_dbus_session_socket(self) -> Path:
         return self.runtime_dir / 'dbus_session_proxy'
@@ -133,55 +149,44 @@ class BubblejailInstance:
     def path_runtime_dbus_system_socket(self) -> Path:
         return self.runtime_dir / 'dbus_system_proxy'
 
-    # endregion Paths
+    @property
+    def path_runtime_pool_dir(self) -> Path:
+        """Run-time directory of the pre-warmed sandbox pool"""
+        return Path(get_runtime_dir() + f'/bubblejail-pool/{self.name}')
 
-    # region Metadata
+    @property
+    def path_runtime_pool_socket(self) -> Path:
+        return self.path_runtime_pool_dir / 'pool.socket'
 
-    def _get_metadata_dict(self) -> MutableMapping[Any, Any]:
-        try:
-            with open(self.path_metadata_file) as metadata_file:
-                return toml_loads(metadata_file.read())
-        except FileNotFoundError:
-            return {}
+    # endregion Paths
 
-    def _save_metadata_key(self, key: str, value: Any) -> None:
-        toml_dict = self._get_metadata_dict()
-        toml_dict[key] = value
+    # region Metadata
 
-        with open(self.path_metadata_file, mode='w') as metadata_file:
-            toml_dump(toml_dict, metadata_file)
+    @property
+    def metadata(self) -> 'BubblejailInstanceMetadata':
+        """Metadata loaded once per instance object"""
+        if self._metadata is None:
+            self._metadata = BubblejailInstanceMetadata(self)
 
-    def _get_metadata_value(self, key: str) -> Optional[str]:
-        try:
-            value = self._get_metadata_dict()[key]
-            if isinstance(value, str):
-                return value
-            else:
-                raise TypeError(f"Expected str, got {value}")
-        except KeyError:
-            return None
+        return self._metadata
 
     @property
     def metadata_creation_profile_name(self) -> Optional[str]:
-        return self._get_metadata_value('creation_profile_name')
+        return self.metadata.creation_profile_name
 
     @metadata_creation_profile_name.setter
     def metadata_creation_profile_name(self, profile_name: str) -> None:
-        self._save_metadata_key(
-            key='creation_profile_name',
-            value=profile_name,
-        )
+        with self.metadata as metadata:
+            metadata.creation_profile_name = profile_name
 
     @property
     def metadata_desktop_entry_name(self) -> Optional[str]:
-        return self._get_metadata_value('desktop_entry_name')
+        return self.metadata.desktop_entry_name
 
     @metadata_desktop_entry_name.setter
     def metadata_desktop_entry_name(self, desktop_entry_name: str) -> None:
-        self._save_metadata_key(
-            key='desktop_entry_name',
-            value=desktop_entry_name,
-        )
+        with self.metadata as metadata:
+            metadata.desktop_entry_name = desktop_entry_name
 
     # endregion Metadata
 
@@ -193,10 +198,10 @@ class BubblejailInstance:
             self,
             config_contents: Optional[str] = None) -> BubblejailInstanceConfig:
 
-        if config_contents is None:
-            config_contents = self._read_config_file()
-
-        conf_dict = cast(ServicesConfDictType, toml_loads(config_contents))
+        conf_dict = cast(
+            ServicesConfDictType,
+            load_toml(self.path_config_file, config_contents),
+        )
 
         return BubblejailInstanceConfig(conf_dict)
 
@@ -204,38 +209,62 @@ class BubblejailInstance:
         with open(self.path_config_file, mode='w') as conf_file:
             toml_dump(config.get_service_conf_dict(), conf_file)
 
+    def helper_client(self) -> HelperClient:
+        """Returns connection to the helper of running instance
+
+        Use as async context manager to send several requests
+        over the same connection.
+        """
+        return HelperClient(self.path_runtime_helper_socket)
+
     async def send_run_rpc(
         self,
         args_to_run: List[str],
         wait_for_response: bool = False,
+        timeout: Optional[float] = None,
     ) -> Optional[str]:
-        (reader, writer) = await open_unix_connection(
-            path=self.path_runtime_helper_socket,
-        )
+        async with self.helper_client() as client:
+            return await client.run(
+                args_to_run=args_to_run,
+                wait_response=wait_for_response,
+                timeout=timeout,
+            )
 
-        request = RequestRun(
+    async def stream_run_rpc(
+        self,
+        args_to_run: List[str],
+        output_handler: OutputHandler,
+    ) -> int:
+        """Runs command passing output to handler as it arrives
+
+        Returns exit code of the command.
+        """
+        async with self.helper_client() as client:
+            return await client.run_streaming(
+                args_to_run=args_to_run,
+                output_handler=output_handler,
+            )
+
+    async def send_run_rpc_with_fds(
+        self,
+        args_to_run: List[str],
+        pass_stdio: bool = False,
+        file_fds: Optional[List[int]] = None,
+    ) -> int:
+        """Runs command with descriptors of this process
+
+        Returns exit code of the command.
+        """
+        exit_code = await run_with_fds(
+            fd_socket_path=self.path_runtime_helper_fd_socket,
             args_to_run=args_to_run,
-            wait_response=wait_for_response,
+            pass_stdio=pass_stdio,
+            file_fds=file_fds,
         )
-        writer.write(request.to_json_byte_line())
-        await writer.drain()
+        if exit_code is None:
+            raise TypeError('Expected exit code')
 
-        try:
-            if wait_for_response:
-                data: Optional[str] \
-                    = request.decode_response(
-                        await wait_for(
-                            fut=reader.readline(),
-                            timeout=3,
-                        )
-                )
-            else:
-                data = None
-        finally:
-            writer.close()
-            await writer.wait_closed()
-
-        return data
+        return exit_code
 
     def is_running(self) -> bool:
         return self.path_runtime_helper_socket.is_socket()
@@ -244,14 +273,7 @@ class BubblejailInstance:
             self,
             arguments: List[str]) -> Generator[str, None, None]:
         """Rewrites real user home with sandboxed one."""
-        user_real_home_str = str(Path.home())
-        sandbox_home = '/home/user'
-
-        for arg in arguments:
-            if arg.startswith(user_real_home_str):
-                yield arg.replace(user_real_home_str, sandbox_home, 1)
-            else:
-                yield arg
+        yield from rewrite_home_arguments(arguments)
 
     async def async_run_init(
         self,
@@ -261,21 +283,33 @@ class BubblejailInstance:
         debug_helper_script: Optional[Path] = None,
         debug_log_dbus: bool = False,
         extra_bwrap_args: Optional[List[str]] = None,
+        use_launch_plan_cache: bool = True,
+        trace_path: Optional[Path] = None,
     ) -> None:
 
-        instance_config = self._read_config()
+        tracer = TraceRecorder(
+            process_name='bubblejail',
+            enabled=trace_path is not None,
+        )
+
+        # Config is only parsed if there is no cached launch plan
+        with tracer.span('read config'):
+            config_contents = self._read_config_file()
 
         # Create init
         init = BubblejailInit(
             parent=self,
-            instance_config=instance_config,
+            config_contents=config_contents,
             is_shell_debug=debug_shell,
             is_helper_debug=debug_helper_script is not None,
             is_log_dbus=debug_log_dbus,
+            use_launch_plan_cache=use_launch_plan_cache,
+            tracer=tracer,
+            trace_path=trace_path,
         )
 
         async with init:
-            bwrap_args = ['/usr/bin/bwrap']
+            bwrap_args = [BubblejailSettings.BWRAP_PATH_STR]
             # Pass option args file descriptor
             bwrap_args.append('--args')
             bwrap_args.append(str(init.get_args_file_descriptor()))
@@ -297,6 +331,11 @@ class BubblejailInstance:
             if debug_shell:
                 bwrap_args.append('--shell')
 
+            if tracer.enabled:
+                bwrap_args.append('--trace')
+
+            bwrap_args.extend(init.helper_args)
+
             if not args_to_run:
                 bwrap_args.extend(init.executable_args)
             else:
@@ -314,14 +353,22 @@ class BubblejailInstance:
 
                 return
 
-            bwrap_process = await create_subprocess_exec(
-                *bwrap_args,
-                pass_fds=init.file_descriptors_to_pass,
-                stdout=(asyncio_pipe
-                        if not debug_shell
-                        else None),
-                stderr=asyncio_stdout,
-            )
+            with tracer.span('bwrap exec'):
+                bwrap_process = await create_subprocess_exec(
+                    *bwrap_args,
+                    pass_fds=init.file_descriptors_to_pass,
+                    stdout=(asyncio_pipe
+                            if not debug_shell
+                            else None),
+                    stderr=asyncio_stdout,
+                )
+
+            if tracer.enabled:
+                init.trace_helper_startup_task = create_task(
+                    init.trace_helper_startup(),
+                    name='trace helper startup',
+                )
+
             if __debug__:
                 print(f"Bubblewrap started. PID: {repr(bwrap_process)}")
 
@@ -375,19 +422,30 @@ class BubblejailInit:
     def __init__(
         self,
         parent: BubblejailInstance,
-        instance_config: BubblejailInstanceConfig,
+        config_contents: str,
         is_shell_debug: bool = False,
         is_helper_debug: bool = False,
         is_log_dbus: bool = False,
+        use_launch_plan_cache: bool = True,
+        tracer: Optional[TraceRecorder] = None,
+        trace_path: Optional[Path] = None,
     ) -> None:
+        self.parent = parent
         self.home_bind_path = parent.path_home_directory
         self.runtime_dir = parent.runtime_dir
-        # Prevent our temporary file from being garbage collected
+        # Prevent our memory files from being garbage collected
         self.temp_files: List[IO[bytes]] = []
         self.file_descriptors_to_pass: List[int] = []
         # Helper
         self.helper_runtime_dir = parent.path_runtime_helper_dir
         self.helper_socket_path = parent.path_runtime_helper_socket
+        self.helper_fd_socket_path = parent.path_runtime_helper_fd_socket
+        self.helper_trace_path = parent.path_runtime_helper_trace
+
+        # Tracing
+        self.tracer = tracer if tracer is not None else TraceRecorder()
+        self.trace_path = trace_path
+        self.trace_helper_startup_task: Optional[Task[None]] = None
 
         # Args to dbus proxy
         self.dbus_proxy_args: List[str] = []
@@ -408,21 +466,54 @@ class BubblejailInit:
         self.is_shell_debug = is_shell_debug
         self.is_log_dbus = is_log_dbus
         # Instance config
-        self.instance_config = instance_config
+        self.config_contents = config_contents
+        self.use_launch_plan_cache = use_launch_plan_cache
 
         # Tasks
         self.watch_dbus_proxy_task: Optional[Task[None]] = None
 
         # Executable args
         self.executable_args: List[str] = []
+        # Extra args to helper
+        self.helper_args: List[str] = []
+        # Environment variables the launch plan was made with
+        self.launch_environ_vars: Set[str] = set()
+
+    def get_launch_plan_cache(self) -> LaunchPlanCache:
+        return LaunchPlanCache(
+            instance_name=self.parent.name,
+            home_bind_path=self.home_bind_path,
+            config_contents=self.config_contents,
+        )
+
+    def get_launch_plan(self) -> LaunchPlan:
+        plan_cache: Optional[LaunchPlanCache] = None
+        if self.use_launch_plan_cache:
+            plan_cache = self.get_launch_plan_cache()
+            with self.tracer.span('launch plan cache load'):
+                cached_plan = plan_cache.load()
+
+            if cached_plan is not None:
+                return cached_plan
+
+        with self.tracer.span('parse config'):
+            instance_config = self.parent._read_config(self.config_contents)
+
+        launch_plan = LaunchPlan.from_services(
+            instance_config=instance_config,
+            home_bind_path=self.home_bind_path,
+            tracer=self.tracer,
+        )
+
+        if plan_cache is not None:
+            plan_cache.store(launch_plan)
+
+        return launch_plan
 
     def genetate_args(self) -> None:
         # TODO: Reorganize the order to allow for
         # better binding multiple resources in same filesystem path
 
-        dbus_session_opts: Set[str] = set()
-        dbus_system_opts: Set[str] = set()
-        seccomp_state: Optional[SeccompState] = None
         # Unshare all
         self.bwrap_options_args.append('--unshare-all')
         # Die with parent
@@ -448,53 +539,44 @@ class BubblejailInit:
         for e in environ:
             self.bwrap_options_args.extend(('--unsetenv', e))
 
-        for service in self.instance_config.iter_services():
-            config_iterator = service.__iter__()
+        launch_plan = self.get_launch_plan()
+        self.launch_environ_vars = launch_plan.environ_vars
+
+        for step in launch_plan.bwrap_options:
+            if isinstance(step, FileTransfer):
+                # Copy files
+                with self.tracer.span('memfd create', dest=step.dest):
+                    if isinstance(step.content, bytes):
+                        memfd = copy_data_to_memfd(step.dest, step.content)
+                    else:
+                        memfd = copy_file_to_memfd(step.dest, step.content)
+                self.temp_files.append(memfd)
+                memfd_descriptor = memfd.fileno()
+                self.file_descriptors_to_pass.append(memfd_descriptor)
+                self.bwrap_options_args.extend(
+                    ('--file', str(memfd_descriptor), step.dest))
+            else:
+                self.bwrap_options_args.extend(step)
 
-            while True:
-                try:
-                    config = next(config_iterator)
-                except StopIteration:
-                    break
+        self.executable_args.extend(launch_plan.executable_args)
+        self.helper_args.extend(launch_plan.helper_args)
+
+        if launch_plan.seccomp_directives:
+            # Seccomp loads libseccomp with ctypes, only cold launch needs it
+            from .bubblejail_seccomp import SeccompState
+
+            seccomp_state = SeccompState()
+            for directive in launch_plan.seccomp_directives:
+                seccomp_state.add_directive(directive)
 
-                # When we need to send something to generator
-                if isinstance(config, ServiceWantsHomeBind):
-                    config = config_iterator.send(self.home_bind_path)
-
-                if isinstance(config, BwrapConfigBase):
-                    self.bwrap_options_args.extend(config.to_args())
-                elif isinstance(config, FileTransfer):
-                    # Copy files
-                    temp_f = copy_data_to_temp_file(config.content)
-                    self.temp_files.append(temp_f)
-                    temp_file_descriptor = temp_f.fileno()
-                    self.file_descriptors_to_pass.append(
-                        temp_file_descriptor)
-                    self.bwrap_options_args.extend(
-                        ('--file', str(temp_file_descriptor), config.dest))
-                elif isinstance(config, DbusSessionArgs):
-                    dbus_session_opts.add(config.to_args())
-                elif isinstance(config, DbusSystemArgs):
-                    dbus_system_opts.add(config.to_args())
-                elif isinstance(config, SeccompDirective):
-                    if seccomp_state is None:
-                        seccomp_state = SeccompState()
-
-                    seccomp_state.add_directive(config)
-                elif isinstance(config, LaunchArguments):
-                    # TODO: implement priority
-                    self.executable_args.extend(config.launch_args)
-                else:
-                    raise TypeError('Unknown bwrap config.')
-
-        if seccomp_state is not None:
             if __debug__:
                 seccomp_state.print()
 
-            seccomp_temp_file = seccomp_state.export_to_temp_file()
-            seccomp_fd = seccomp_temp_file.fileno()
+            with self.tracer.span('seccomp compile'):
+                seccomp_memfd = seccomp_state.export_to_memfd()
+            seccomp_fd = seccomp_memfd.fileno()
             self.file_descriptors_to_pass.append(seccomp_fd)
-            self.temp_files.append(seccomp_temp_file)
+            self.temp_files.append(seccomp_memfd)
             self.bwrap_options_args.extend(('--seccomp', str(seccomp_fd)))
 
         env_dbus_session_addr = 'DBUS_SESSION_BUS_ADDRESS'
@@ -506,7 +588,7 @@ class BubblejailInit:
             str(self.dbus_session_socket_path),
         ))
 
-        self.dbus_proxy_args.extend(dbus_session_opts)
+        self.dbus_proxy_args.extend(launch_plan.dbus_session_opts)
         self.dbus_proxy_args.append('--filter')
         if self.is_log_dbus:
             self.dbus_proxy_args.append('--log')
@@ -557,16 +639,35 @@ class BubblejailInit:
     def get_args_file_descriptor(self) -> int:
         options_null = '\0'.join(self.bwrap_options_args)
 
-        args_tempfile = copy_data_to_temp_file(options_null.encode())
-        args_tempfile_fileno = args_tempfile.fileno()
-        self.file_descriptors_to_pass.append(args_tempfile_fileno)
-        self.temp_files.append(args_tempfile)
+        with self.tracer.span('memfd create', dest='args'):
+            args_memfd = copy_data_to_memfd('args', options_null.encode())
+        args_memfd_fileno = args_memfd.fileno()
+        self.file_descriptors_to_pass.append(args_memfd_fileno)
+        self.temp_files.append(args_memfd)
 
-        return args_tempfile_fileno
+        return args_memfd_fileno
+
+    async def trace_helper_startup(self) -> None:
+        client = HelperClient(self.helper_socket_path)
+        with self.tracer.span('helper socket appearance'):
+            while True:
+                try:
+                    await client.connect()
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # Socket might be bound but not listening yet
+                    await sleep(0.001)
+
+        try:
+            with self.tracer.span('first rpc ping'):
+                await client.ping(timeout=None)
+        finally:
+            await client.close()
 
     async def __aenter__(self) -> None:
         # Generate args
-        self.genetate_args()
+        with self.tracer.span('generate args'):
+            self.genetate_args()
 
         # Create runtime dir
         # If the dir exists exception will be raised indicating that
@@ -587,14 +688,15 @@ class BubblejailInit:
 
         # Pylint does not recognize *args for some reason
         # pylint: disable=E1120
-        self.dbus_proxy_process = await create_subprocess_exec(
-            *self.dbus_proxy_args,
-            stdout=(asyncio_pipe
-                    if not self.is_shell_debug
-                    else asyncio_devnull),
-            stderr=asyncio_stdout,
-            stdin=asyncio_devnull,
-        )
+        with self.tracer.span('dbus proxy spawn'):
+            self.dbus_proxy_process = await create_subprocess_exec(
+                *self.dbus_proxy_args,
+                stdout=(asyncio_pipe
+                        if not self.is_shell_debug
+                        else asyncio_devnull),
+                stderr=asyncio_stdout,
+                stdin=asyncio_devnull,
+            )
 
         self.watch_dbus_proxy_task = create_task(
             process_watcher(self.dbus_proxy_process),
@@ -608,6 +710,26 @@ class BubblejailInit:
         traceback: Any,  # ???: What type is traceback
     ) -> None:
         # Cleanup
+        if (
+            self.trace_helper_startup_task is not None
+            and
+            not self.trace_helper_startup_task.done()
+        ):
+            self.trace_helper_startup_task.cancel()
+            try:
+                await self.trace_helper_startup_task
+            except CancelledError:
+                ...
+
+        if self.trace_path is not None:
+            self.tracer.save_trace(
+                self.trace_path,
+                json_lines_paths=(self.helper_trace_path, ),
+            )
+
+        if self.helper_trace_path.exists():
+            self.helper_trace_path.unlink()
+
         if (
             self.watch_dbus_proxy_task is not None
             and
@@ -632,6 +754,9 @@ class BubblejailInit:
         if self.helper_socket_path.exists():
             self.helper_socket_path.unlink()
 
+        if self.helper_fd_socket_path.exists():
+            self.helper_fd_socket_path.unlink()
+
         self.helper_runtime_dir.rmdir()
 
         if self.dbus_session_socket_path.exists():
@@ -667,12 +792,111 @@ class BubblejailProfile:
 
 
 class BubblejailInstanceMetadata:
-    def __init__(
-        self,
-        parent: BubblejailInstance,
-        creation_profile_name: Optional[str] = None,
-        desktop_entry_name: Optional[str] = None,
-    ):
+    """Metadata file loaded once
+
+    Changed values are written together when the outermost 'with'
+    block exits or commit() is called. Changes are merged in to the
+    current file which is replaced with a fully written temporary
+    file so readers never see it partially written.
+    """
+
+    def __init__(self, parent: BubblejailInstance):
         self.parent = parent
-        self.creation_profile_name = creation_profile_name
-        self.desktop_entry_name = desktop_entry_name
+        self.metadata_dict: Dict[str, Any] = self._load()
+        self.changed_values: Dict[str, Any] = {}
+        self._session_depth = 0
+        self._session_snapshot: Tuple[Dict[str, Any], Dict[str, Any]] = (
+            {}, {})
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            return load_toml(self.parent.path_metadata_file)
+        except FileNotFoundError:
+            return {}
+
+    def get_value(self, key: str, value_type: Type[T]) -> Optional[T]:
+        try:
+            value = self.metadata_dict[key]
+        except KeyError:
+            return None
+
+        if not isinstance(value, value_type):
+            raise TypeError(f"Expected {value_type.__name__}, got {value}")
+
+        return value
+
+    def set_value(self, key: str, value: Any) -> None:
+        self.metadata_dict[key] = value
+        self.changed_values[key] = value
+
+    @property
+    def creation_profile_name(self) -> Optional[str]:
+        return self.get_value('creation_profile_name', str)
+
+    @creation_profile_name.setter
+    def creation_profile_name(self, profile_name: str) -> None:
+        self.set_value('creation_profile_name', profile_name)
+
+    @property
+    def desktop_entry_name(self) -> Optional[str]:
+        return self.get_value('desktop_entry_name', str)
+
+    @desktop_entry_name.setter
+    def desktop_entry_name(self, desktop_entry_name: str) -> None:
+        self.set_value('desktop_entry_name', desktop_entry_name)
+
+    def commit(self) -> None:
+        if not self.changed_values:
+            return
+
+        # Keep values written by others since the file was loaded
+        metadata_dict = self._load()
+        metadata_dict.update(self.changed_values)
+
+        metadata_path = self.parent.path_metadata_file
+        temp_path = metadata_path.with_name(
+            f".{metadata_path.name}.{getpid()}")
+        try:
+            with open(temp_path, mode='w') as temp_file:
+                toml_dump(metadata_dict, temp_file)
+                temp_file.flush()
+                fsync(temp_file.fileno())
+
+            replace(temp_path, metadata_path)
+        except BaseException:
+            try:
+                unlink(temp_path)
+            except FileNotFoundError:
+                ...
+            raise
+
+        # Rename is only durable once directory is synced
+        directory_fd = os_open(metadata_path.parent, O_RDONLY | O_DIRECTORY)
+        try:
+            fsync(directory_fd)
+        finally:
+            close(directory_fd)
+
+        self.metadata_dict = metadata_dict
+        self.changed_values.clear()
+
+    def __enter__(self) -> 'BubblejailInstanceMetadata':
+        if self._session_depth == 0:
+            self._session_snapshot = (
+                dict(self.metadata_dict), dict(self.changed_values))
+
+        self._session_depth += 1
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Any) -> None:
+        self._session_depth -= 1
+        if self._session_depth != 0:
+            return
+
+        if exc_type is None:
+            self.commit()
+        else:
+            # Changes of failed session should not be written by next one
+            self.metadata_dict, self.changed_values = self._session_snapshot
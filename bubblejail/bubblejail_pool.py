@@ -0,0 +1,416 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import (AbstractServer, CancelledError, Event, StreamReader,
+                     StreamWriter, Task, create_subprocess_exec, create_task,
+                     gather, get_event_loop, open_unix_connection, sleep,
+                     start_unix_server)
+from asyncio.subprocess import PIPE as asyncio_pipe
+from asyncio.subprocess import STDOUT as asyncio_stdout
+from asyncio.subprocess import Process
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import environ, readlink
+from signal import SIGINT, SIGTERM
+from time import monotonic
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+from .bubblejail_instance import (BubblejailInit, BubblejailInstance,
+                                  process_watcher, sigterm_bubblejail_handler)
+from .bubblejail_utils import BubblejailSettings, RefillStrategy
+from .exceptions import BubblejailException
+
+PoolResponse = Dict[str, Any]
+
+# Claim requests carry the client environment
+POOL_REQUEST_LIMIT = 2 * 1024 * 1024
+
+
+class PooledSandbox:
+    def __init__(self, instance: BubblejailInstance):
+        # Instance with its own run-time directory
+        self.instance = instance
+        self.bwrap_process: Optional[Process] = None
+        self.executable_args: List[str] = []
+        # Configuration and host facts sandbox was started with
+        self.config_contents = ''
+        self.launch_environ_vars: Set[str] = set()
+        self.launch_digest = ''
+        self.is_ready = False
+        self.is_claimed = False
+        # Stopped because configuration or host changed
+        self.is_stale = False
+        self.ready_since = 0.0
+        self.task: Optional[Task[None]] = None
+
+    async def wait_helper_ready(self, watcher_task: Task[None]) -> None:
+        while True:
+            if watcher_task.done():
+                raise BubblejailException(
+                    'Sandbox exited before helper started')
+
+            try:
+                (_, writer) = await open_unix_connection(
+                    path=self.instance.path_runtime_helper_socket,
+                )
+            except (FileNotFoundError, ConnectionRefusedError):
+                await sleep(0.01)
+                continue
+
+            writer.close()
+            await writer.wait_closed()
+            return
+
+    def get_launch_digest(self, config_contents: str,
+                          host_environ: Mapping[str, str]) -> str:
+        from .launch_plan import LaunchPlanCache
+
+        return LaunchPlanCache(
+            instance_name=self.instance.name,
+            home_bind_path=self.instance.path_home_directory,
+            config_contents=config_contents,
+        ).get_launch_digest(self.launch_environ_vars, host_environ)
+
+    def stop(self) -> None:
+        if (self.bwrap_process is None
+                or self.bwrap_process.returncode is not None):
+            return
+
+        try:
+            sigterm_bubblejail_handler(self.bwrap_process.pid)
+        except (OSError, IndexError):
+            # Helper has not been started yet
+            self.bwrap_process.terminate()
+
+
+class SandboxPool:
+    """Keeps pre-warmed sandboxes of an instance
+
+    Sandboxes run helper without startup command. Claiming sandbox
+    links the instance run-time directory to the sandbox one, after
+    that the sandbox is used as a running instance.
+    """
+
+    def __init__(
+        self,
+        instance: BubblejailInstance,
+        size: int = 1,
+        idle_timeout: float = 600,
+        refill_strategy: RefillStrategy = 'eager',
+    ) -> None:
+        self.instance = instance
+        self.size = size
+        # Zero disables eviction
+        self.idle_timeout = idle_timeout
+        self.refill_strategy = refill_strategy
+
+        self.sandboxes: List[PooledSandbox] = []
+        self.sandbox_counter = 0
+        # Set when idle sandboxes were evicted or failed to start.
+        # Refill is postponed until the next claim.
+        self.is_dormant = False
+        self.is_stopping = False
+
+        self.server: Optional[AbstractServer] = None
+        self.eviction_task: Optional[Task[None]] = None
+        self.stop_event = Event()
+
+    # region Sandboxes
+
+    def refill(self) -> None:
+        if self.is_dormant or self.is_stopping:
+            return
+
+        if self.refill_strategy == 'eager':
+            sandboxes_number = len(
+                [x for x in self.sandboxes if not x.is_claimed])
+        else:
+            sandboxes_number = len(self.sandboxes)
+
+        for _ in range(self.size - sandboxes_number):
+            self.start_sandbox()
+
+    def start_sandbox(self) -> None:
+        self.sandbox_counter += 1
+        sandbox = PooledSandbox(
+            BubblejailInstance(
+                instance_home=self.instance.instance_directory,
+                runtime_dir=(self.instance.path_runtime_pool_dir
+                             / f"sandbox-{self.sandbox_counter}"),
+            )
+        )
+        self.sandboxes.append(sandbox)
+        sandbox.task = create_task(
+            self.run_sandbox(sandbox),
+            name=f"sandbox {self.sandbox_counter}",
+        )
+
+    async def run_sandbox(self, sandbox: PooledSandbox) -> None:
+        try:
+            sandbox.config_contents = sandbox.instance._read_config_file()
+            init = BubblejailInit(
+                parent=sandbox.instance,
+                config_contents=sandbox.config_contents,
+            )
+
+            async with init:
+                sandbox.launch_environ_vars = init.launch_environ_vars
+                sandbox.launch_digest = sandbox.get_launch_digest(
+                    sandbox.config_contents, environ)
+
+                bwrap_args = [
+                    BubblejailSettings.BWRAP_PATH_STR,
+                    '--args', str(init.get_args_file_descriptor()),
+                    BubblejailSettings.HELPER_PATH_STR,
+                    '--wait-for-run',
+                    *init.helper_args,
+                ]
+                sandbox.executable_args = init.executable_args
+
+                sandbox.bwrap_process = await create_subprocess_exec(
+                    *bwrap_args,
+                    pass_fds=init.file_descriptors_to_pass,
+                    stdout=asyncio_pipe,
+                    stderr=asyncio_stdout,
+                )
+                watcher_task = create_task(
+                    process_watcher(sandbox.bwrap_process),
+                    name='bwrap main',
+                )
+
+                await sandbox.wait_helper_ready(watcher_task)
+                sandbox.is_ready = True
+                sandbox.ready_since = monotonic()
+
+                await watcher_task
+        except (BubblejailException, OSError) as e:
+            print('Failed to start sandbox:', e)
+        finally:
+            self.sandboxes.remove(sandbox)
+            self.release_claim(sandbox)
+
+            if not sandbox.is_ready and not sandbox.is_claimed:
+                # Do not restart sandboxes that fail to start
+                self.is_dormant = True
+
+            self.refill()
+
+    def release_claim(self, sandbox: PooledSandbox) -> None:
+        runtime_link = self.instance.runtime_dir
+
+        if (
+            sandbox.is_claimed
+            and
+            runtime_link.is_symlink()
+            and
+            readlink(runtime_link) == str(sandbox.instance.runtime_dir)
+        ):
+            runtime_link.unlink()
+
+    def claim(
+        self,
+        host_environ: Optional[Mapping[str, str]] = None,
+    ) -> PoolResponse:
+        """Claims ready sandbox started with current configuration
+
+        Host environment is the one of the launching client.
+        Sandboxes started with different configuration or host
+        facts are stopped and the client launches cold.
+        """
+        if self.is_dormant:
+            self.is_dormant = False
+            self.refill()
+
+        runtime_link = self.instance.runtime_dir
+        if runtime_link.exists() or runtime_link.is_symlink():
+            return {'error': 'Instance is already running'}
+
+        try:
+            config_contents = self.instance._read_config_file()
+        except OSError:
+            return {'error': 'Failed to read instance configuration'}
+
+        if host_environ is None:
+            host_environ = environ
+
+        for sandbox in self.sandboxes:
+            if not sandbox.is_ready or sandbox.is_claimed or sandbox.is_stale:
+                continue
+
+            if sandbox.launch_digest == sandbox.get_launch_digest(
+                    config_contents, host_environ):
+                break
+
+            # Edited configuration or changed host.
+            # Replacement is started once it exits.
+            sandbox.is_stale = True
+            sandbox.stop()
+        else:
+            return {'error': 'No pre-warmed sandbox is ready'}
+
+        runtime_link.parent.mkdir(parents=True, exist_ok=True)
+        runtime_link.symlink_to(sandbox.instance.runtime_dir)
+        sandbox.is_claimed = True
+
+        if self.refill_strategy == 'eager':
+            self.refill()
+
+        return {'result': {'executable_args': sandbox.executable_args}}
+
+    async def evict_idle_sandboxes(self) -> None:
+        check_interval = max(1.0, self.idle_timeout / 10)
+        while True:
+            await sleep(check_interval)
+
+            current_time = monotonic()
+            for sandbox in self.sandboxes:
+                if (
+                    sandbox.is_ready
+                    and
+                    not sandbox.is_claimed
+                    and
+                    current_time - sandbox.ready_since > self.idle_timeout
+                ):
+                    self.is_dormant = True
+                    sandbox.stop()
+
+    # endregion Sandboxes
+
+    async def client_handler(
+            self,
+            reader: StreamReader,
+            writer: StreamWriter) -> None:
+
+        line = await reader.readline()
+        if line:
+            request = json_loads(line)
+            method = request.get('method')
+            if method == 'claim':
+                params = request.get('params') or {}
+                response = self.claim(params.get('environ'))
+            elif method == 'ping':
+                response = {'result': 'pong'}
+            else:
+                response = {'error': 'Unknown method'}
+
+            writer.write(json_dumps(response).encode() + b'\n')
+            await writer.drain()
+
+        writer.close()
+        await writer.wait_closed()
+
+    async def start_async(self) -> None:
+        pool_socket_path = self.instance.path_runtime_pool_socket
+
+        if await send_pool_request(self.instance, 'ping') is not None:
+            raise BubblejailException('Pool is already running')
+
+        self.instance.path_runtime_pool_dir.mkdir(parents=True, exist_ok=True)
+        # Left over from pool that was killed
+        if pool_socket_path.exists():
+            pool_socket_path.unlink()
+
+        self.server = await start_unix_server(
+            self.client_handler,
+            path=pool_socket_path,
+            limit=POOL_REQUEST_LIMIT,
+        )
+
+        if self.idle_timeout > 0:
+            self.eviction_task = create_task(self.evict_idle_sandboxes())
+
+        self.refill()
+
+    async def stop_async(self) -> None:
+        self.is_stopping = True
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+        if self.eviction_task is not None:
+            self.eviction_task.cancel()
+            try:
+                await self.eviction_task
+            except CancelledError:
+                ...
+
+        for sandbox in self.sandboxes:
+            sandbox.stop()
+
+        await gather(*(x.task for x in self.sandboxes if x.task is not None))
+
+        pool_socket_path = self.instance.path_runtime_pool_socket
+        if pool_socket_path.exists():
+            pool_socket_path.unlink()
+
+        self.instance.path_runtime_pool_dir.rmdir()
+
+    async def run(self) -> None:
+        await self.start_async()
+
+        loop = get_event_loop()
+        loop.add_signal_handler(SIGTERM, self.stop_event.set)
+        loop.add_signal_handler(SIGINT, self.stop_event.set)
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            await self.stop_async()
+
+
+async def send_pool_request(
+        instance: BubblejailInstance,
+        method: str,
+        params: Optional[Dict[str, Any]] = None,
+) -> Optional[PoolResponse]:
+    """Returns None if the pool is not running"""
+    try:
+        (reader, writer) = await open_unix_connection(
+            path=instance.path_runtime_pool_socket,
+        )
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+
+    writer.write(json_dumps({
+        'method': method,
+        'params': params,
+    }).encode() + b'\n')
+    await writer.drain()
+
+    response: PoolResponse = json_loads(await reader.readline())
+
+    writer.close()
+    await writer.wait_closed()
+
+    return response
+
+
+async def claim_pooled_sandbox(
+        instance: BubblejailInstance) -> Optional[List[str]]:
+    """Claims pre-warmed sandbox if instance has a pool
+
+    Returns executable arguments of the instance or None
+    if there was no sandbox ready.
+    """
+    # Pool compares host facts of the sandbox with the client ones
+    response = await send_pool_request(
+        instance, 'claim', {'environ': dict(environ)})
+    if response is None or 'error' in response:
+        return None
+
+    executable_args: List[str] = response['result']['executable_args']
+    return executable_args
@@ -15,20 +15,38 @@
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from ctypes import CDLL, c_char_p, c_int, c_uint, c_uint32, c_void_p
+from contextlib import contextmanager
+from ctypes import (CDLL, POINTER, Structure, c_char_p, c_int, c_uint, c_uint8,
+                    c_uint32, c_void_p)
 from ctypes.util import find_library
-from tempfile import TemporaryFile
-from typing import IO, Callable, Tuple, Type, TypeVar, cast
+from functools import lru_cache
+from hashlib import sha256
+from json import dumps as json_dumps
+from os import getpid, replace, stat, uname
+from pathlib import Path
+from typing import (IO, Any, Callable, Iterator, List, Optional, Tuple, Type,
+                    TypeVar, cast)
+from warnings import warn
 
-from .bwrap_config import SeccompDirective, SeccompSyscallErrno
+from xdg.BaseDirectory import xdg_cache_home
 
-libseccomp = CDLL(find_library('seccomp'))
+from .bubblejail_utils import copy_file_to_memfd, create_memfd, seal_memfd
+from .bwrap_config import SeccompDirective, SeccompSyscallErrno
 
 T = TypeVar('T')
 T2 = TypeVar('T2')
 
+# Bump when the way filters are compiled changes
+SECCOMP_CACHE_VERSION = 3
+# Path libseccomp was loaded from is remembered in the cache
+# directory so that digest does not require loading it
+LIBRARY_PATH_FILE_NAME = 'libseccomp.path'
+
+SeccompRuleType = Tuple[str, str, int]
+
 
 def import_from_cdll(
+    libseccomp: CDLL,
     func_name: str,
         arg_list: Tuple[Type[T2], ...],
         return_type: Type[T]) -> Callable[..., T]:
@@ -38,49 +56,142 @@ def import_from_cdll(
     return cast(Callable[[T2], T], c_function)
 
 
-seccomp_init = import_from_cdll('seccomp_init', (c_uint, ), c_void_p)
-seccomp_load = import_from_cdll('seccomp_load', (c_void_p, ), c_int)
-seccomp_syscall_resolve_name = import_from_cdll(
-    'seccomp_syscall_resolve_name', (c_char_p, ), c_int)
-seccomp_rule_add = import_from_cdll(
-    'seccomp_rule_add', (c_void_p, c_uint32, c_int, c_uint), c_int)
-seccomp_export_pfc = import_from_cdll(
-    'seccomp_export_pfc', (c_void_p, c_int), c_int)
-seccomp_export_bpf = import_from_cdll(
-    'seccomp_export_bpf', (c_void_p, c_int), c_int)
-seccomp_arch_add = import_from_cdll(
-    'seccomp_arch_add', (c_void_p, c_uint32), c_int)
+class ScmpVersion(Structure):
+    _fields_ = [
+        ('major', c_uint),
+        ('minor', c_uint),
+        ('micro', c_uint),
+    ]
+
+
+def find_loaded_library_path(library_name: str) -> str:
+    with open('/proc/self/maps') as maps_file:
+        for maps_line in maps_file:
+            # Path is the last field and can contain spaces
+            mapped_path = maps_line.split(maxsplit=5)[5:]
+            if mapped_path and library_name in mapped_path[0]:
+                return mapped_path[0].rstrip('\n')
+
+    return library_name
+
+
+class LibSeccomp:
+    def __init__(self) -> None:
+        try:
+            # Avoid find_library as it might fork ldconfig or gcc
+            libseccomp = CDLL('libseccomp.so.2')
+        except OSError:
+            libseccomp = CDLL(find_library('seccomp'))
+
+        self.library_path = find_loaded_library_path('libseccomp')
+
+        seccomp_version = import_from_cdll(
+            libseccomp, 'seccomp_version', (), POINTER(ScmpVersion))
+        version_struct = seccomp_version().contents
+        self.version = (version_struct.major, version_struct.minor,
+                        version_struct.micro)
+
+        self.seccomp_init = import_from_cdll(
+            libseccomp, 'seccomp_init', (c_uint, ), c_void_p)
+        # Returns void
+        seccomp_release = libseccomp.seccomp_release
+        seccomp_release.argtypes = (c_void_p, )
+        seccomp_release.restype = None
+        self.seccomp_release = cast(Callable[[c_void_p], None],
+                                    seccomp_release)
+        self.seccomp_load = import_from_cdll(
+            libseccomp, 'seccomp_load', (c_void_p, ), c_int)
+        self.seccomp_syscall_resolve_name = import_from_cdll(
+            libseccomp, 'seccomp_syscall_resolve_name', (c_char_p, ), c_int)
+        self.seccomp_rule_add = import_from_cdll(
+            libseccomp, 'seccomp_rule_add',
+            (c_void_p, c_uint32, c_int, c_uint), c_int)
+        self.seccomp_export_pfc = import_from_cdll(
+            libseccomp, 'seccomp_export_pfc', (c_void_p, c_int), c_int)
+        self.seccomp_export_bpf = import_from_cdll(
+            libseccomp, 'seccomp_export_bpf', (c_void_p, c_int), c_int)
+        self.seccomp_arch_add = import_from_cdll(
+            libseccomp, 'seccomp_arch_add', (c_void_p, c_uint32), c_int)
+        self.seccomp_attr_set = import_from_cdll(
+            libseccomp, 'seccomp_attr_set', (c_void_p, c_int, c_uint32), c_int)
+        self.seccomp_syscall_priority = import_from_cdll(
+            libseccomp, 'seccomp_syscall_priority',
+            (c_void_p, c_int, c_uint8), c_int)
+        self.seccomp_syscall_resolve_num_arch = import_from_cdll(
+            libseccomp, 'seccomp_syscall_resolve_num_arch',
+            (c_uint32, c_int), c_char_p)
+
+
+@lru_cache(maxsize=None)
+def get_libseccomp() -> LibSeccomp:
+    """Loads libseccomp on first use"""
+    return LibSeccomp()
+
 
 SCMP_ACT_ALLOW = c_uint(0x7fff0000)
 
 ARCH_X86 = c_uint32(3 | 0x40000000)
 
+# HACK: Assuming 99.9 percent of people will use x86_64 we only
+# need to add x86 for compatibilities with 32 bit applications
+# I you plan on using bubblejail on ARM or any other arch
+# please open issue on github
+EXTRA_ARCHES = (ARCH_X86, )
+
+
+SCMP_ARCH_NATIVE = c_uint32(0)
+
+SCMP_FLTATR_CTL_OPTIMIZE = c_int(8)
+# Default libseccomp layout. Syscalls are checked one after another
+# ordered by priority.
+SECCOMP_OPTIMIZE_PRIORITY = 1
+# Syscalls are sorted by number and looked up with binary search.
+# Requires libseccomp 2.5 or newer, older versions use default layout.
+SECCOMP_OPTIMIZE_BINARY_TREE = 2
+
+# Most frequently called syscalls first. Used to order the
+# filter so that hot syscalls are matched earlier.
+SYSCALLS_BY_FREQUENCY = (
+    'futex', 'read', 'write', 'poll', 'ppoll', 'epoll_wait',
+    'epoll_pwait', 'recvmsg', 'sendmsg', 'recvfrom', 'sendto',
+    'writev', 'readv', 'pread64', 'pwrite64', 'mmap', 'munmap',
+    'mprotect', 'madvise', 'brk', 'ioctl', 'clock_gettime',
+    'sched_yield', 'nanosleep', 'clock_nanosleep', 'lseek', 'fstat',
+    'newfstatat', 'statx', 'openat', 'close', 'getdents64',
+    'fsync', 'fdatasync', 'sync',
+)
+
 
 def get_scmp_act_errno(error_code: int) -> c_uint32:
     return c_uint32(0x00050000 | (error_code & 0x0000ffff))
 
 
+def get_seccomp_cache_dir() -> Path:
+    return Path(xdg_cache_home) / 'bubblejail' / 'seccomp'
+
+
 class SeccompState:
+    """Seccomp filter rules
 
-    def __init__(self) -> None:
-        self._seccomp_ruleset_ptr: c_void_p = seccomp_init(SCMP_ACT_ALLOW)
-        # HACK: Assuming 99.9 percent of people will use x86_64 we only
-        # need to add x86 for compatibilities with 32 bit applications
-        # I you plan on using bubblejail on ARM or any other arch
-        # please open issue on github
-        seccomp_arch_add(self._seccomp_ruleset_ptr, ARCH_X86)
+    libseccomp is only used when the filter is not found in cache.
+    Cached filters are keyed on the library file so that they are
+    compiled again when library is upgraded.
+    """
 
-    def filter_syscall(self, syscall_name: str, error_number: int) -> None:
-        resolved_syscall_int = seccomp_syscall_resolve_name(
-            c_char_p(syscall_name.encode())
-        )
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        optimize_level: int = SECCOMP_OPTIMIZE_BINARY_TREE,
+    ) -> None:
+        self.rules: List[SeccompRuleType] = []
+        self.cache_dir = (cache_dir if cache_dir is not None
+                          else get_seccomp_cache_dir())
+        self.optimize_level = optimize_level
+        # Set when ruleset is compiled
+        self.applied_optimize_level = optimize_level
 
-        seccomp_rule_add(
-            self._seccomp_ruleset_ptr,
-            get_scmp_act_errno(error_number),
-            resolved_syscall_int,
-            c_uint(0),
-        )
+    def filter_syscall(self, syscall_name: str, error_number: int) -> None:
+        self.rules.append(('errno', syscall_name, error_number))
 
     def add_directive(self, directive: SeccompDirective) -> None:
         if isinstance(directive, SeccompSyscallErrno):
@@ -88,14 +199,143 @@ class SeccompState:
         else:
             raise TypeError('Unknown seccomp directive.')
 
+    @staticmethod
+    def _get_library_stamp(library_path: str) -> List[Any]:
+        library_stat = stat(library_path)
+        return [library_path, library_stat.st_size,
+                library_stat.st_mtime_ns, library_stat.st_ino]
+
+    def get_library_stamp(self) -> List[Any]:
+        """Path and stat of libseccomp
+
+        Library is only loaded if its path is not known.
+        """
+        library_path_file = self.cache_dir / LIBRARY_PATH_FILE_NAME
+        try:
+            return self._get_library_stamp(library_path_file.read_text())
+        except OSError:
+            ...
+
+        library_path = get_libseccomp().library_path
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = library_path_file.with_name(
+                f"{library_path_file.name}.{getpid()}")
+            temp_path.write_text(library_path)
+            replace(temp_path, library_path_file)
+        except OSError:
+            # Cache is only an optimization
+            ...
+
+        try:
+            return self._get_library_stamp(library_path)
+        except OSError:
+            # Library was not found in memory maps
+            return [library_path, *get_libseccomp().version]
+
+    def get_digest(self) -> str:
+        key_data = json_dumps((
+            SECCOMP_CACHE_VERSION,
+            # Library decides the layout and supported optimize levels
+            self.get_library_stamp(),
+            uname().machine,
+            [arch.value for arch in EXTRA_ARCHES],
+            self.optimize_level,
+            sorted(set(self.rules)),
+        ))
+        return sha256(key_data.encode()).hexdigest()
+
+    @contextmanager
+    def _compile_ruleset(self) -> Iterator[c_void_p]:
+        libseccomp = get_libseccomp()
+        seccomp_ruleset_ptr: c_void_p = libseccomp.seccomp_init(
+            SCMP_ACT_ALLOW)
+        try:
+            for arch in EXTRA_ARCHES:
+                libseccomp.seccomp_arch_add(seccomp_ruleset_ptr, arch)
+
+            self.applied_optimize_level = self.optimize_level
+            # ctypes converts c_int return to python int
+            return_code = cast(int, libseccomp.seccomp_attr_set(
+                seccomp_ruleset_ptr,
+                SCMP_FLTATR_CTL_OPTIMIZE,
+                c_uint32(self.optimize_level),
+            ))
+            if return_code < 0:
+                # libseccomp older than 2.5 only has the default layout
+                self.applied_optimize_level = SECCOMP_OPTIMIZE_PRIORITY
+                warn(
+                    f"libseccomp {'.'.join(map(str, libseccomp.version))} "
+                    f"rejected optimize level {self.optimize_level}, "
+                    'using default layout',
+                    RuntimeWarning,
+                )
+
+            # Priority is a hint, it only changes the order of
+            # syscalls that end up in the filter
+            for frequency_rank, syscall_name in enumerate(
+                    SYSCALLS_BY_FREQUENCY):
+                libseccomp.seccomp_syscall_priority(
+                    seccomp_ruleset_ptr,
+                    libseccomp.seccomp_syscall_resolve_name(
+                        c_char_p(syscall_name.encode())),
+                    c_uint8(255 - frequency_rank),
+                )
+
+            for _, syscall_name, error_number in sorted(set(self.rules)):
+                libseccomp.seccomp_rule_add(
+                    seccomp_ruleset_ptr,
+                    get_scmp_act_errno(error_number),
+                    libseccomp.seccomp_syscall_resolve_name(
+                        c_char_p(syscall_name.encode())),
+                    c_uint(0),
+                )
+
+            yield seccomp_ruleset_ptr
+        finally:
+            libseccomp.seccomp_release(seccomp_ruleset_ptr)
+
+    def get_applied_optimize_level(self) -> int:
+        """Optimize level libseccomp accepted"""
+        with self._compile_ruleset():
+            return self.applied_optimize_level
+
     def load(self) -> None:
-        seccomp_load(self._seccomp_ruleset_ptr)
+        with self._compile_ruleset() as seccomp_ruleset_ptr:
+            # ctypes converts c_int return to python int
+            return_code = cast(
+                int, get_libseccomp().seccomp_load(seccomp_ruleset_ptr))
+        if return_code < 0:
+            raise OSError(-return_code, 'Failed to load seccomp filter')
+
+    def export_to_memfd(self) -> IO[bytes]:
+        cached_bpf_path = self.cache_dir / f"{self.get_digest()}.bpf"
+
+        try:
+            return copy_file_to_memfd('seccomp', cached_bpf_path)
+        except FileNotFoundError:
+            ...
+
+        memfd = create_memfd('seccomp')
+        with self._compile_ruleset() as seccomp_ruleset_ptr:
+            get_libseccomp().seccomp_export_bpf(
+                seccomp_ruleset_ptr, memfd.fileno())
+        seal_memfd(memfd)
+        bpf_program = memfd.read()
+        memfd.seek(0)
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = cached_bpf_path.with_name(
+                f"{cached_bpf_path.name}.{getpid()}")
+            temp_path.write_bytes(bpf_program)
+            replace(temp_path, cached_bpf_path)
+        except OSError:
+            # Cache is only an optimization
+            ...
 
-    def export_to_temp_file(self) -> IO[bytes]:
-        t = TemporaryFile()
-        seccomp_export_bpf(self._seccomp_ruleset_ptr, t.fileno())
-        t.seek(0)
-        return t
+        return memfd
 
     def print(self) -> None:
-        seccomp_export_pfc(self._seccomp_ruleset_ptr, 0)
+        with self._compile_ruleset() as seccomp_ruleset_ptr:
+            get_libseccomp().seccomp_export_pfc(seccomp_ruleset_ptr, 0)
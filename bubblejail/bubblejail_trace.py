@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Launch timeline in Chrome trace event format
+
+Used by both the launcher and the helper inside the sandbox.
+Helper only imports it if the launch is traced.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import PathLike, getpid
+from time import monotonic_ns
+from typing import Any, Dict, Generator, Iterable, List, Union
+
+# Helper avoids pathlib as its import is a noticeable part
+# of the helper start up
+StrPath = Union[str, 'PathLike[str]']
+
+TraceEvent = Dict[str, Any]
+
+
+class TraceRecorder:
+    """Records spans in Chrome trace event format
+
+    Traces can be opened in about:tracing or Perfetto.
+    If recorder is not enabled spans are not recorded.
+    """
+
+    def __init__(self, process_name: str = '', enabled: bool = False):
+        self.enabled = enabled
+        self.pid = getpid()
+        self.events: List[TraceEvent] = []
+
+        if enabled:
+            self.events.append({
+                'name': 'process_name',
+                'ph': 'M',
+                'pid': self.pid,
+                'tid': self.pid,
+                'args': {'name': process_name},
+            })
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Generator[None, None, None]:
+        if not self.enabled:
+            yield
+            return
+
+        start_time = monotonic_ns()
+        try:
+            yield
+        finally:
+            self.add_span(name, start_time, monotonic_ns(), **args)
+
+    def add_span(self, name: str, start_time: int, end_time: int,
+                 **args: Any) -> None:
+        if not self.enabled:
+            return
+
+        # Trace event timestamps are in microseconds
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': start_time / 1000,
+            'dur': (end_time - start_time) / 1000,
+            'pid': self.pid,
+            'tid': self.pid,
+            'args': args,
+        })
+
+    def add_instant(self, name: str) -> None:
+        if not self.enabled:
+            return
+
+        self.events.append({
+            'name': name,
+            'ph': 'i',
+            's': 'p',
+            'ts': monotonic_ns() / 1000,
+            'pid': self.pid,
+            'tid': self.pid,
+        })
+
+    def save_json_lines(self, path: StrPath) -> None:
+        """Appends events to the file one JSON object per line"""
+        with open(path, mode='a') as json_lines_file:
+            for event in self.events:
+                json_lines_file.write(json_dumps(event) + '\n')
+
+    def save_trace(self, path: StrPath,
+                   json_lines_paths: Iterable[StrPath] = ()) -> None:
+        """Writes trace file merging events saved by other processes"""
+        events = list(self.events)
+        for json_lines_path in json_lines_paths:
+            try:
+                with open(json_lines_path) as json_lines_file:
+                    events.extend(json_loads(line)
+                                  for line in json_lines_file)
+            except FileNotFoundError:
+                continue
+
+        with open(path, mode='w') as trace_file:
+            trace_file.write(json_dumps({'traceEvents': events}))
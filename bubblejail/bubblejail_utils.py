@@ -14,11 +14,83 @@
 # You should have received a copy of the GNU General Public License
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
+from fcntl import (F_ADD_SEALS, F_SEAL_GROW, F_SEAL_SEAL, F_SEAL_SHRINK,
+                   F_SEAL_WRITE, fcntl)
+from os import (MFD_ALLOW_SEALING, MFD_CLOEXEC, SEEK_SET, copy_file_range,
+                fstat, lseek, memfd_create, sendfile, write)
+from pathlib import Path
+from typing import IO, Literal
 
 FILE_NAME_SERVICES = 'services.toml'
 FILE_NAME_METADATA = 'metadata_v1.toml'
 
+# Network file systems can have coarse time stamps. Files modified
+# this recently can change again without time stamps changing.
+RACY_MTIME_NS = 2 * 10**9
+
+# eager: start replacement as soon as sandbox is claimed
+# lazy: start replacement once claimed sandbox exits
+# Defined here so that command line parser does not import the pool
+RefillStrategy = Literal['eager', 'lazy']
+REFILL_STRATEGIES = ('eager', 'lazy')
+
 
 class BubblejailSettings:
     HELPER_PATH_STR: str = '/usr/lib/bubblejail/bubblejail-helper'
+    BWRAP_PATH_STR: str = '/usr/bin/bwrap'
     SHARE_PATH_STR: str = '/usr/share'
+
+
+MEMFD_SEALS = F_SEAL_SEAL | F_SEAL_SHRINK | F_SEAL_GROW | F_SEAL_WRITE
+
+
+def create_memfd(name: str) -> IO[bytes]:
+    """Creates anonymous memory file that can be sealed"""
+    memfd = memfd_create(
+        f"bubblejail-{name}",
+        MFD_CLOEXEC | MFD_ALLOW_SEALING,
+    )
+    return open(memfd, mode='r+b', buffering=0)
+
+
+def seal_memfd(memfd: IO[bytes]) -> None:
+    """Makes memory file immutable and rewinds it for reading"""
+    memfd_fileno = memfd.fileno()
+    fcntl(memfd_fileno, F_ADD_SEALS, MEMFD_SEALS)
+    lseek(memfd_fileno, 0, SEEK_SET)
+
+
+def copy_data_to_memfd(name: str, data: bytes) -> IO[bytes]:
+    memfd = create_memfd(name)
+    data_view = memoryview(data)
+    while data_view:
+        data_view = data_view[write(memfd.fileno(), data_view):]
+
+    seal_memfd(memfd)
+    return memfd
+
+
+def copy_file_to_memfd(name: str, source_path: Path) -> IO[bytes]:
+    """Copies file to memory file without reading it in to python"""
+    memfd = create_memfd(name)
+    with open(source_path, mode='rb') as source_file:
+        source_fileno = source_file.fileno()
+        bytes_left = fstat(source_fileno).st_size
+        try:
+            while bytes_left > 0:
+                bytes_copied = copy_file_range(
+                    source_fileno, memfd.fileno(), bytes_left)
+                if bytes_copied == 0:
+                    break
+                bytes_left -= bytes_copied
+        except OSError:
+            # Older kernels do not support copy between file systems
+            while bytes_left > 0:
+                bytes_copied = sendfile(
+                    memfd.fileno(), source_fileno, None, bytes_left)
+                if bytes_copied == 0:
+                    break
+                bytes_left -= bytes_copied
+
+    seal_memfd(memfd)
+    return memfd
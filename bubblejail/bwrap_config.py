@@ -17,7 +17,8 @@
 
 from dataclasses import dataclass, field
 from os import environ
-from typing import List, Optional, Tuple
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
 
 @dataclass
@@ -61,7 +62,9 @@ class Symlink(BwrapConfigBase):
 
 @dataclass
 class FileTransfer:
-    content: bytes
+    # Large files should be passed as path so that they are
+    # copied in kernel instead of being read in to memory
+    content: Union[bytes, Path]
     dest: str
 
 
@@ -143,3 +146,10 @@ class LaunchArguments:
             priority: int = 0,) -> None:
         self.launch_args = launch_args
         self.priority = priority
+
+
+class HelperArguments:
+    def __init__(
+            self,
+            helper_args: List[str]) -> None:
+        self.helper_args = helper_args
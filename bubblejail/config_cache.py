@@ -0,0 +1,155 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Cache of parsed TOML files
+
+Instance configuration, metadata and profiles are parsed with the
+pure Python toml module. Parsed data is kept in memory and in
+$XDG_CACHE_HOME/bubblejail/configs as marshal, keyed on the file
+path, device, inode, size, modification and change times.
+
+Launch reads configuration contents before parsing because launch
+plan cache is keyed on them. Entries keep the contents they were
+parsed from so that they can be looked up by contents as well.
+"""
+
+from marshal import dumps as marshal_dumps
+from marshal import loads as marshal_loads
+from os import fstat, getpid, replace, stat, stat_result
+from pathlib import Path
+from time import time_ns
+from typing import Any, Dict, Optional, Tuple
+from zlib import crc32
+
+from toml import loads as toml_loads
+from xdg.BaseDirectory import xdg_cache_home
+
+from .bubblejail_utils import RACY_MTIME_NS
+
+# Bump when format of entries changes
+CONFIG_CACHE_VERSION = 1
+
+StatKey = Tuple[int, int, int, int, int]
+# Version, path, stat key, contents and parsed data
+CacheEntry = Tuple[int, str, Optional[StatKey], str, Dict[str, Any]]
+
+_memory_cache: Dict[str, bytes] = {}
+
+
+def get_config_cache_dir() -> Path:
+    return Path(xdg_cache_home) / 'bubblejail' / 'configs'
+
+
+def _stat_key(file_stat: stat_result) -> Optional[StatKey]:
+    if time_ns() - file_stat.st_mtime_ns < RACY_MTIME_NS:
+        # File can be modified again without time stamps changing
+        return None
+
+    return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+            file_stat.st_mtime_ns, file_stat.st_ctime_ns)
+
+
+def _entry_path(cache_dir: Path, path_str: str) -> Path:
+    # Entries store the path so collisions are only misses
+    return cache_dir / f"{crc32(path_str.encode()):08x}"
+
+
+def _load_entry(cache_dir: Path, path_str: str) -> Optional[CacheEntry]:
+    try:
+        entry_bytes = _memory_cache[path_str]
+    except KeyError:
+        try:
+            with open(_entry_path(cache_dir, path_str),
+                      mode='rb') as entry_file:
+                entry_bytes = entry_file.read()
+        except OSError:
+            return None
+
+    try:
+        entry = marshal_loads(entry_bytes)
+    except (EOFError, ValueError, TypeError):
+        return None
+
+    if (not isinstance(entry, tuple)
+            or len(entry) != 5
+            or entry[0] != CONFIG_CACHE_VERSION
+            or entry[1] != path_str):
+        return None
+
+    _memory_cache[path_str] = entry_bytes
+    return entry
+
+
+def _store_entry(cache_dir: Path, entry: CacheEntry) -> None:
+    try:
+        entry_bytes = marshal_dumps(entry)
+    except ValueError:
+        # Inline tables and dates can not be marshaled
+        return
+
+    path_str = entry[1]
+    _memory_cache[path_str] = entry_bytes
+
+    entry_path = _entry_path(cache_dir, path_str)
+    try:
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = entry_path.with_name(f"{entry_path.name}.{getpid()}")
+        with open(temp_path, mode='wb') as temp_file:
+            temp_file.write(entry_bytes)
+        replace(temp_path, entry_path)
+    except OSError:
+        # Cache is only an optimization
+        ...
+
+
+def load_toml(
+    path: Path,
+    contents: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Parses TOML file or its already read contents
+
+    Raises same exceptions as opening and parsing the file would.
+    Returned data is not shared with other callers.
+    """
+    if cache_dir is None:
+        cache_dir = get_config_cache_dir()
+
+    path_str = str(path)
+    entry = _load_entry(cache_dir, path_str)
+
+    if contents is None:
+        stat_key = _stat_key(stat(path_str))
+        if (entry is not None
+                and stat_key is not None
+                and entry[2] == stat_key):
+            return entry[4]
+
+        with open(path_str) as toml_file:
+            stat_key = _stat_key(fstat(toml_file.fileno()))
+            contents = toml_file.read()
+    else:
+        if entry is not None and entry[3] == contents:
+            return entry[4]
+
+        # Contents could have been read before the file was changed
+        stat_key = None
+
+    parsed_data: Dict[str, Any] = toml_loads(contents)
+    _store_entry(
+        cache_dir,
+        (CONFIG_CACHE_VERSION, path_str, stat_key, contents, parsed_data),
+    )
+    return parsed_data
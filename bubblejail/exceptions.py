@@ -33,3 +33,7 @@ class MissingConfigurationError(BubblejailException):
 
 class BubblejailInstanceNotFoundError(BubblejailException):
     ...
+
+
+class HelperConnectionError(BubblejailException):
+    ...
@@ -0,0 +1,229 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Index of instances in a data directory
+
+Looking up or listing instances should not stat every instance
+directory, which is slow on network file systems with hundreds of
+instances. Index is stored next to the instances directory and is
+valid as long as the instances directory modification time did not
+change. Creating, renaming or removing an instance changes it.
+
+Old configurations are converted when index is rebuilt so that
+conversion does not run on every command.
+"""
+
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import getpid, replace, scandir, stat
+from pathlib import Path
+from time import time, time_ns
+from typing import Any, Dict, NamedTuple, Optional
+
+from toml import TomlDecodeError
+from toml import dump as toml_dump
+from toml import load as toml_load
+
+from .bubblejail_utils import (FILE_NAME_METADATA, FILE_NAME_SERVICES,
+                               RACY_MTIME_NS)
+from .config_cache import load_toml
+
+# Bump when records change or old configurations need converting
+INSTANCES_INDEX_VERSION = 1
+
+INSTANCES_INDEX_FILE_NAME = 'instances_index.json'
+
+
+class InstanceRecord(NamedTuple):
+    name: str
+    path: str
+    creation_profile_name: Optional[str]
+    creation_time: float
+
+
+def convert_old_conf_to_new(instance_directory: Path) -> None:
+    if (instance_directory / FILE_NAME_SERVICES).is_file():
+        return
+
+    old_conf_path = instance_directory / 'config.toml'
+    if not old_conf_path.is_file():
+        return
+
+    print(f"Converting {instance_directory.stem}")
+
+    with open(old_conf_path) as old_conf_file:
+        old_conf_dict = toml_load(old_conf_file)
+
+    new_conf: Dict[str, Any] = {}
+
+    try:
+        services_list = old_conf_dict.pop('services')
+    except KeyError:
+        services_list = []
+
+    for service_name in services_list:
+        new_conf[service_name] = {}
+
+    try:
+        old_service_dict = old_conf_dict.pop('service')
+    except KeyError:
+        old_service_dict = {}
+
+    for service_name, service_dict in old_service_dict.items():
+        new_conf[service_name] = service_dict
+
+    new_conf['common'] = old_conf_dict
+
+    with open(instance_directory / FILE_NAME_SERVICES, mode='x') as f:
+        toml_dump(new_conf, f)
+
+
+def read_creation_profile_name(instance_directory: Path) -> Optional[str]:
+    try:
+        profile_name = load_toml(
+            instance_directory / FILE_NAME_METADATA).get(
+                'creation_profile_name')
+    except (OSError, TomlDecodeError):
+        return None
+
+    return profile_name if isinstance(profile_name, str) else None
+
+
+class InstancesIndex:
+    def __init__(self, data_directory: Path) -> None:
+        self.instances_directory = data_directory / 'instances'
+        self.index_path = data_directory / INSTANCES_INDEX_FILE_NAME
+        self._records: Optional[Dict[str, InstanceRecord]] = None
+
+    def _instances_mtime_ns(self) -> Optional[int]:
+        try:
+            return stat(self.instances_directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(
+            self,
+            check_mtime: bool = True,
+    ) -> Optional[Dict[str, InstanceRecord]]:
+        try:
+            with open(self.index_path) as index_file:
+                index = json_loads(index_file.read())
+        except (OSError, ValueError):
+            return None
+
+        try:
+            if index['version'] != INSTANCES_INDEX_VERSION:
+                return None
+
+            instances_mtime_ns = index['instances_mtime_ns']
+            if check_mtime and (
+                    instances_mtime_ns is None
+                    or instances_mtime_ns != self._instances_mtime_ns()):
+                return None
+
+            return {
+                name: InstanceRecord(**record)
+                for name, record in index['instances'].items()
+            }
+        except (KeyError, TypeError):
+            return None
+
+    def _store(self, records: Dict[str, InstanceRecord],
+               instances_mtime_ns: Optional[int]) -> None:
+        # Directory modified this recently can be modified again
+        # without modification time changing, index is not trusted
+        if (instances_mtime_ns is not None
+                and time_ns() - instances_mtime_ns < RACY_MTIME_NS):
+            instances_mtime_ns = None
+
+        index = {
+            'version': INSTANCES_INDEX_VERSION,
+            'instances_mtime_ns': instances_mtime_ns,
+            'instances': {
+                name: record._asdict() for name, record in records.items()
+            },
+        }
+
+        try:
+            temp_path = self.index_path.with_name(
+                f"{self.index_path.name}.{getpid()}")
+            with open(temp_path, mode='w') as temp_file:
+                temp_file.write(json_dumps(index))
+            replace(temp_path, self.index_path)
+        except OSError:
+            # Index is only an optimization, read-only data
+            # directories are scanned every time
+            ...
+
+    def rebuild(self) -> Dict[str, InstanceRecord]:
+        # Instances indexed by the same index version were already
+        # converted and their creation records do not change
+        old_records = self._load(check_mtime=False) or {}
+
+        self.instances_directory.mkdir(parents=True, exist_ok=True)
+        # Taken before scanning so that instances created
+        # during the scan invalidate the index
+        instances_mtime_ns = self._instances_mtime_ns()
+
+        records: Dict[str, InstanceRecord] = {}
+        with scandir(self.instances_directory) as instances_iter:
+            instance_entries = sorted(
+                (x for x in instances_iter if x.is_dir()),
+                key=lambda x: x.name,
+            )
+
+        for instance_entry in instance_entries:
+            try:
+                records[instance_entry.name] = old_records[instance_entry.name]
+                continue
+            except KeyError:
+                ...
+
+            instance_directory = Path(instance_entry.path)
+            convert_old_conf_to_new(instance_directory)
+
+            records[instance_entry.name] = InstanceRecord(
+                name=instance_entry.name,
+                path=instance_entry.path,
+                creation_profile_name=read_creation_profile_name(
+                    instance_directory),
+                creation_time=instance_entry.stat().st_ctime,
+            )
+
+        self._store(records, instances_mtime_ns)
+        self._records = records
+        return records
+
+    def records(self) -> Dict[str, InstanceRecord]:
+        if self._records is None:
+            self._records = self._load()
+
+        if self._records is None:
+            return self.rebuild()
+
+        return self._records
+
+    def add(self, instance_directory: Path,
+            creation_profile_name: Optional[str]) -> None:
+        """Called after new instance was created"""
+        instances_mtime_ns = self._instances_mtime_ns()
+        records = self.records()
+        records[instance_directory.name] = InstanceRecord(
+            name=instance_directory.name,
+            path=str(instance_directory),
+            creation_profile_name=creation_profile_name,
+            creation_time=time(),
+        )
+        self._store(records, instances_mtime_ns)
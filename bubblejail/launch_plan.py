@@ -0,0 +1,373 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+from base64 import b64decode, b64encode
+from hashlib import sha256
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import environ, getpid, replace, stat
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple, Union
+
+from xdg.BaseDirectory import xdg_cache_home, xdg_config_home
+
+from .bubblejail_trace import TraceRecorder
+from .bubblejail_utils import BubblejailSettings
+from .bwrap_config import (BwrapConfigBase, DbusSessionArgs, DbusSystemArgs,
+                           EnvrimentalVar, FileTransfer, HelperArguments,
+                           LaunchArguments, SeccompDirective,
+                           SeccompSyscallErrno)
+from .services import (XDG_DESKTOP_VARS, BubblejailService, ServiceContainer,
+                       ServiceWantsHomeBind, generate_volatile_files)
+
+# Bump when the layout of the cached plan changes
+LAUNCH_PLAN_VERSION = 3
+
+LaunchPlanStep = Union[Tuple[str, ...], FileTransfer]
+
+# Environmental variables read by services directly
+# (not through EnvrimentalVar with empty value)
+PLAN_ENVIRON_VARS = frozenset({
+    'DISPLAY', 'XAUTHORITY', 'WAYLAND_DISPLAY', 'XDG_RUNTIME_DIR',
+    'PATH', 'HOME',
+}) | XDG_DESKTOP_VARS
+
+# Directories that services walk to discover host layout and devices.
+# Modification time of directory changes when an entry is added,
+# removed or replaced which is cheaper to check than listing it.
+# Entries under /sys/dev/char and /sys/class/input are added together
+# with the device nodes under /dev which directories do track it.
+PLAN_HOST_DIRECTORIES = (
+    '/', '/dev/dri', '/sys/dev/char', '/dev/input/by-path',
+    '/sys/class/input',
+)
+
+
+def get_launch_plans_dir() -> Path:
+    return Path(xdg_cache_home) / 'bubblejail' / 'launch_plans'
+
+
+def _stat_identity(path: str) -> Optional[List[int]]:
+    """List so that it compares equal after JSON round trip"""
+    try:
+        stat_result = stat(path)
+    except OSError:
+        return None
+
+    return [stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns]
+
+
+def get_code_identity() -> Optional[List[int]]:
+    """Identifies installed bubblejail version by its package directory
+
+    Installing or upgrading replaces the modules which changes
+    the modification time of the directory.
+    """
+    return _stat_identity(str(Path(__file__).parent))
+
+
+def _check_str_list(value: Any) -> List[str]:
+    if not isinstance(value, list):
+        raise TypeError('Expected list of strings.', value)
+
+    # Raises TypeError if any of the items is not a string
+    ''.join(value)
+    return value
+
+
+class LaunchPlan:
+    """Result of iterating over instance services
+
+    Contains everything needed to build the bwrap arguments except
+    the file descriptors which are created on every launch.
+    """
+
+    def __init__(
+        self,
+        bwrap_options: Optional[List[LaunchPlanStep]] = None,
+        dbus_session_opts: Optional[Set[str]] = None,
+        dbus_system_opts: Optional[Set[str]] = None,
+        seccomp_directives: Optional[List[SeccompDirective]] = None,
+        executable_args: Optional[List[str]] = None,
+        environ_vars: Optional[Set[str]] = None,
+        helper_args: Optional[List[str]] = None,
+    ) -> None:
+        self.bwrap_options: List[LaunchPlanStep] = (
+            bwrap_options if bwrap_options is not None else [])
+        self.dbus_session_opts: Set[str] = (
+            dbus_session_opts if dbus_session_opts is not None else set())
+        self.dbus_system_opts: Set[str] = (
+            dbus_system_opts if dbus_system_opts is not None else set())
+        self.seccomp_directives: List[SeccompDirective] = (
+            seccomp_directives if seccomp_directives is not None else [])
+        self.executable_args: List[str] = (
+            executable_args if executable_args is not None else [])
+        # Names of environmental variables which values ended up in plan
+        self.environ_vars: Set[str] = (
+            environ_vars if environ_vars is not None else set())
+        self.helper_args: List[str] = (
+            helper_args if helper_args is not None else [])
+
+    @classmethod
+    def from_services(
+        cls,
+        instance_config: ServiceContainer,
+        home_bind_path: Path,
+        tracer: Optional[TraceRecorder] = None,
+    ) -> 'LaunchPlan':
+        new_plan = cls()
+        if tracer is None:
+            tracer = TraceRecorder()
+
+        for service in instance_config.iter_services():
+            with tracer.span(f"service {service.name}"):
+                new_plan._add_service(service, home_bind_path)
+
+        return new_plan
+
+    def _add_service(
+        self,
+        service: BubblejailService,
+        home_bind_path: Path,
+    ) -> None:
+        config_iterator = service.__iter__()
+
+        while True:
+            try:
+                config = next(config_iterator)
+            except StopIteration:
+                break
+
+            # When we need to send something to generator
+            if isinstance(config, ServiceWantsHomeBind):
+                config = config_iterator.send(home_bind_path)
+
+            if isinstance(config, BwrapConfigBase):
+                if (isinstance(config, EnvrimentalVar)
+                        and config.var_value is None):
+                    self.environ_vars.add(config.var_name)
+
+                self.bwrap_options.append(config.to_args())
+            elif isinstance(config, FileTransfer):
+                self.bwrap_options.append(config)
+            elif isinstance(config, DbusSessionArgs):
+                self.dbus_session_opts.add(config.to_args())
+            elif isinstance(config, DbusSystemArgs):
+                self.dbus_system_opts.add(config.to_args())
+            elif isinstance(config, SeccompDirective):
+                self.seccomp_directives.append(config)
+            elif isinstance(config, LaunchArguments):
+                # TODO: implement priority
+                self.executable_args.extend(config.launch_args)
+            elif isinstance(config, HelperArguments):
+                self.helper_args.extend(config.helper_args)
+            else:
+                raise TypeError('Unknown bwrap config.')
+
+    def refresh_volatile_files(self) -> None:
+        volatile_files = {
+            file_transfer.dest: file_transfer
+            for file_transfer in generate_volatile_files()
+        }
+
+        for index, step in enumerate(self.bwrap_options):
+            if isinstance(step, FileTransfer) and step.dest in volatile_files:
+                self.bwrap_options[index] = volatile_files[step.dest]
+
+    def to_dict(self) -> Dict[str, Any]:
+        bwrap_options: List[List[Any]] = []
+        for step in self.bwrap_options:
+            if isinstance(step, FileTransfer):
+                if isinstance(step.content, bytes):
+                    bwrap_options.append(
+                        ['file', step.dest,
+                         b64encode(step.content).decode()])
+                else:
+                    bwrap_options.append(
+                        ['file_path', step.dest, str(step.content)])
+            else:
+                bwrap_options.append(['args', list(step)])
+
+        seccomp_directives: List[List[Any]] = []
+        for directive in self.seccomp_directives:
+            if isinstance(directive, SeccompSyscallErrno):
+                seccomp_directives.append(
+                    ['errno', directive.syscall_name, directive.errno])
+            else:
+                raise TypeError('Unknown seccomp directive.')
+
+        return {
+            'bwrap_options': bwrap_options,
+            'dbus_session_opts': sorted(self.dbus_session_opts),
+            'dbus_system_opts': sorted(self.dbus_system_opts),
+            'seccomp_directives': seccomp_directives,
+            'executable_args': self.executable_args,
+            'environ_vars': sorted(self.environ_vars),
+            'helper_args': self.helper_args,
+        }
+
+    @classmethod
+    def from_dict(cls, plan_dict: Dict[str, Any]) -> 'LaunchPlan':
+        bwrap_options: List[LaunchPlanStep] = []
+        for step_type, *step_data in plan_dict['bwrap_options']:
+            if step_type == 'file':
+                dest, content = _check_str_list(step_data)
+                bwrap_options.append(
+                    FileTransfer(b64decode(content, validate=True), dest))
+            elif step_type == 'file_path':
+                dest, source_path = _check_str_list(step_data)
+                bwrap_options.append(FileTransfer(Path(source_path), dest))
+            elif step_type == 'args':
+                args, = step_data
+                bwrap_options.append(tuple(_check_str_list(args)))
+            else:
+                raise TypeError('Unknown launch plan step.', step_type)
+
+        seccomp_directives: List[SeccompDirective] = []
+        for directive_type, *directive_data in (
+                plan_dict['seccomp_directives']):
+            if directive_type == 'errno':
+                syscall_name, errno = directive_data
+                if (not isinstance(syscall_name, str)
+                        or not isinstance(errno, int)):
+                    raise TypeError('Malformed seccomp directive.',
+                                    directive_data)
+
+                seccomp_directives.append(
+                    SeccompSyscallErrno(syscall_name, errno))
+            else:
+                raise TypeError('Unknown seccomp directive.', directive_type)
+
+        return cls(
+            bwrap_options=bwrap_options,
+            dbus_session_opts=set(
+                _check_str_list(plan_dict['dbus_session_opts'])),
+            dbus_system_opts=set(
+                _check_str_list(plan_dict['dbus_system_opts'])),
+            seccomp_directives=seccomp_directives,
+            executable_args=_check_str_list(plan_dict['executable_args']),
+            environ_vars=set(_check_str_list(plan_dict['environ_vars'])),
+            helper_args=_check_str_list(plan_dict['helper_args']),
+        )
+
+
+class LaunchPlanCache:
+    """Persistent cache of launch plans, one entry per instance
+
+    Entry is keyed on the digest of the instance configuration,
+    bubblejail and bwrap versions. Host facts such as environment
+    and device topology are stored along side and compared on load.
+    Plan read from the entry is validated before it is used.
+    """
+
+    def __init__(
+        self,
+        instance_name: str,
+        home_bind_path: Path,
+        config_contents: str,
+        cache_dir: Optional[Path] = None,
+    ) -> None:
+        self.home_bind_path = home_bind_path
+        self.config_contents = config_contents
+
+        if cache_dir is None:
+            cache_dir = get_launch_plans_dir()
+
+        self.entry_path = cache_dir / f"{instance_name}.json"
+
+    def get_digest(self) -> str:
+        key_data = json_dumps((
+            LAUNCH_PLAN_VERSION,
+            get_code_identity(),
+            _stat_identity(BubblejailSettings.BWRAP_PATH_STR),
+            str(self.home_bind_path),
+            self.config_contents,
+        ))
+        return sha256(key_data.encode()).hexdigest()
+
+    @staticmethod
+    def get_host_facts(
+        environ_vars: Set[str],
+        host_environ: Mapping[str, str] = environ,
+    ) -> Dict[str, Any]:
+        kde_globals_path = f"{xdg_config_home}/kdeglobals"
+        return {
+            'environ': {
+                var_name: host_environ.get(var_name)
+                for var_name in sorted(PLAN_ENVIRON_VARS | environ_vars)
+            },
+            'directories': {
+                directory: _stat_identity(directory)
+                for directory in PLAN_HOST_DIRECTORIES
+            },
+            'files': {
+                kde_globals_path: (
+                    _stat_identity(kde_globals_path) is not None),
+            },
+        }
+
+    def get_launch_digest(
+        self,
+        environ_vars: Set[str],
+        host_environ: Mapping[str, str] = environ,
+    ) -> str:
+        """Changes when a plan made earlier would not be valid
+
+        Covers instance configuration and host facts.
+        """
+        key_data = json_dumps((
+            self.get_digest(),
+            self.get_host_facts(environ_vars, host_environ),
+        ))
+        return sha256(key_data.encode()).hexdigest()
+
+    def load(self) -> Optional[LaunchPlan]:
+        try:
+            with open(self.entry_path) as entry_file:
+                entry = json_loads(entry_file.read())
+        except (OSError, ValueError):
+            return None
+
+        try:
+            if entry['digest'] != self.get_digest():
+                return None
+
+            plan = LaunchPlan.from_dict(entry['plan'])
+            if entry['host_facts'] != self.get_host_facts(plan.environ_vars):
+                return None
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        plan.refresh_volatile_files()
+        return plan
+
+    def store(self, plan: LaunchPlan) -> None:
+        entry = {
+            'digest': self.get_digest(),
+            'host_facts': self.get_host_facts(plan.environ_vars),
+            'plan': plan.to_dict(),
+        }
+
+        try:
+            self.entry_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.entry_path.with_name(
+                f"{self.entry_path.name}.{getpid()}")
+            with open(temp_path, mode='w') as temp_file:
+                temp_file.write(json_dumps(entry))
+            replace(temp_path, self.entry_path)
+        except OSError:
+            # Cache is only an optimization
+            ...
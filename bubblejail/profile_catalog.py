@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019-2021 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+"""Catalog of profiles indexed by name
+
+Profiles are listed and parsed once. Catalog is loaded again when
+modification time of a profiles directory or a directory holding
+a profile desktop entry changes, for example when a profile is
+added or the profiled application is installed.
+"""
+
+from __future__ import annotations
+
+from os import scandir, stat
+from pathlib import Path
+from time import time_ns
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional
+
+from toml import TomlDecodeError
+
+from .bubblejail_utils import RACY_MTIME_NS
+from .config_cache import load_toml
+from .exceptions import BubblejailException
+
+if TYPE_CHECKING:
+    from .bubblejail_instance import BubblejailProfile
+
+
+class ProfileRecord(NamedTuple):
+    name: str
+    path: Path
+    description: str
+    import_tips: str
+    dot_desktop_path: Optional[Path]
+    dot_desktop_exists: bool
+
+
+def _mtime_ns(directory: Path) -> Optional[int]:
+    try:
+        return stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ProfileCatalog:
+    def __init__(self, profile_directories: Iterable[Path]) -> None:
+        # Earlier directories take precedence
+        self.profile_directories = tuple(profile_directories)
+        self._records: Optional[Dict[str, ProfileRecord]] = None
+        self._load_errors: Dict[str, Exception] = {}
+        self._watched_mtimes: Dict[Path, Optional[int]] = {}
+        self._is_racy = False
+
+    def _is_valid(self) -> bool:
+        if self._records is None or self._is_racy:
+            return False
+
+        return all(_mtime_ns(directory) == mtime_ns
+                   for directory, mtime_ns in self._watched_mtimes.items())
+
+    def _load(self) -> Dict[str, ProfileRecord]:
+        # Taken before scanning so that changes
+        # during the scan invalidate the catalog
+        watched_mtimes = {x: _mtime_ns(x) for x in self.profile_directories}
+
+        records: Dict[str, ProfileRecord] = {}
+        load_errors: Dict[str, Exception] = {}
+        for profiles_directory in self.profile_directories:
+            try:
+                with scandir(profiles_directory) as profiles_iter:
+                    profile_paths = sorted(
+                        Path(x.path) for x in profiles_iter
+                        if x.name.endswith('.toml') and x.is_file())
+            except OSError:
+                continue
+
+            for profile_path in profile_paths:
+                profile_name = profile_path.stem
+                if profile_name in records or profile_name in load_errors:
+                    continue
+
+                try:
+                    profile_dict = load_toml(profile_path)
+                except (OSError, TomlDecodeError) as e:
+                    # Broken profile should not hide other profiles
+                    load_errors[profile_name] = e
+                    continue
+
+                dot_desktop_str = profile_dict.get('dot_desktop_path')
+                dot_desktop_path = (Path(dot_desktop_str)
+                                    if dot_desktop_str is not None else None)
+                if dot_desktop_path is not None:
+                    watched_mtimes.setdefault(
+                        dot_desktop_path.parent,
+                        _mtime_ns(dot_desktop_path.parent))
+
+                records[profile_name] = ProfileRecord(
+                    name=profile_name,
+                    path=profile_path,
+                    description=profile_dict.get(
+                        'description', 'No description'),
+                    import_tips=profile_dict.get('import_tips', 'None'),
+                    dot_desktop_exists=(dot_desktop_path is not None
+                                        and dot_desktop_path.is_file()),
+                    dot_desktop_path=dot_desktop_path,
+                )
+
+        # Directory modified this recently can be modified again
+        # without modification time changing, load again next time
+        current_time_ns = time_ns()
+        self._is_racy = any(
+            x is not None and current_time_ns - x < RACY_MTIME_NS
+            for x in watched_mtimes.values())
+
+        self._records = records
+        self._load_errors = load_errors
+        self._watched_mtimes = watched_mtimes
+        return records
+
+    def records(self) -> Dict[str, ProfileRecord]:
+        if self._records is None or not self._is_valid():
+            return self._load()
+
+        return self._records
+
+    def names(self) -> List[str]:
+        records = self.records()
+        return sorted((*records, *self._load_errors))
+
+    def record(self, profile_name: str) -> ProfileRecord:
+        try:
+            return self.records()[profile_name]
+        except KeyError:
+            ...
+
+        load_error = self._load_errors.get(profile_name)
+        if load_error is not None:
+            raise load_error
+
+        raise BubblejailException(f"Profile {profile_name} not found")
+
+    def profile_get(self, profile_name: str) -> BubblejailProfile:
+        from .bubblejail_instance import BubblejailProfile
+
+        # Parsed data is cached, profile object is not shared
+        return BubblejailProfile(**load_toml(self.record(profile_name).path))
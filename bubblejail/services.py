@@ -26,9 +26,9 @@ from xdg import BaseDirectory
 
 from .bwrap_config import (Bind, BwrapConfigBase, DbusCommon, DbusSessionOwn,
                            DbusSessionTalkTo, DevBind, DirCreate,
-                           EnvrimentalVar, FileTransfer, LaunchArguments,
-                           ReadOnlyBind, SeccompDirective, SeccompSyscallErrno,
-                           ShareNetwork, Symlink)
+                           EnvrimentalVar, FileTransfer, HelperArguments,
+                           LaunchArguments, ReadOnlyBind, SeccompDirective,
+                           SeccompSyscallErrno, ShareNetwork, Symlink)
 
 # region Service Typing
 
@@ -42,7 +42,7 @@ class ServiceWantsHomeBind(ServiceWantsSend):
 
 
 ServiceIterTypes = Union[BwrapConfigBase, FileTransfer,
-                         SeccompDirective,
+                         SeccompDirective, HelperArguments,
                          LaunchArguments, ServiceWantsSend, DbusCommon]
 
 ServiceSendType = Union[Path]
@@ -53,7 +53,7 @@ ServiceGeneratorType = Generator[ServiceIterTypes, ServiceSendType, None]
 
 # region Service Options
 
-ServiceOptionTypes = Union[str, List[str], bool]
+ServiceOptionTypes = Union[str, List[str], bool, int]
 
 
 class ServiceOption:
@@ -168,6 +168,28 @@ class OptionBool(ServiceOption):
         else:
             raise TypeError(f"Option Bool got {type(new_value)}")
 
+
+class OptionInt(ServiceOption):
+    def __init__(self, integer: int,
+                 description: str, name: str,
+                 pretty_name: str):
+        super().__init__(
+            description=description,
+            name=name,
+            pretty_name=pretty_name,
+        )
+        self.integer = integer
+
+    def get_value(self) -> int:
+        return self.integer
+
+    def set_value(self, new_value: ServiceOptionTypes) -> None:
+        # bool is a subclass of int
+        if isinstance(new_value, int) and not isinstance(new_value, bool):
+            self.integer = new_value
+        else:
+            raise TypeError(f"Option Int got {type(new_value)}")
+
 # endregion Service Options
 
 
@@ -271,6 +293,18 @@ def generate_machine_id_bytes() -> bytes:
 
     return b''.join((x.encode() for x in random_hex_string))
 
+
+def generate_volatile_files() -> Tuple[FileTransfer, ...]:
+    """Files that must be regenerated on every launch
+
+    Random hostname and machine id should not be reused between launches
+    even if the rest of the launch plan was cached.
+    """
+    return (
+        *generate_hosts(),
+        FileTransfer(generate_machine_id_bytes(), '/etc/machine-id'),
+    )
+
 # endregion HelperFunctions
 
 
@@ -374,9 +408,7 @@ class BubblejailDefaults(BubblejailService):
         yield generate_group()
         yield generate_nssswitch()
         yield FileTransfer(b'multi on', '/etc/host.conf')
-        yield from generate_hosts()
-
-        yield FileTransfer(generate_machine_id_bytes(), '/etc/machine-id')
+        yield from generate_volatile_files()
 
     def __repr__(self) -> str:
         return "Bubblejail defaults."
@@ -393,6 +425,7 @@ class CommonSettings(BubblejailService):
         share_local_time: bool = True,
         filter_disk_sync: bool = False,
         dbus_name: str = '',
+        linger_timeout: int = 0,
     ):
         super().__init__()
         self.share_local_time = OptionBool(
@@ -426,10 +459,21 @@ class CommonSettings(BubblejailService):
             pretty_name='Dbus name',
         )
 
+        self.linger_timeout = OptionInt(
+            integer=linger_timeout,
+            name='linger_timeout',
+            pretty_name='Linger timeout',
+            description=(
+                'Seconds to keep sandbox running after\n'
+                'the last process exits. Running the instance\n'
+                'again during that time will reuse the sandbox.'),
+        )
+
         self.add_option(self.dbus_name)
         self.add_option(self.executable_name)
         self.add_option(self.filter_disk_sync)
         self.add_option(self.share_local_time)
+        self.add_option(self.linger_timeout)
 
     def __iter__(self) -> ServiceGeneratorType:
         if not self.enabled:
@@ -449,6 +493,10 @@ class CommonSettings(BubblejailService):
         if dbus_name:
             yield DbusSessionOwn(dbus_name)
 
+        linger_timeout = self.linger_timeout.get_value()
+        if linger_timeout:
+            yield HelperArguments(['--linger-timeout', str(linger_timeout)])
+
     name = 'common'
     pretty_name = 'Common Settings'
     description = "Settings that don't fit any particular category"
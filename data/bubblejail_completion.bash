@@ -1,10 +1,86 @@
 #/usr/bin/env bash
 
+# Completes from the cache written by 'bubblejail list _auto_complete'.
+# Follows the same rules as AutoCompleteParser. Sets
+# _bubblejail_candidates or returns 1 if the cache is missing or stale.
+_bubblejail_cached_candidates()
+{
+	local cache_file="${XDG_CACHE_HOME:-$HOME/.cache}/bubblejail/completion"
+	[[ -f $cache_file ]] || return 1
+
+	local -A cache=()
+	local key values
+	while IFS=$'\t' read -r key values; do
+		cache[$key]=$values
+	done < "$cache_file"
+
+	[[ ${cache[version]} == 2 ]] || return 1
+	[[ ${cache[environ]} == "$BUBBLEJAIL_DATADIRS|$BUBBLEJAIL_CONFDIRS|$XDG_DATA_HOME|$XDG_CONFIG_HOME" ]] || return 1
+
+	local watch_path
+	for watch_path in ${cache[watch]}; do
+		[[ -e $watch_path && ! $watch_path -nt $cache_file ]] || return 1
+	done
+
+	# Upgrade keeps modification time of installed files
+	local install_path=${cache[install]%%$'\t'*}
+	local install_stamp
+	install_stamp=$(stat -L -c '%s:%Y:%i' -- "$install_path" 2>/dev/null)
+	[[ -n $install_stamp && $install_stamp == "${cache[install]#*$'\t'}" ]] || return 1
+
+	local words=("${COMP_WORDS[@]:0:COMP_CWORD+1}")
+	local index=0 token subcommand
+	_bubblejail_candidates=${cache[subcommands]}
+
+	# Base options and subcommand
+	while (( ++index < ${#words[@]} )); do
+		token=${words[index]}
+		if [[ $token != -* ]]; then
+			subcommand=$token
+			break
+		fi
+		_bubblejail_candidates='--help'
+	done
+
+	(( index < ${#words[@]} )) || return 0
+
+	if [[ ! -v cache[options:$subcommand] ]]; then
+		# Unknown subcommand is only completed while being typed
+		if (( index + 1 < ${#words[@]} )); then
+			_bubblejail_candidates=''
+		fi
+		return 0
+	fi
+
+	local subject_set=0
+	while (( ++index < ${#words[@]} )); do
+		token=${words[index]}
+		if (( subject_set )); then
+			_bubblejail_candidates=''
+		elif [[ $token == -* ]]; then
+			_bubblejail_candidates=${cache[options:$subcommand]}
+		elif [[ $subcommand == list ]]; then
+			_bubblejail_candidates=${cache[list_options]}
+			subject_set=1
+		elif [[ ${words[index-1]} == --profile ]]; then
+			_bubblejail_candidates=${cache[profiles]}
+		elif [[ $'\t'${cache[want_instance]}$'\t' == *$'\t'$subcommand$'\t'* ]]; then
+			_bubblejail_candidates=${cache[instances]}
+			subject_set=1
+		else
+			_bubblejail_candidates=''
+		fi
+	done
+}
+
 _complete_bubblejail()
 {
 	local IFS=$'\t\n'    # normalize IFS
-	local PYTHON_RETURN=$(bubblejail list --command-line "${COMP_LINE::$COMP_POINT}"  _auto_complete)
-	COMPREPLY=( $(compgen -W "$PYTHON_RETURN" -- "$2") )
+	local _bubblejail_candidates
+	if ! _bubblejail_cached_candidates; then
+		_bubblejail_candidates=$(bubblejail list --command-line "${COMP_LINE::$COMP_POINT}"  _auto_complete)
+	fi
+	COMPREPLY=( $(compgen -W "$_bubblejail_candidates" -- "$2") )
 }
 
 complete -F _complete_bubblejail bubblejail
@@ -1,8 +1,141 @@
 # Disable file completion
 complete --command bubblejail --no-files
+
+# Completes from the cache written by 'bubblejail list _auto_complete'.
+# Follows the same rules as AutoCompleteParser.
+# Returns 1 if the cache is missing or stale.
+function __bubblejail_cached_candidates
+    # path builtin is available since fish 3.5
+    builtin -q path; or return 1
+
+    set -l cache_dir $HOME/.cache
+    test -n "$XDG_CACHE_HOME"; and set cache_dir $XDG_CACHE_HOME
+    set -l cache_file $cache_dir/bubblejail/completion
+    test -f $cache_file; or return 1
+
+    set -l cache_version
+    set -l cache_environ
+    set -l watch
+    set -l install
+    set -l subcommands
+    set -l want_instance
+    set -l list_options
+    set -l instances
+    set -l profiles
+    set -l options_lines
+    while read --list --delimiter \t fields
+        set -l values $fields
+        set -e values[1]
+        switch $fields[1]
+            case version
+                set cache_version $values
+            case environ
+                set cache_environ $values
+            case watch
+                set watch $values
+            case install
+                set install $values
+            case subcommands
+                set subcommands $values
+            case want_instance
+                set want_instance $values
+            case list_options
+                set list_options $values
+            case instances
+                set instances $values
+            case profiles
+                set profiles $values
+            case 'options:*'
+                set -a options_lines (string join \t -- $fields)
+        end
+    end <$cache_file
+
+    test "$cache_version" = 2; or return 1
+    test "$cache_environ" = "$BUBBLEJAIL_DATADIRS|$BUBBLEJAIL_CONFDIRS|$XDG_DATA_HOME|$XDG_CONFIG_HOME"
+    or return 1
+
+    set -l watch_mtimes (path mtime -- $cache_file $watch)
+    test (count $watch_mtimes) -eq (math (count $watch) + 1); or return 1
+    set -l cache_mtime $watch_mtimes[1]
+    set -e watch_mtimes[1]
+    for watch_mtime in $watch_mtimes
+        test $watch_mtime -le $cache_mtime; or return 1
+    end
+
+    # Upgrade keeps modification time of installed files
+    test (count $install) -eq 2; or return 1
+    set -l install_stamp (stat -L -c '%s:%Y:%i' -- $install[1] 2>/dev/null)
+    test -n "$install_stamp"; and test "$install_stamp" = $install[2]
+    or return 1
+
+    set -l current_token (commandline --cut-at-cursor --current-token)
+    set -l words (commandline --cut-at-cursor --tokenize) "$current_token"
+    set -l candidates $subcommands
+    set -l index 1
+    set -l subcommand
+
+    # Base options and subcommand
+    while test $index -lt (count $words)
+        set index (math $index + 1)
+        if string match -q -- '-*' $words[$index]
+            set candidates --help
+            continue
+        end
+        set subcommand $words[$index]
+        break
+    end
+
+    if test -z "$subcommand"; and test $index -eq (count $words)
+        string join \n -- $candidates
+        return 0
+    end
+
+    set -l subcommand_options
+    set -l is_known_subcommand 0
+    for options_line in $options_lines
+        set -l options_fields (string split \t -- $options_line)
+        if test "$options_fields[1]" = "options:$subcommand"
+            set is_known_subcommand 1
+            set subcommand_options $options_fields
+            set -e subcommand_options[1]
+        end
+    end
+
+    if test $is_known_subcommand = 0
+        # Unknown subcommand is only completed while being typed
+        test $index -lt (count $words); and set candidates
+        string join \n -- $candidates
+        return 0
+    end
+
+    set -l subject_set 0
+    while test $index -lt (count $words)
+        set index (math $index + 1)
+        if test $subject_set = 1
+            set candidates
+        else if string match -q -- '-*' $words[$index]
+            set candidates $subcommand_options
+        else if test $subcommand = list
+            set candidates $list_options
+            set subject_set 1
+        else if test "$words[(math $index - 1)]" = --profile
+            set candidates $profiles
+        else if contains -- $subcommand $want_instance
+            set candidates $instances
+            set subject_set 1
+        else
+            set candidates
+        end
+    end
+
+    string join \n -- $candidates
+    return 0
+end
+
 # Completion function
 function bubblejail_complete_func
-    bubblejail list --command-line (commandline --cut-at-cursor) _auto_complete 
+    __bubblejail_cached_candidates
+    or bubblejail list --command-line (commandline --cut-at-cursor) _auto_complete
 end
 
 complete --command bubblejail --arguments '(bubblejail_complete_func)'
@@ -6,6 +6,14 @@ from sys import path
 path.append('_LIB_PREFIX/bubblejail/python_packages')
 
 if __name__ == "__main__":
+    from sys import argv
+
+    from bubblejail.bubblejail_fast_run import try_fast_run
+
+    # Running instance does not need the rest of bubblejail
+    if try_fast_run(argv[1:]):
+        raise SystemExit
+
     from bubblejail.bubblejail_utils import BubblejailSettings
 
     BubblejailSettings.HELPER_PATH_STR = \
@@ -0,0 +1,200 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from os import environ, stat, utime
+from pathlib import Path
+from shlex import quote, split
+from shutil import which
+from subprocess import run
+from sys import executable
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase, skipIf
+from unittest import main as unittest_main
+
+PROJECT_ROOT_PATH = Path(__file__).parent.parent
+
+BASH_COMPLETION_PATH = PROJECT_ROOT_PATH / 'data/bubblejail_completion.bash'
+
+COMMAND_LINES = (
+    'bubblejail ',
+    'bubblejail r',
+    'bubblejail -',
+    'bubblejail --help r',
+    'bubblejail run ',
+    'bubblejail run --',
+    'bubblejail run --dry-run te',
+    'bubblejail run test ',
+    'bubblejail pool --refill ',
+    'bubblejail create --profile ',
+    'bubblejail create --profile f',
+    'bubblejail generate-desktop-entry --profile fire',
+    'bubblejail list ',
+    'bubblejail list instances ',
+    'bubblejail unknown ',
+    'bubblejail unknown',
+)
+
+
+@skipIf(which('bash') is None, 'bash is not installed')
+class TestBashCompletionCache(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        temp_path = Path(self.dir.name)
+
+        data_directory = temp_path / 'data'
+        self.instances_directory = data_directory / 'instances'
+        for instance_name in ('test', 'test_other', 'firefox'):
+            (self.instances_directory / instance_name).mkdir(parents=True)
+
+        config_directory = temp_path / 'config'
+        self.profiles_directory = config_directory / 'profiles'
+        self.profiles_directory.mkdir(parents=True)
+        for profile_name in ('firefox', 'firefox_wayland', 'chromium'):
+            (self.profiles_directory / f"{profile_name}.toml").touch()
+
+        self.cache_path = temp_path / 'cache/bubblejail/completion'
+
+        self.env = environ.copy()
+        self.env['BUBBLEJAIL_DATADIRS'] = str(data_directory)
+        self.env['BUBBLEJAIL_CONFDIRS'] = str(config_directory)
+        self.env['XDG_CACHE_HOME'] = str(temp_path / 'cache')
+        self.env['PYTHONPATH'] = str(PROJECT_ROOT_PATH)
+
+        # Watched directories changed within a second of writing
+        # the cache make it stale
+        self.age_path(self.instances_directory)
+        self.age_path(self.profiles_directory)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def age_path(self, path: Path) -> None:
+        path_stat = stat(path)
+        utime(path, ns=(path_stat.st_atime_ns,
+                        path_stat.st_mtime_ns - 10 * 10**9))
+
+    def python_complete(self, command_line: str) -> List[str]:
+        argv = ['list', '--command-line', command_line, '_auto_complete']
+        candidates = run(
+            (executable, '-c',
+             'from sys import argv\n'
+             f"argv[1:] = {argv!r}\n"
+             'from bubblejail.bubblejail_cli import bubblejail_main\n'
+             'bubblejail_main()\n'),
+            env=self.env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.splitlines()
+
+        # Shell filters by the word being completed
+        current_word = '' if command_line[-1].isspace() else (
+            split(command_line)[-1])
+        return sorted(x for x in candidates if x.startswith(current_word))
+
+    def bash_complete(self, command_line: str) -> List[str]:
+        words = split(command_line)
+        if command_line[-1].isspace():
+            words.append('')
+
+        bash_script = (
+            f"source {quote(str(BASH_COMPLETION_PATH))}\n"
+            'bubblejail() { echo FALLBACK; }\n'
+            f"COMP_LINE={quote(command_line)}\n"
+            'COMP_POINT=${#COMP_LINE}\n'
+            f"COMP_WORDS=({' '.join(quote(x) for x in words)})\n"
+            f"COMP_CWORD={len(words) - 1}\n"
+            f"_complete_bubblejail bubblejail {quote(words[-1])} "
+            f"{quote(words[-2])}\n"
+            'printf "%s\\n" "${COMPREPLY[@]}"\n'
+        )
+        return sorted(filter(None, run(
+            ('bash', '-c', bash_script),
+            env=self.env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.splitlines()))
+
+    def test_cache(self) -> None:
+        with self.subTest('Fallback without cache'):
+            self.assertFalse(self.cache_path.exists())
+            self.assertEqual(self.bash_complete('bubblejail run '),
+                             ['FALLBACK'])
+
+        for command_line in COMMAND_LINES:
+            python_candidates = self.python_complete(command_line)
+            with self.subTest(command_line):
+                self.assertEqual(
+                    self.bash_complete(command_line),
+                    python_candidates,
+                )
+
+        with self.subTest('New instance makes cache stale'):
+            (self.instances_directory / 'new').mkdir()
+            self.assertEqual(self.bash_complete('bubblejail run '),
+                             ['FALLBACK'])
+
+        with self.subTest('New profile makes cache stale'):
+            self.python_complete('bubblejail ')
+            self.age_path(self.instances_directory)
+            self.python_complete('bubblejail ')
+            self.assertNotIn('FALLBACK',
+                             self.bash_complete('bubblejail run '))
+
+            (self.profiles_directory / 'new.toml').touch()
+            self.assertEqual(
+                self.bash_complete('bubblejail create --profile '),
+                ['FALLBACK'],
+            )
+
+        with self.subTest('Upgrade makes cache stale'):
+            self.python_complete('bubblejail ')
+            self.age_path(self.profiles_directory)
+            self.python_complete('bubblejail ')
+            self.assertNotIn('FALLBACK',
+                             self.bash_complete('bubblejail run '))
+
+            # Installed module replaced with one of the same
+            # modification time older than the cache
+            cache_stat = stat(self.cache_path)
+            cache_lines = self.cache_path.read_text().splitlines(True)
+            self.cache_path.write_text(''.join(
+                x.rsplit('\t', 1)[0] + '\t0:0:0\n'
+                if x.startswith('install\t') else x
+                for x in cache_lines))
+            utime(self.cache_path, ns=(cache_stat.st_atime_ns,
+                                       cache_stat.st_mtime_ns))
+
+            self.assertEqual(self.bash_complete('bubblejail run '),
+                             ['FALLBACK'])
+
+        with self.subTest('Different environment'):
+            self.python_complete('bubblejail ')
+            self.age_path(self.profiles_directory)
+            self.python_complete('bubblejail ')
+            self.assertNotIn('FALLBACK',
+                             self.bash_complete('bubblejail run '))
+
+            self.env['XDG_CONFIG_HOME'] = self.dir.name
+            self.assertEqual(self.bash_complete('bubblejail run '),
+                             ['FALLBACK'])
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,190 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from json import dumps as json_dumps
+from os import stat, utime
+from pathlib import Path
+from shutil import copy
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest import main as unittest_main
+from unittest.mock import patch
+
+from toml import dumps as toml_dumps
+from toml import load as toml_load
+
+from bubblejail.config_cache import _memory_cache, load_toml
+from bubblejail.services import ServiceContainer
+
+PROFILES_PATH = Path(__file__).parent.parent / 'data/bubblejail/profiles'
+
+METADATA_TOML = '''creation_profile_name = "firefox"
+desktop_entry_name = "firefox.desktop"
+'''
+
+NOT_PARSED = 'bubblejail.config_cache.toml_loads'
+
+
+def age_file(file_path: Path) -> None:
+    """Recently modified files are not cached by time stamps"""
+    file_stat = stat(file_path)
+    utime(file_path, ns=(file_stat.st_atime_ns,
+                         file_stat.st_mtime_ns - 10 * 10**9))
+
+
+class TestConfigCache(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        self.dir_path = Path(self.dir.name)
+        self.cache_dir = self.dir_path / 'cache'
+        self.configs_dir = self.dir_path / 'configs'
+        self.configs_dir.mkdir()
+
+    def tearDown(self) -> None:
+        _memory_cache.clear()
+        self.dir.cleanup()
+
+    def create_config_files(self) -> List[Path]:
+        config_paths: List[Path] = []
+        for profile_path in sorted(PROFILES_PATH.iterdir()):
+            config_paths.append(
+                Path(copy(profile_path, self.configs_dir)))
+
+            # Instance configuration generated from profile
+            services_path = self.configs_dir / f"{profile_path.stem}.services"
+            services_path.write_text(toml_dumps(ServiceContainer(
+                toml_load(profile_path).get('services')
+            ).get_service_conf_dict()))
+            config_paths.append(services_path)
+
+        metadata_path = self.configs_dir / 'metadata_v1.toml'
+        metadata_path.write_text(METADATA_TOML)
+        config_paths.append(metadata_path)
+
+        for config_path in config_paths:
+            age_file(config_path)
+
+        return config_paths
+
+    def assertSameData(self, first: Dict[str, Any],
+                       second: Dict[str, Any]) -> None:
+        self.assertEqual(first, second)
+        # Equality does not tell apart bool and int or int and float
+        self.assertEqual(json_dumps(first, sort_keys=True),
+                         json_dumps(second, sort_keys=True))
+
+    def test_cached_parse_is_identical(self) -> None:
+        config_paths = self.create_config_files()
+        uncached_data = {x: toml_load(x) for x in config_paths}
+
+        for config_path in config_paths:
+            with self.subTest(config_path.name):
+                self.assertSameData(
+                    load_toml(config_path, cache_dir=self.cache_dir),
+                    uncached_data[config_path],
+                )
+
+                with patch(NOT_PARSED, side_effect=AssertionError):
+                    self.assertSameData(
+                        load_toml(config_path, cache_dir=self.cache_dir),
+                        uncached_data[config_path],
+                    )
+                    self.assertSameData(
+                        load_toml(config_path, config_path.read_text(),
+                                  cache_dir=self.cache_dir),
+                        uncached_data[config_path],
+                    )
+
+        with self.subTest('Parsed by another process'):
+            _memory_cache.clear()
+            with patch(NOT_PARSED, side_effect=AssertionError):
+                for config_path in config_paths:
+                    self.assertSameData(
+                        load_toml(config_path, cache_dir=self.cache_dir),
+                        uncached_data[config_path],
+                    )
+
+    def test_invalidation(self) -> None:
+        config_path = self.configs_dir / 'services.toml'
+        config_path.write_text('[x11]\n')
+        age_file(config_path)
+        self.assertEqual(load_toml(config_path, cache_dir=self.cache_dir),
+                         {'x11': {}})
+
+        with self.subTest('Same size and modification time'):
+            old_stat = stat(config_path)
+            config_path.write_text('[ipc]\n')
+            utime(config_path, ns=(old_stat.st_atime_ns,
+                                   old_stat.st_mtime_ns))
+            self.assertEqual(
+                load_toml(config_path, cache_dir=self.cache_dir),
+                {'ipc': {}},
+            )
+
+        with self.subTest('Different contents'):
+            self.assertEqual(
+                load_toml(config_path, '[x11]\n', cache_dir=self.cache_dir),
+                {'x11': {}},
+            )
+
+        with self.subTest('Recently modified file is parsed again'):
+            config_path.write_text('[network]\n')
+            self.assertEqual(
+                load_toml(config_path, cache_dir=self.cache_dir),
+                {'network': {}},
+            )
+            config_path.write_text('[wayland]\n')
+            self.assertEqual(
+                load_toml(config_path, cache_dir=self.cache_dir),
+                {'wayland': {}},
+            )
+
+        with self.subTest('Removed file'):
+            config_path.unlink()
+            with self.assertRaises(FileNotFoundError):
+                load_toml(config_path, cache_dir=self.cache_dir)
+
+    def test_data_not_shared(self) -> None:
+        config_path = self.configs_dir / 'services.toml'
+        config_path.write_text('[home_share]\nhome_paths = ["Downloads"]\n')
+        age_file(config_path)
+
+        first_data = load_toml(config_path, cache_dir=self.cache_dir)
+        first_data['home_share']['home_paths'].append('Documents')
+
+        self.assertEqual(
+            load_toml(config_path, cache_dir=self.cache_dir),
+            {'home_share': {'home_paths': ['Downloads']}},
+        )
+
+    def test_not_marshalable(self) -> None:
+        config_path = self.configs_dir / 'services.toml'
+        config_path.write_text('x11 = {}\nnetwork = {}\n')
+        age_file(config_path)
+
+        for _ in range(2):
+            self.assertEqual(
+                load_toml(config_path, cache_dir=self.cache_dir),
+                {'x11': {}, 'network': {}},
+            )
+
+        self.assertFalse(self.cache_dir.exists())
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from asyncio import get_event_loop, sleep
+from os import environ
+from os.path import expanduser
+from pathlib import Path
+from subprocess import run
+from sys import executable
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest import main as unittest_main
+
+from bubblejail.bubblejail_fast_run import (rewrite_home_arguments,
+                                            run_request_line, try_fast_run)
+from bubblejail.bubblejail_helper import BubblejailHelper, RequestRun
+
+
+class TestFastRun(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        self.old_runtime_dir = environ.get('XDG_RUNTIME_DIR')
+        environ['XDG_RUNTIME_DIR'] = self.dir.name
+
+        helper_dir = Path(self.dir.name) / 'bubblejail/test/helper'
+        helper_dir.mkdir(parents=True)
+        self.helper = BubblejailHelper(
+            startup_args=[],
+            helper_socket_path=helper_dir / 'helper.socket',
+            no_child_timeout=None,
+            use_fixups=False,
+            linger_timeout=60,
+        )
+        await self.helper.start_async()
+
+    async def asyncTearDown(self) -> None:
+        await self.helper.stop_async()
+        if self.old_runtime_dir is not None:
+            environ['XDG_RUNTIME_DIR'] = self.old_runtime_dir
+
+        self.dir.cleanup()
+
+    async def fast_run(self, argv: List[str]) -> bool:
+        # Blocking send would deadlock with helper in the same loop
+        return await get_event_loop().run_in_executor(
+            None, try_fast_run, argv)
+
+    async def test_fast_run(self) -> None:
+        with self.subTest('Command is run in running instance'):
+            self.assertTrue(await self.fast_run(
+                ['run', 'test', '/bin/sh', '-c', 'exit 3']))
+
+            while not self.helper.reaper.exit_history:
+                await sleep(0.01)
+
+            exit_record = self.helper.reaper.exit_history[-1]
+            self.assertEqual(exit_record.argv, ['/bin/sh', '-c', 'exit 3'])
+            self.assertEqual(exit_record.exit_code, 3)
+
+        with self.subTest('Not running instance'):
+            self.assertFalse(await self.fast_run(['run', 'other', 'true']))
+
+        with self.subTest('Options are left to command line interface'):
+            self.assertFalse(
+                await self.fast_run(['run', '--wait', 'test', 'true']))
+            self.assertFalse(await self.fast_run(['list', 'instances']))
+
+        with self.subTest('Names outside run-time directory'):
+            self.assertFalse(
+                await self.fast_run(['run', '../bubblejail/test', 'true']))
+
+        with self.subTest('Stale socket'):
+            await self.helper.stop_async()
+            self.assertFalse(await self.fast_run(['run', 'test', 'true']))
+
+
+class TestFastRunRequest(TestCase):
+    def test_request_line(self) -> None:
+        args_to_run = ['firefox', 'https://example.com/"quoted"', 'ü']
+        self.assertEqual(
+            run_request_line(args_to_run),
+            RequestRun(args_to_run).to_json_byte_line(),
+        )
+
+    def test_imports(self) -> None:
+        imports_output = run(
+            (executable, '-X', 'importtime', '-c',
+             'import bubblejail.bubblejail_fast_run'),
+            env={**environ,
+                 'PYTHONPATH': str(Path(__file__).parent.parent)},
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stderr
+        imported_modules = {
+            x.split('|')[2].strip()
+            for x in imports_output.splitlines()[1:]
+        }
+
+        for heavy_module in ('asyncio', 'typing', 'toml', 'xdg',
+                             'bubblejail.bubblejail_helper',
+                             'bubblejail.bubblejail_directories'):
+            with self.subTest(heavy_module):
+                self.assertNotIn(heavy_module, imported_modules)
+
+    def test_home_rewrite(self) -> None:
+        self.assertEqual(
+            rewrite_home_arguments([expanduser('~/file'), '/tmp/file']),
+            ['/home/user/file', '/tmp/file'],
+        )
+
+
+if __name__ == '__main__':
+    unittest_main()
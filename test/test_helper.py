@@ -14,15 +14,31 @@
 # You should have received a copy of the GNU General Public License
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
-from asyncio import (StreamReader, StreamWriter, create_subprocess_exec,
-                     create_task, get_event_loop, open_unix_connection)
-from os import unlink
+from asyncio import (StreamReader, StreamWriter, all_tasks,
+                     create_subprocess_exec, create_task, current_task, gather,
+                     get_event_loop, open_unix_connection, sleep, wait_for)
+from gc import collect as gc_collect
+from json import loads as json_loads
+from os import listdir, unlink
 from pathlib import Path
+from subprocess import DEVNULL, run
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import monotonic
+from time import sleep as blocking_sleep
+from typing import List
 from unittest import IsolatedAsyncioTestCase, TestCase
 from unittest import main as unittest_main
+from warnings import catch_warnings, simplefilter
 
-from bubblejail.bubblejail_helper import (BubblejailHelper, RequestPing,
+from bubblejail.bubblejail_helper import (BubblejailHelper, JsonRpcRequest,
+                                          RequestExitHistory, RequestPing,
+                                          RequestRun,
                                           get_helper_argument_parser)
+from bubblejail.bubblejail_helper_client import HelperClient
+from bubblejail.bubblejail_trace import TraceRecorder
+
+PROJECT_ROOT_PATH = Path(__file__).parent.parent
 
 # Test socket needs to be cleaned up
 test_socket_path = Path('./test_socket')
@@ -112,6 +128,28 @@ class HelperParserTests(TestCase):
             self.assertEqual(parsed_args.args_to_run, [])
 
 
+class HelperScriptTest(TestCase):
+    def test_trace_without_package(self) -> None:
+        # Same way as --debug-helper-script runs it
+        helper_script = (
+            PROJECT_ROOT_PATH / 'bubblejail/bubblejail_helper.py'
+        ).read_text()
+        with TemporaryDirectory() as temp_dir:
+            helper_process = run(
+                (executable, '-c', helper_script,
+                 '--trace', '--linger-timeout', '0',
+                 '--helper-socket', f"{temp_dir}/helper.socket",
+                 '/bin/true'),
+                capture_output=True,
+                text=True,
+                timeout=30,
+            )
+
+        self.assertEqual(helper_process.returncode, 0,
+                         helper_process.stderr)
+        self.assertIn('Tracing is not available', helper_process.stdout)
+
+
 class PidTrackerTest(IsolatedAsyncioTestCase):
 
     async def test_process_detection(self) -> None:
@@ -128,6 +166,18 @@ class PidTrackerTest(IsolatedAsyncioTestCase):
             self.assertTrue(
                 BubblejailHelper.process_has_child())
 
+        with self.subTest('Stopping at first child leaves nothing open'):
+            with catch_warnings(record=True) as caught_warnings:
+                simplefilter('always', ResourceWarning)
+                BubblejailHelper.process_has_child()
+                gc_collect()
+
+            self.assertEqual(
+                [x for x in caught_warnings
+                 if issubclass(x.category, ResourceWarning)],
+                [],
+            )
+
         with self.subTest('PID tracking by command: right command'):
             # WARN: This will give false positive if you have
             # sleep runing anywhere on the system
@@ -145,5 +195,317 @@ class PidTrackerTest(IsolatedAsyncioTestCase):
         await child_process.wait()
 
 
+class LingerTest(IsolatedAsyncioTestCase):
+    async def test_linger(self) -> None:
+        helper = BubblejailHelper(
+            startup_args=['true'],
+            helper_socket_path=test_socket_path,
+            use_fixups=False,
+            linger_timeout=0.5,
+        )
+        await helper.start_async()
+
+        try:
+            await sleep(0.25)
+            with self.subTest('Helper lingers without children'):
+                self.assertFalse(helper.terminated.is_set())
+
+            with self.subTest('Helper terminates after linger timeout'):
+                await wait_for(helper, timeout=2)
+        finally:
+            unlink(test_socket_path)
+
+    async def test_startup_args_resolved(self) -> None:
+        helper = BubblejailHelper(
+            startup_args=['true'],
+            helper_socket_path=test_socket_path,
+            use_fixups=False,
+        )
+
+        for args_to_run, resolved_args in (
+                ([], ['true']),
+                (['false'], ['false'])):
+            with self.subTest(args_to_run=args_to_run):
+                request = helper.parse_request(
+                    RequestRun(args_to_run).to_json_byte_line())
+                if not isinstance(request, RequestRun):
+                    raise TypeError('Expected run request')
+
+                self.assertEqual(request.args_to_run, resolved_args)
+
+
+class PipeliningTest(IsolatedAsyncioTestCase):
+    async def get_response_ids(
+            self, max_concurrent_requests: int,
+            requests: List[JsonRpcRequest],
+            responses_count: int) -> List[str]:
+        helper = BubblejailHelper(
+            startup_args=[],
+            helper_socket_path=test_socket_path,
+            no_child_timeout=None,
+            use_fixups=False,
+            linger_timeout=60,
+            max_concurrent_requests=max_concurrent_requests,
+        )
+        await helper.start_async()
+
+        try:
+            (reader, writer) = await open_unix_connection(
+                path=test_socket_path,
+            )
+            for request in requests:
+                writer.write(request.to_json_byte_line())
+
+            await writer.drain()
+
+            response_ids = [
+                json_loads(await wait_for(reader.readline(), timeout=5))['id']
+                for _ in range(responses_count)
+            ]
+
+            writer.close()
+            await writer.wait_closed()
+        finally:
+            # Detached commands are still running
+            await helper.terminate_async()
+            unlink(test_socket_path)
+
+        return response_ids
+
+    async def test_pipelining(self) -> None:
+        slow_run = RequestRun(
+            args_to_run=['/bin/sh', '-c', 'sleep 0.2; echo slow'],
+            wait_response=True,
+            request_id='run',
+        )
+        fast_run = RequestRun(
+            args_to_run=['/bin/echo', 'fast'],
+            wait_response=True,
+            request_id='fast',
+        )
+
+        with self.subTest('Ping is not blocked by running command'):
+            self.assertEqual(
+                await self.get_response_ids(
+                    2, [slow_run, RequestPing('ping')], 2),
+                ['ping', 'run'],
+            )
+
+        with self.subTest('Ping does not count towards limit'):
+            self.assertEqual(
+                await self.get_response_ids(
+                    1, [slow_run, RequestPing('ping')], 2),
+                ['ping', 'run'],
+            )
+
+        with self.subTest('Requests over the limit wait'):
+            self.assertEqual(
+                await self.get_response_ids(1, [slow_run, fast_run], 2),
+                ['run', 'fast'],
+            )
+
+        with self.subTest('Detached commands do not count towards limit'):
+            detached_run = RequestRun(
+                args_to_run=['/bin/sleep', '60'],
+            )
+            self.assertEqual(
+                await self.get_response_ids(
+                    1, [detached_run, detached_run, fast_run], 1),
+                ['fast'],
+            )
+
+
+class ReaperTest(IsolatedAsyncioTestCase):
+    async def test_exit_history(self) -> None:
+        helper = BubblejailHelper(
+            startup_args=[],
+            helper_socket_path=test_socket_path,
+            no_child_timeout=None,
+            use_fixups=False,
+            # Do not terminate once commands exit
+            linger_timeout=60,
+            exit_history_size=3,
+        )
+        await helper.start_async()
+
+        try:
+            with self.subTest('Command exit code'):
+                await helper.run_command(['/bin/sh', '-c', 'exit 3'])
+                exit_record = helper.reaper.exit_history[-1]
+                self.assertEqual(exit_record.exit_code, 3)
+                self.assertEqual(exit_record.argv[0], '/bin/sh')
+
+            with self.subTest('History is bounded'):
+                for _ in range(3):
+                    await helper.run_command(['/bin/true'])
+
+                self.assertEqual(len(helper.reaper.exit_history), 3)
+                # Orphans left by earlier tests are reaped as well
+                self.assertGreaterEqual(helper.reaper.reaped_total, 4)
+
+            with self.subTest('Detached command is left to reaper'):
+                await helper.run_command(
+                    ['/bin/sh', '-c', 'exit 5'], DEVNULL)
+                # Command exits before reaper gets to run. Starting
+                # another command waits for discarded Popen objects.
+                blocking_sleep(0.2)
+                await helper.run_command(['/bin/true'])
+
+                async def wait_exit_code() -> None:
+                    while 5 not in (x.exit_code
+                                    for x in helper.reaper.exit_history):
+                        await sleep(0.05)
+
+                await wait_for(wait_exit_code(), timeout=2)
+
+            with self.subTest('History over RPC'):
+                (reader, writer) = await open_unix_connection(
+                    path=test_socket_path,
+                )
+                request = RequestExitHistory('test')
+                writer.write(request.to_json_byte_line())
+                await writer.drain()
+
+                exit_records = request.decode_response(
+                    await reader.readline())
+                self.assertEqual(
+                    exit_records, list(helper.reaper.exit_history))
+
+                writer.close()
+                await writer.wait_closed()
+        finally:
+            await helper.stop_async()
+            unlink(test_socket_path)
+
+
+class TerminationTest(IsolatedAsyncioTestCase):
+    async def test_termination_deadline(self) -> None:
+        helper = BubblejailHelper(
+            startup_args=[],
+            helper_socket_path=test_socket_path,
+            no_child_timeout=None,
+            use_fixups=False,
+            termination_deadline=0.5,
+        )
+        await helper.start_async()
+
+        try:
+            # Child ignores SIGTERM and has to be killed
+            run_task = create_task(helper.run_command(
+                ['/bin/sh', '-c', 'trap "" TERM; exec sleep 30']))
+            while not helper.process_has_child():
+                await sleep(0.01)
+
+            start_time = monotonic()
+            await wait_for(helper.terminate_async(), timeout=5)
+            self.assertLess(monotonic() - start_time, 3)
+            self.assertTrue(helper.terminated.is_set())
+
+            await wait_for(run_task, timeout=1)
+            self.assertFalse(helper.process_has_child())
+        finally:
+            unlink(test_socket_path)
+
+
+class LoadTest(IsolatedAsyncioTestCase):
+    async def test_no_leaks_under_load(self) -> None:
+        helper = BubblejailHelper(
+            startup_args=[],
+            helper_socket_path=test_socket_path,
+            no_child_timeout=None,
+            use_fixups=False,
+            linger_timeout=60,
+            max_concurrent_requests=8,
+        )
+        await helper.start_async()
+
+        def count_tasks() -> int:
+            return len(all_tasks() - {current_task()})
+
+        def count_open_fds() -> int:
+            return len(listdir('/proc/self/fd'))
+
+        async def client_load(client: HelperClient) -> None:
+            for x in range(30):
+                if x % 3 == 0:
+                    await client.ping()
+                elif x % 3 == 1:
+                    await client.run(['/bin/true'])
+                else:
+                    self.assertEqual(
+                        await client.run(['/bin/echo', str(x)],
+                                         wait_response=True),
+                        f"{x}\n",
+                    )
+
+        try:
+            tasks_before = count_tasks()
+            fds_before = count_open_fds()
+
+            clients = [HelperClient(test_socket_path) for _ in range(10)]
+            await gather(*(x.connect() for x in clients))
+            await wait_for(
+                gather(*(client_load(x) for x in clients)),
+                timeout=30,
+            )
+            await gather(*(x.close() for x in clients))
+
+            # Connection handlers and fire and forget commands
+            # finish after clients are closed
+            for _ in range(500):
+                if not helper.reaper.commands and (
+                        count_tasks() <= tasks_before):
+                    break
+                await sleep(0.01)
+
+            with self.subTest('All commands reaped'):
+                self.assertFalse(helper.reaper.commands)
+                # Orphans left by earlier tests are reaped as well
+                self.assertGreaterEqual(helper.reaper.reaped_total, 200)
+
+            with self.subTest('No leaked tasks'):
+                self.assertEqual(count_tasks(), tasks_before)
+
+            with self.subTest('No leaked file descriptors'):
+                self.assertEqual(count_open_fds(), fds_before)
+        finally:
+            await helper.stop_async()
+            unlink(test_socket_path)
+
+
+class TraceRecorderTest(TestCase):
+    def test_merge_trace(self) -> None:
+        with TemporaryDirectory() as tempdir:
+            helper_trace_path = Path(tempdir) / 'trace.jsonl'
+            trace_path = Path(tempdir) / 'trace.json'
+
+            helper_tracer = TraceRecorder('helper', enabled=True)
+            with helper_tracer.span('startup command'):
+                ...
+            helper_tracer.add_instant('first request')
+            helper_tracer.save_json_lines(helper_trace_path)
+
+            tracer = TraceRecorder('bubblejail', enabled=True)
+            with tracer.span('launch plan', cache='miss'):
+                ...
+            tracer.save_trace(trace_path, (helper_trace_path, ))
+
+            trace_events = json_loads(trace_path.read_text())['traceEvents']
+
+        self.assertEqual(
+            [event['name'] for event in trace_events],
+            ['process_name', 'launch plan',
+             'process_name', 'startup command', 'first request'],
+        )
+        self.assertEqual(trace_events[1]['args'], {'cache': 'miss'})
+
+    def test_disabled(self) -> None:
+        tracer = TraceRecorder('bubblejail')
+        with tracer.span('launch plan'):
+            ...
+
+        self.assertEqual(tracer.events, [])
+
+
 if __name__ == '__main__':
     unittest_main()
@@ -0,0 +1,202 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from asyncio import StreamReader, StreamWriter
+from asyncio import TimeoutError as AsyncioTimeoutError
+from asyncio import (create_task, gather, get_event_loop, sleep,
+                     start_unix_server, wait_for)
+from os import close, pipe
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+from unittest import IsolatedAsyncioTestCase
+from unittest import main as unittest_main
+
+from bubblejail.bubblejail_helper import BubblejailHelper, RpcFraming
+from bubblejail.bubblejail_helper_client import HelperClient, run_with_fds
+from bubblejail.exceptions import HelperConnectionError
+
+
+class TestHelperClient(IsolatedAsyncioTestCase):
+    framing: RpcFraming = 'line'
+
+    async def asyncSetUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        socket_path = Path(self.dir.name) / 'helper.socket'
+        self.fd_socket_path = Path(self.dir.name) / 'fds.socket'
+
+        self.helper = BubblejailHelper(
+            startup_args=[],
+            helper_socket_path=socket_path,
+            fd_socket_path=self.fd_socket_path,
+            no_child_timeout=None,
+            use_fixups=False,
+            linger_timeout=60,
+        )
+        await self.helper.start_async()
+
+        self.client = HelperClient(socket_path, framing=self.framing)
+        await self.client.connect()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await self.helper.stop_async()
+        self.dir.cleanup()
+
+    async def test_requests(self) -> None:
+        with self.subTest('Concurrent requests on one connection'):
+            slow_task = create_task(self.client.run(
+                ['/bin/sh', '-c', 'sleep 0.2; echo slow'],
+                wait_response=True,
+            ))
+            await self.client.ping()
+            self.assertFalse(slow_task.done())
+            self.assertEqual(await slow_task, 'slow\n')
+
+        with self.subTest('Many requests'):
+            outputs = await gather(*(
+                self.client.run(['/bin/echo', str(x)], wait_response=True)
+                for x in range(20)
+            ))
+            self.assertEqual(outputs, [f"{x}\n" for x in range(20)])
+
+        with self.subTest('Request timeout'):
+            with self.assertRaises(AsyncioTimeoutError):
+                await self.client.run(
+                    ['/bin/sleep', '0.5'],
+                    wait_response=True,
+                    timeout=0.05,
+                )
+
+            # Connection is still usable
+            await self.client.ping()
+            self.assertFalse(self.client.pending_responses)
+
+        with self.subTest('Command not found'):
+            output = await self.client.run(
+                ['/nonexistent/command'],
+                wait_response=True,
+                timeout=5,
+            )
+            self.assertIn('Failed to run command', output or '')
+
+        with self.subTest('Fire and forget run'):
+            self.assertIsNone(await self.client.run(['/bin/true']))
+            while self.helper.reaper.exit_history[-1].argv != ['/bin/true']:
+                await sleep(0.01)
+
+    async def test_streaming(self) -> None:
+        output: Dict[str, bytes] = {'stdout': b'', 'stderr': b''}
+
+        def output_handler(stream_name: str, data: bytes) -> None:
+            output[stream_name] += data
+
+        with self.subTest('Output streams and exit code'):
+            exit_code = await self.client.run_streaming(
+                ['/bin/sh', '-c',
+                 r'echo out; echo err >&2; printf "\377"; exit 5'],
+                output_handler,
+            )
+            self.assertEqual(exit_code, 5)
+            self.assertEqual(output['stdout'], b'out\n\xff')
+            self.assertEqual(output['stderr'], b'err\n')
+
+        with self.subTest('Large output is sent in chunks'):
+            chunk_sizes: List[int] = []
+            exit_code = await self.client.run_streaming(
+                ['/bin/head', '-c', '1000000', '/dev/zero'],
+                lambda _, data: chunk_sizes.append(len(data)),
+            )
+            self.assertEqual(exit_code, 0)
+            self.assertEqual(sum(chunk_sizes), 1000000)
+            self.assertGreater(len(chunk_sizes), 1)
+
+        with self.subTest('Command not found'):
+            output['stderr'] = b''
+            exit_code = await self.client.run_streaming(
+                ['/nonexistent/command'],
+                output_handler,
+                timeout=5,
+            )
+            self.assertEqual(exit_code, 127)
+            self.assertIn(b'Failed to run command', output['stderr'])
+
+    async def test_fd_passing(self) -> None:
+        input_path = Path(self.dir.name) / 'input'
+        input_path.write_bytes(b'test data')
+
+        read_fd, write_fd = pipe()
+        try:
+            with open(input_path, mode='rb') as input_file:
+                exit_code = await run_with_fds(
+                    fd_socket_path=self.fd_socket_path,
+                    args_to_run=['/bin/sh', '-c', 'cat <&3 >&4; exit 4'],
+                    file_fds=[input_file.fileno(), write_fd],
+                )
+        finally:
+            close(write_fd)
+
+        with self.subTest('Exit code'):
+            self.assertEqual(exit_code, 4)
+
+        with self.subTest('Helper closed its copies of descriptors'):
+            with open(read_fd, mode='rb') as output_file:
+                # Would never reach end of file if pipe was leaked
+                output = await wait_for(
+                    get_event_loop().run_in_executor(
+                        None, output_file.read),
+                    timeout=5,
+                )
+            self.assertEqual(output, b'test data')
+
+        with self.subTest('Command not found'):
+            self.assertEqual(
+                await run_with_fds(
+                    fd_socket_path=self.fd_socket_path,
+                    args_to_run=['/nonexistent/command'],
+                ),
+                127,
+            )
+
+    async def test_connection_lost(self) -> None:
+        async def close_after_request(
+                reader: StreamReader,
+                writer: StreamWriter) -> None:
+            await reader.readline()
+            writer.close()
+
+        socket_path = Path(self.dir.name) / 'closing.socket'
+        server = await start_unix_server(close_after_request, path=socket_path)
+
+        try:
+            async with HelperClient(socket_path) as client:
+                with self.assertRaises(HelperConnectionError):
+                    await client.ping()
+
+                with self.assertRaises(HelperConnectionError):
+                    await client.ping()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+
+class TestHelperClientBinaryFraming(TestHelperClient):
+    framing: RpcFraming = 'binary'
+
+
+if __name__ == '__main__':
+    unittest_main()
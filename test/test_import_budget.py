@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from importlib.util import find_spec
+from os import environ
+from pathlib import Path
+from subprocess import run
+from sys import executable
+from tempfile import TemporaryDirectory
+from typing import Set
+from unittest import TestCase, skipIf
+from unittest import main as unittest_main
+
+# Modules helper may import in addition to the ones asyncio imports
+HELPER_ALLOWED_IMPORTS = {
+    '__future__', 'argparse', 'gettext',
+    'json', 'json.decoder', 'json.encoder', 'json.scanner', '_json',
+    'bubblejail', 'bubblejail.bubblejail_helper',
+}
+# Only running or editing instance needs these
+CLI_FORBIDDEN_IMPORTS = {
+    'asyncio', 'ctypes', 'xdg.IniFile',
+    'bubblejail.bubblejail_instance', 'bubblejail.bubblejail_seccomp',
+    'bubblejail.bubblejail_pool', 'bubblejail.services',
+}
+GUI_FORBIDDEN_IMPORTS = {
+    'asyncio', 'bubblejail.bubblejail_instance',
+    'bubblejail.bubblejail_seccomp',
+}
+
+
+class ImportBudgetBase(TestCase):
+    def run_python(self, code: str, *python_args: str) -> str:
+        """Returns standard error"""
+        return run(
+            (executable, *python_args, '-c', code),
+            env=self.env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stderr
+
+    def imported_modules(self, code: str) -> Set[str]:
+        return set(self.run_python(
+            code + '\n'
+            'from sys import modules, stderr\n'
+            'print(*modules, sep="\\n", file=stderr)\n'
+        ).splitlines())
+
+    def setUp(self) -> None:
+        self.temp_dir = TemporaryDirectory()
+        self.env = environ.copy()
+        self.env['PYTHONPATH'] = str(Path(__file__).parent.parent)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+
+class HelperImportBudgetTest(ImportBudgetBase):
+    """Helper is started in every sandbox before it can bind socket"""
+
+    def test_imported_modules(self) -> None:
+        imported_modules = self.imported_modules(
+            'import asyncio; import bubblejail.bubblejail_helper')
+        asyncio_modules = self.imported_modules('import asyncio')
+
+        self.assertLessEqual(
+            imported_modules - asyncio_modules,
+            HELPER_ALLOWED_IMPORTS,
+        )
+
+
+class CliImportBudgetTest(ImportBudgetBase):
+    """Every bubblejail command and shell completion imports the CLI"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.env['XDG_CONFIG_HOME'] = self.temp_dir.name + '/config'
+        self.env['XDG_DATA_HOME'] = self.temp_dir.name + '/data'
+        # Completion writes its cache
+        self.env['XDG_CACHE_HOME'] = self.temp_dir.name + '/cache'
+        self.env.pop('BUBBLEJAIL_CONFDIRS', None)
+        self.env.pop('BUBBLEJAIL_DATADIRS', None)
+
+    def test_imported_modules(self) -> None:
+        imported_modules = self.imported_modules(
+            'import bubblejail.bubblejail_cli')
+
+        with self.subTest('Heavy modules are not imported'):
+            self.assertFalse(imported_modules & CLI_FORBIDDEN_IMPORTS)
+
+        with self.subTest('No directories created on import'):
+            self.assertFalse(Path(self.env['XDG_CONFIG_HOME']).exists())
+            self.assertFalse(Path(self.env['XDG_DATA_HOME']).exists())
+
+    def test_list_commands(self) -> None:
+        for dirs_variable in ('BUBBLEJAIL_CONFDIRS', 'BUBBLEJAIL_DATADIRS'):
+            bubblejail_dir = Path(self.temp_dir.name) / dirs_variable
+            bubblejail_dir.mkdir()
+            self.env[dirs_variable] = str(bubblejail_dir)
+
+        for list_args in (
+            "'instances'",
+            "'profiles'",
+            "'_auto_complete', '--command-line', 'bubblejail run '",
+        ):
+            with self.subTest(list_args):
+                imported_modules = self.imported_modules(
+                    'from sys import argv\n'
+                    f"argv[1:] = ['list', {list_args}]\n"
+                    'from bubblejail.bubblejail_cli import bubblejail_main\n'
+                    'bubblejail_main()\n'
+                )
+                self.assertFalse(imported_modules & CLI_FORBIDDEN_IMPORTS)
+
+
+@skipIf(find_spec('PyQt5') is None, 'PyQt5 is not installed')
+class GuiImportBudgetTest(ImportBudgetBase):
+    """Window should show up before instance is selected"""
+
+    def test_imported_modules(self) -> None:
+        imported_modules = self.imported_modules(
+            'import bubblejail.bubblejail_gui_qt')
+
+        self.assertFalse(imported_modules & GUI_FORBIDDEN_IMPORTS)
+
+
+if __name__ == '__main__':
+    unittest_main()
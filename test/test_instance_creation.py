@@ -15,15 +15,18 @@
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from os import environ
+from os import environ, fstat, fsync
 from pathlib import Path
+from stat import S_ISDIR
 from tempfile import TemporaryDirectory
-from unittest import IsolatedAsyncioTestCase
+from typing import List
+from unittest import IsolatedAsyncioTestCase, TestCase
 from unittest import main as unittest_main
+from unittest.mock import patch
 
 from bubblejail.bubblejail_directories import BubblejailDirectories
 from bubblejail.bubblejail_instance import BubblejailInstance
-from bubblejail.bubblejail_utils import FILE_NAME_SERVICES
+from bubblejail.bubblejail_utils import FILE_NAME_METADATA, FILE_NAME_SERVICES
 
 
 class TestInstanceGeneration(IsolatedAsyncioTestCase):
@@ -60,5 +63,94 @@ class TestInstanceGeneration(IsolatedAsyncioTestCase):
         await instance.async_run_init([], dry_run=True)
 
 
+class TestInstanceMetadata(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        self.instance_directory = Path(self.dir.name) / 'test'
+        self.instance_directory.mkdir()
+        self.metadata_path = self.instance_directory / FILE_NAME_METADATA
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_metadata_session(self) -> None:
+        instance = BubblejailInstance(self.instance_directory)
+
+        with self.subTest('Changes are written once'):
+            with instance.metadata as metadata:
+                metadata.creation_profile_name = 'firefox'
+                # Nested sessions commit with the outer one
+                instance.metadata_desktop_entry_name = 'firefox.desktop'
+
+                self.assertEqual(metadata.creation_profile_name, 'firefox')
+                self.assertFalse(self.metadata_path.exists())
+
+            self.assertEqual(
+                BubblejailInstance(
+                    self.instance_directory).metadata_desktop_entry_name,
+                'firefox.desktop',
+            )
+
+        with self.subTest('Failed session is not written'):
+            with self.assertRaises(RuntimeError):
+                with instance.metadata as metadata:
+                    metadata.desktop_entry_name = 'chromium.desktop'
+                    raise RuntimeError
+
+            self.assertEqual(
+                BubblejailInstance(
+                    self.instance_directory).metadata_desktop_entry_name,
+                'firefox.desktop',
+            )
+            self.assertEqual(
+                instance.metadata_desktop_entry_name, 'firefox.desktop')
+
+            # Next session should not write discarded changes
+            instance.metadata_creation_profile_name = 'firefox'
+            self.assertEqual(
+                BubblejailInstance(
+                    self.instance_directory).metadata_desktop_entry_name,
+                'firefox.desktop',
+            )
+
+        with self.subTest('Other writers are not overwritten'):
+            other_instance = BubblejailInstance(self.instance_directory)
+            with other_instance.metadata as metadata:
+                metadata.set_value('launch_count', 1)
+
+            with instance.metadata as metadata:
+                metadata.creation_profile_name = 'generic'
+
+            metadata = BubblejailInstance(self.instance_directory).metadata
+            self.assertEqual(metadata.get_value('launch_count', int), 1)
+            self.assertEqual(metadata.creation_profile_name, 'generic')
+
+        with self.subTest('File is replaced'):
+            old_inode = self.metadata_path.stat().st_ino
+            instance.metadata_creation_profile_name = 'firefox'
+            self.assertNotEqual(self.metadata_path.stat().st_ino, old_inode)
+            self.assertEqual(
+                [x.name for x in self.instance_directory.iterdir()],
+                [FILE_NAME_METADATA],
+            )
+
+        with self.subTest('Instance directory is synced'):
+            synced_directories: List[bool] = []
+
+            def record_fsync(fd: int) -> None:
+                synced_directories.append(S_ISDIR(fstat(fd).st_mode))
+                fsync(fd)
+
+            with patch('bubblejail.bubblejail_instance.fsync', record_fsync):
+                instance.metadata_creation_profile_name = 'generic'
+
+            # File is synced before rename, directory after it
+            self.assertEqual(synced_directories, [False, True])
+
+        with self.subTest('Value type is checked'):
+            with self.assertRaises(TypeError):
+                instance.metadata.get_value('launch_count', str)
+
+
 if __name__ == '__main__':
     unittest_main()
@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import environ, stat, utime
+from pathlib import Path
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from bubblejail.bubblejail_directories import BubblejailDirectories
+from bubblejail.bubblejail_utils import FILE_NAME_SERVICES
+from bubblejail.exceptions import BubblejailInstanceNotFoundError
+from bubblejail.instances_index import (INSTANCES_INDEX_FILE_NAME,
+                                        InstancesIndex)
+
+
+class TestInstancesIndex(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        self.data_directory = Path(self.dir.name)
+        self.instances_directory = self.data_directory / 'instances'
+        self.index_path = self.data_directory / INSTANCES_INDEX_FILE_NAME
+        self.old_data_dirs = environ.get('BUBBLEJAIL_DATADIRS')
+        environ['BUBBLEJAIL_DATADIRS'] = self.dir.name
+
+    def tearDown(self) -> None:
+        if self.old_data_dirs is not None:
+            environ['BUBBLEJAIL_DATADIRS'] = self.old_data_dirs
+        else:
+            del environ['BUBBLEJAIL_DATADIRS']
+
+        self.dir.cleanup()
+
+    def age_instances_directory(self) -> None:
+        """Index does not trust recently modified directories"""
+        instances_stat = stat(self.instances_directory)
+        utime(
+            self.instances_directory,
+            ns=(instances_stat.st_atime_ns,
+                instances_stat.st_mtime_ns - 10 * 10**9),
+        )
+
+    def test_create_and_lookup(self) -> None:
+        BubblejailDirectories.create_new_instance('test')
+        records = InstancesIndex(self.data_directory).records()
+
+        self.assertEqual(list(records), ['test'])
+        self.assertEqual(
+            records['test'].path, str(self.instances_directory / 'test'))
+        self.assertIsNone(records['test'].creation_profile_name)
+        self.assertEqual(
+            BubblejailDirectories.instance_get('test').instance_directory,
+            self.instances_directory / 'test',
+        )
+
+        with self.assertRaises(BubblejailInstanceNotFoundError):
+            BubblejailDirectories.instance_get('not_test')
+
+    def test_revalidation(self) -> None:
+        BubblejailDirectories.create_new_instance('test')
+
+        with self.subTest('Instance created outside of bubblejail'):
+            (self.instances_directory / 'copied').mkdir()
+            self.assertEqual(
+                list(InstancesIndex(self.data_directory).records()),
+                ['copied', 'test'],
+            )
+
+        with self.subTest('Instance removed outside of bubblejail'):
+            rmtree(self.instances_directory / 'copied')
+            self.assertEqual(
+                list(InstancesIndex(self.data_directory).records()),
+                ['test'],
+            )
+
+        with self.subTest('Index is used if directory was not modified'):
+            self.age_instances_directory()
+            InstancesIndex(self.data_directory).rebuild()
+
+            # Same modification time as indexed directory
+            instances_stat = stat(self.instances_directory)
+            (self.instances_directory / 'hidden').mkdir()
+            utime(
+                self.instances_directory,
+                ns=(instances_stat.st_atime_ns, instances_stat.st_mtime_ns),
+            )
+
+            self.assertEqual(
+                list(InstancesIndex(self.data_directory).records()),
+                ['test'],
+            )
+
+        with self.subTest('Recently modified directory is not trusted'):
+            (self.instances_directory / 'new').mkdir()
+            InstancesIndex(self.data_directory).rebuild()
+            index = json_loads(self.index_path.read_text())
+            self.assertIsNone(index['instances_mtime_ns'])
+
+    def test_old_config_conversion(self) -> None:
+        old_instance_directory = self.instances_directory / 'old'
+        old_instance_directory.mkdir(parents=True)
+        (old_instance_directory / 'config.toml').write_text(
+            'services = ["x11"]\n'
+            'executable_name = "firefox"\n'
+        )
+        services_path = old_instance_directory / FILE_NAME_SERVICES
+
+        InstancesIndex(self.data_directory).records()
+        self.assertIn('[x11]', services_path.read_text())
+
+        with self.subTest('Converted once per index version'):
+            services_path.unlink()
+            (self.instances_directory / 'new').mkdir()
+            InstancesIndex(self.data_directory).records()
+            self.assertFalse(services_path.exists())
+
+        with self.subTest('Converted again on index version change'):
+            index = json_loads(self.index_path.read_text())
+            index['version'] = -1
+            self.index_path.write_text(json_dumps(index))
+
+            InstancesIndex(self.data_directory).records()
+            self.assertTrue(services_path.exists())
+
+
+if __name__ == '__main__':
+    unittest_main()
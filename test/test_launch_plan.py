@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import environ
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import cast
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from toml import loads as toml_loads
+
+from bubblejail.bwrap_config import FileTransfer
+from bubblejail.launch_plan import LaunchPlan, LaunchPlanCache
+from bubblejail.services import ServiceContainer, ServicesConfDictType
+
+TEST_CONFIG = '''
+[common]
+executable_name = "/usr/bin/true"
+filter_disk_sync = true
+dbus_name = "org.example.Test"
+linger_timeout = 30
+
+[root_share]
+paths = ["/srv/test"]
+read_only_paths = ["/srv/read_only"]
+
+[home_share]
+home_paths = ["Downloads"]
+'''
+
+
+class TestLaunchPlan(TestCase):
+    def setUp(self) -> None:
+        environ.setdefault('LANG', 'C.UTF-8')
+        self.dir = TemporaryDirectory()
+        self.dir_path = Path(self.dir.name)
+        self.home_path = self.dir_path / 'home'
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _build_plan(self, config_contents: str) -> LaunchPlan:
+        return LaunchPlan.from_services(
+            instance_config=ServiceContainer(
+                cast(ServicesConfDictType, toml_loads(config_contents))),
+            home_bind_path=self.home_path,
+        )
+
+    def _get_cache(self, config_contents: str) -> LaunchPlanCache:
+        return LaunchPlanCache(
+            instance_name='test',
+            home_bind_path=self.home_path,
+            config_contents=config_contents,
+            cache_dir=self.dir_path / 'cache',
+        )
+
+    def test_dict_round_trip(self) -> None:
+        plan = self._build_plan(TEST_CONFIG)
+        plan_dict = plan.to_dict()
+
+        self.assertEqual(plan.helper_args, ['--linger-timeout', '30'])
+
+        self.assertEqual(
+            LaunchPlan.from_dict(plan_dict).to_dict(),
+            plan_dict,
+        )
+
+    def test_cache_hit_and_miss(self) -> None:
+        plan = self._build_plan(TEST_CONFIG)
+        cache = self._get_cache(TEST_CONFIG)
+
+        with self.subTest('Empty cache'):
+            self.assertIsNone(cache.load())
+
+        cache.store(plan)
+
+        with self.subTest('Cache hit'):
+            cached_plan = cache.load()
+            self.assertIsNotNone(cached_plan)
+            assert cached_plan is not None
+
+            cached_dict = cached_plan.to_dict()
+            plan_dict = plan.to_dict()
+            # File contents might differ due to random hostname
+            for plan_step, cached_step in zip(
+                    plan_dict['bwrap_options'],
+                    cached_dict['bwrap_options']):
+                self.assertEqual(plan_step[:2], cached_step[:2])
+
+            plan_dict.pop('bwrap_options')
+            cached_dict.pop('bwrap_options')
+            self.assertEqual(plan_dict, cached_dict)
+
+        with self.subTest('Config changed'):
+            changed_config = TEST_CONFIG + '\n[network]\n'
+            self.assertIsNone(self._get_cache(changed_config).load())
+
+        with self.subTest('Host facts changed'):
+            old_display = environ.get('DISPLAY')
+            environ['DISPLAY'] = ':1234'
+            try:
+                self.assertIsNone(cache.load())
+            finally:
+                if old_display is None:
+                    environ.pop('DISPLAY')
+                else:
+                    environ['DISPLAY'] = old_display
+
+    def test_malformed_entry(self) -> None:
+        plan = self._build_plan(TEST_CONFIG)
+        cache = self._get_cache(TEST_CONFIG)
+        cache.store(plan)
+
+        entry = json_loads(cache.entry_path.read_text())
+        entry['plan']['bwrap_options'].append(['args', ['--bind', 1]])
+        cache.entry_path.write_text(json_dumps(entry))
+
+        self.assertIsNone(cache.load())
+
+    def test_volatile_files_regenerated(self) -> None:
+        plan = self._build_plan(TEST_CONFIG)
+        cache = self._get_cache(TEST_CONFIG)
+        cache.store(plan)
+
+        cached_plan = cache.load()
+        assert cached_plan is not None
+
+        def get_machine_id(plan: LaunchPlan) -> bytes:
+            for step in plan.bwrap_options:
+                if (isinstance(step, FileTransfer)
+                        and step.dest == '/etc/machine-id'):
+                    assert isinstance(step.content, bytes)
+                    return step.content
+
+            raise ValueError('No machine id in plan')
+
+        self.assertNotEqual(get_machine_id(plan), get_machine_id(cached_plan))
+
+
+if __name__ == '__main__':
+    unittest_main()
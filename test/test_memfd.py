@@ -0,0 +1,50 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from bubblejail.bubblejail_utils import copy_data_to_memfd, copy_file_to_memfd
+
+
+class TestMemfd(TestCase):
+    def test_data_copy(self) -> None:
+        test_data = b'user:x:1000:1000::/home/user:/bin/nologin'
+
+        with copy_data_to_memfd('passwd', test_data) as memfd:
+            self.assertEqual(memfd.read(), test_data)
+
+            with self.subTest('Memfd is sealed'):
+                with self.assertRaises(PermissionError):
+                    memfd.write(b'root')
+
+    def test_file_copy(self) -> None:
+        # Bigger than a single page to test copy loop
+        test_data = bytes(range(256)) * 1024
+
+        with TemporaryDirectory() as tempdir:
+            source_path = Path(tempdir) / 'source'
+            source_path.write_bytes(test_data)
+
+            with copy_file_to_memfd('source', source_path) as memfd:
+                self.assertEqual(memfd.read(), test_data)
+
+
+if __name__ == '__main__':
+    unittest_main()
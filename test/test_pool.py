@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from os import environ
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest import main as unittest_main
+
+from bubblejail.bubblejail_instance import BubblejailInstance
+from bubblejail.bubblejail_pool import PooledSandbox, SandboxPool
+
+
+class TestSandboxPool(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        self.dir_path = Path(self.dir.name)
+
+        instance_directory = self.dir_path / 'pool_test'
+        instance_directory.mkdir()
+        (instance_directory / 'services.toml').write_text('[x11]\n')
+        self.instance = BubblejailInstance(
+            instance_directory,
+            runtime_dir=self.dir_path / 'runtime/pool_test',
+        )
+
+        # Lazy refill does not start new sandboxes on claim
+        self.pool = SandboxPool(
+            instance=self.instance,
+            size=2,
+            refill_strategy='lazy',
+        )
+        for index in range(2):
+            sandbox = PooledSandbox(BubblejailInstance(
+                instance_directory,
+                runtime_dir=self.dir_path / f"sandbox-{index}",
+            ))
+            sandbox.executable_args = ['/usr/bin/true']
+            sandbox.launch_environ_vars = {'DISPLAY'}
+            sandbox.launch_digest = sandbox.get_launch_digest(
+                '[x11]\n', environ)
+            self.pool.sandboxes.append(sandbox)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_claim(self) -> None:
+        with self.subTest('No sandbox ready'):
+            self.assertIn('error', self.pool.claim())
+
+        first_sandbox, second_sandbox = self.pool.sandboxes
+        second_sandbox.is_ready = True
+
+        with self.subTest('Claim ready sandbox'):
+            response = self.pool.claim()
+            self.assertEqual(
+                response['result']['executable_args'], ['/usr/bin/true'])
+            self.assertTrue(second_sandbox.is_claimed)
+            self.assertEqual(
+                self.instance.runtime_dir.resolve(),
+                second_sandbox.instance.runtime_dir,
+            )
+
+        first_sandbox.is_ready = True
+
+        with self.subTest('Instance is running'):
+            self.assertIn('error', self.pool.claim())
+            self.assertFalse(first_sandbox.is_claimed)
+
+        with self.subTest('Claimed sandbox exits'):
+            self.pool.release_claim(second_sandbox)
+            self.assertFalse(self.instance.runtime_dir.is_symlink())
+
+            self.pool.release_claim(first_sandbox)
+            self.assertIn('result', self.pool.claim())
+
+    def test_claim_stale(self) -> None:
+        first_sandbox, second_sandbox = self.pool.sandboxes
+        first_sandbox.is_ready = True
+        second_sandbox.is_ready = True
+
+        with self.subTest('Changed host environment'):
+            client_environ = dict(environ)
+            client_environ['DISPLAY'] = ':99'
+            self.assertIn('error', self.pool.claim(client_environ))
+            self.assertTrue(first_sandbox.is_stale)
+            self.assertTrue(second_sandbox.is_stale)
+            self.assertFalse(self.instance.runtime_dir.is_symlink())
+
+        second_sandbox.is_stale = False
+
+        with self.subTest('Edited configuration'):
+            self.instance.path_config_file.write_text('')
+            self.assertIn('error', self.pool.claim())
+            self.assertTrue(second_sandbox.is_stale)
+            self.assertFalse(second_sandbox.is_claimed)
+
+        second_sandbox.is_stale = False
+
+        with self.subTest('Same configuration and host'):
+            self.instance.path_config_file.write_text('[x11]\n')
+            self.assertIn('result', self.pool.claim(dict(environ)))
+            self.assertTrue(second_sandbox.is_claimed)
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -15,13 +15,28 @@
 # along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from os import stat, utime
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest import main as unittest_main
+from unittest.mock import patch
 
 
 from bubblejail.bubblejail_instance import BubblejailProfile
-from toml import load
+from bubblejail.config_cache import _memory_cache
+from bubblejail.exceptions import BubblejailException
+from bubblejail.profile_catalog import ProfileCatalog
+from toml import TomlDecodeError, load
+
+NOT_LOADED = 'bubblejail.profile_catalog.load_toml'
+
+
+def age_path(path: Path) -> None:
+    """Recently modified directories are not trusted by catalog"""
+    path_stat = stat(path)
+    utime(path, ns=(path_stat.st_atime_ns,
+                    path_stat.st_mtime_ns - 10 * 10**9))
 
 
 class TestProfiles(TestCase):
@@ -31,5 +46,108 @@ class TestProfiles(TestCase):
                 BubblejailProfile(**load(profile_path))
 
 
+class TestProfileCatalog(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        temp_path = Path(self.dir.name)
+
+        self.user_profiles = temp_path / 'user/profiles'
+        self.system_profiles = temp_path / 'system/profiles'
+        self.applications = temp_path / 'applications'
+        for directory in (self.user_profiles, self.system_profiles,
+                          self.applications):
+            directory.mkdir(parents=True)
+
+        (self.system_profiles / 'app.toml').write_text(
+            f"dot_desktop_path = \"{self.applications}/app.desktop\"\n"
+            'description = "System profile"\n'
+            'import_tips = "Import app"\n'
+            '[services.x11]\n'
+        )
+        (self.system_profiles / 'empty.toml').write_text('')
+        (self.system_profiles / 'README').write_text('Not a profile')
+
+        self.catalog = ProfileCatalog(
+            (self.user_profiles, self.system_profiles))
+
+    def tearDown(self) -> None:
+        _memory_cache.clear()
+        self.dir.cleanup()
+
+    def age_directories(self) -> None:
+        for directory in (self.user_profiles, self.system_profiles,
+                          self.applications):
+            age_path(directory)
+
+    def test_records(self) -> None:
+        self.assertEqual(self.catalog.names(), ['app', 'empty'])
+
+        app_record = self.catalog.record('app')
+        self.assertEqual(app_record.description, 'System profile')
+        self.assertEqual(app_record.import_tips, 'Import app')
+        self.assertEqual(app_record.dot_desktop_path,
+                         self.applications / 'app.desktop')
+        self.assertFalse(app_record.dot_desktop_exists)
+
+        empty_record = self.catalog.record('empty')
+        self.assertEqual(empty_record.description, 'No description')
+        self.assertIsNone(empty_record.dot_desktop_path)
+
+        app_profile = self.catalog.profile_get('app')
+        self.assertEqual(app_profile.description, 'System profile')
+        self.assertIn('x11', app_profile.config.get_service_conf_dict())
+
+        with self.assertRaises(BubblejailException):
+            self.catalog.record('README')
+
+        with self.subTest('User profile takes precedence'):
+            (self.user_profiles / 'app.toml').write_text(
+                'description = "User profile"\n')
+            self.assertEqual(self.catalog.record('app').description,
+                             'User profile')
+            self.assertEqual(self.catalog.names(), ['app', 'empty'])
+
+        with self.subTest('Broken profile'):
+            (self.user_profiles / 'broken.toml').write_text('[')
+            self.assertEqual(self.catalog.names(),
+                             ['app', 'broken', 'empty'])
+            with self.assertRaises(TomlDecodeError):
+                self.catalog.record('broken')
+
+    def test_invalidation(self) -> None:
+        self.age_directories()
+        self.assertFalse(self.catalog.record('app').dot_desktop_exists)
+
+        with self.subTest('Unchanged directories are not loaded'):
+            with patch(NOT_LOADED, side_effect=AssertionError):
+                self.assertEqual(self.catalog.names(), ['app', 'empty'])
+                self.catalog.record('app')
+
+        with self.subTest('Application installed'):
+            (self.applications / 'app.desktop').touch()
+            self.assertTrue(self.catalog.record('app').dot_desktop_exists)
+
+        with self.subTest('Profile added'):
+            self.age_directories()
+            (self.user_profiles / 'new.toml').touch()
+            self.assertEqual(self.catalog.names(), ['app', 'empty', 'new'])
+
+        with self.subTest('Profile removed'):
+            self.age_directories()
+            (self.system_profiles / 'empty.toml').unlink()
+            self.assertEqual(self.catalog.names(), ['app', 'new'])
+
+    def test_missing_directories(self) -> None:
+        missing_profiles = Path(self.dir.name) / 'missing/profiles'
+        catalog = ProfileCatalog((missing_profiles, self.system_profiles))
+
+        self.assertEqual(catalog.names(), ['app', 'empty'])
+        self.assertFalse(missing_profiles.parent.exists())
+
+        missing_profiles.mkdir(parents=True)
+        (missing_profiles / 'new.toml').touch()
+        self.assertEqual(catalog.names(), ['app', 'empty', 'new'])
+
+
 if __name__ == '__main__':
     unittest_main()
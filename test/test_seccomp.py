@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Copyright 2019, 2020 igo95862
+
+# This file is part of bubblejail.
+# bubblejail is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# bubblejail is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with bubblejail.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest import main as unittest_main
+from unittest.mock import patch
+
+from bubblejail.bubblejail_seccomp import (LIBRARY_PATH_FILE_NAME,
+                                           SECCOMP_OPTIMIZE_BINARY_TREE,
+                                           SECCOMP_OPTIMIZE_PRIORITY,
+                                           SeccompState, get_libseccomp)
+from bubblejail.bwrap_config import SeccompSyscallErrno
+
+
+class TestSeccompCache(TestCase):
+    def setUp(self) -> None:
+        self.dir = TemporaryDirectory()
+        self.cache_dir = Path(self.dir.name)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _create_state(self, *syscall_names: str) -> SeccompState:
+        seccomp_state = SeccompState(cache_dir=self.cache_dir)
+        for syscall_name in syscall_names:
+            seccomp_state.add_directive(SeccompSyscallErrno(syscall_name, 0))
+
+        return seccomp_state
+
+    def test_cache(self) -> None:
+        with self._create_state('sync', 'fsync').export_to_memfd() as memfd:
+            compiled_bpf = memfd.read()
+
+        self.assertTrue(compiled_bpf)
+        self.assertEqual(len(list(self.cache_dir.glob('*.bpf'))), 1)
+
+        with self.subTest('Same rules in different order share blob'):
+            other_state = self._create_state('fsync', 'sync')
+            with other_state.export_to_memfd() as memfd:
+                self.assertEqual(memfd.read(), compiled_bpf)
+
+            self.assertEqual(len(list(self.cache_dir.glob('*.bpf'))), 1)
+
+        with self.subTest('Different rules'):
+            with self._create_state('sync').export_to_memfd() as memfd:
+                self.assertNotEqual(memfd.read(), compiled_bpf)
+
+            self.assertEqual(len(list(self.cache_dir.glob('*.bpf'))), 2)
+
+        with self.subTest('Cache hit does not load library'):
+            with patch('bubblejail.bubblejail_seccomp.get_libseccomp',
+                       wraps=get_libseccomp) as get_libseccomp_mock:
+                with self._create_state('sync').export_to_memfd():
+                    ...
+
+            get_libseccomp_mock.assert_not_called()
+
+    def test_library_in_digest(self) -> None:
+        seccomp_state = self._create_state('sync')
+        seccomp_state.get_digest()
+
+        with self.subTest('Loaded library path is remembered'):
+            self.assertEqual(
+                (self.cache_dir / LIBRARY_PATH_FILE_NAME).read_text(),
+                get_libseccomp().library_path,
+            )
+
+        with self.subTest('Upgraded library'):
+            library_path = self.cache_dir / 'libseccomp.so.2'
+            library_path.write_bytes(b'old')
+            (self.cache_dir / LIBRARY_PATH_FILE_NAME).write_text(
+                str(library_path))
+            digest = seccomp_state.get_digest()
+
+            library_path.unlink()
+            library_path.write_bytes(b'new version')
+            self.assertNotEqual(seccomp_state.get_digest(), digest)
+
+    def test_optimize_level(self) -> None:
+        seccomp_state = self._create_state('sync')
+        if get_libseccomp().version >= (2, 5, 0):
+            self.assertEqual(seccomp_state.get_applied_optimize_level(),
+                             SECCOMP_OPTIMIZE_BINARY_TREE)
+
+        with self.subTest('Rejected level'):
+            seccomp_state.optimize_level = 99
+            with self.assertWarns(RuntimeWarning):
+                self.assertEqual(seccomp_state.get_applied_optimize_level(),
+                                 SECCOMP_OPTIMIZE_PRIORITY)
+
+    def test_ruleset_released(self) -> None:
+        libseccomp = get_libseccomp()
+        with patch.object(libseccomp, 'seccomp_release',
+                          wraps=libseccomp.seccomp_release) as release_mock:
+            with self._create_state('sync').export_to_memfd():
+                ...
+
+            self.assertEqual(release_mock.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest_main()